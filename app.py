@@ -1,5 +1,25 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, request, make_response, g
+import bisect
+import contextlib
+import functools
 import json
+import os
+import uuid
+
+from edit_journal import EditJournal, changes_ops, document_changes
+from graph_layout import layered_layout
+from graph_records import Node, Edge, frozen
+from graph_store import GraphStore
+from instrumentation import metrics, stage, timed, RequestProfiler
+from schema_index import SchemaIndex
+from schema_library import SchemaLibrary
+from schema_patch import SchemaPatch, diff_json, graph_patch, diff_graphs
+from schema_cache import SchemaCache, CachedSchema, content_key
+from schema_diff import diff_schemas
+from schema_stream import UploadReader, parse_schema, decompress, DECODE_ERRORS
+from schema_validator import SchemaValidator, SchemaValidationError, parse_error_report
+from serialization import dumps, loads, json_response, compress_response
+from workspace import Workspace, WorkspaceManager, WorkspaceLimitError
 
 # ===============================================
 # app.py
@@ -9,19 +29,33 @@ import json
 
 app = Flask(__name__, static_folder='./static', template_folder='./static')
 
-nodes = {}
-edges = []
-schema_json = {}
-
-# SDF version 3.0
-schema_key_dict = {
-    'event': ['@id', 'name', 'comment', 'description', 'aka', 'qnode', 'qlabel', 'isSchema', 'goal', 'ta1explanation', 'importance', 'children_gate', 'instanceOf', 'probParent', 'probChild', 'probability', 'liklihood', 'wd_node', 'wd_label', 'wd_description', 'modality', 'participants', 'privateData', 'outlinks', 'entities', 'relations', 'children', 'optional', 'repeatable'],
-    'children': ['child', 'comment', 'optional', 'importance', 'outlinks'],
-    'privateData': ['@type', 'template', 'repeatable', 'importance'],
-    'entity': ['name', '@id', 'qnode', 'qlabel', 'centrality', 'wd_node', 'wd_label', 'wd_description', 'modality', 'aka','properties'],
-    'properties': ['property values'],
-    'relation': ['name', 'wd_node', 'wd_label', 'modality', 'wd_description', 'ta1ref', 'relationSubject', 'relationObject', 'relationPredicate']
-}
+# parsed uploads shared between workspaces and repeated loads
+schema_cache = SchemaCache(int(os.environ.get('SCHEMA_CACHE_BYTES', 64 * 1024 * 1024)))
+# uploads larger than this are parsed while they are read instead of being read whole
+STREAM_UPLOAD_BYTES = int(os.environ.get('SCHEMA_STREAM_BYTES', 8 * 1024 * 1024))
+# uploads larger than this once decompressed are refused
+MAX_SCHEMA_BYTES = int(os.environ.get('SCHEMA_MAX_BYTES', 512 * 1024 * 1024))
+# checks uploads before their graph is built, compiled once
+validator = SchemaValidator()
+
+# requests slower than SCHEMA_PROFILE_SECONDS are profiled to SCHEMA_PROFILE_DIR, timings are kept with SCHEMA_METRICS=1
+profiler = RequestProfiler(float(os.environ.get('SCHEMA_PROFILE_SECONDS', 0)), os.environ.get('SCHEMA_PROFILE_DIR', 'profiles'))
+# edits are journaled to the SQLite file SCHEMA_JOURNAL, to restore workspaces after a restart and to undo edits;
+# each workspace keeps its last SCHEMA_JOURNAL_KEEP entries
+journal = EditJournal(os.environ['SCHEMA_JOURNAL'], int(os.environ.get('SCHEMA_SNAPSHOT_EVERY', 50)),
+                      int(os.environ.get('SCHEMA_JOURNAL_KEEP', 1000))) \
+    if os.environ.get('SCHEMA_JOURNAL') else None
+# schema state per curator session, see with_workspace; without the journal, workspaces holding a document are never evicted
+workspaces = WorkspaceManager(int(os.environ.get('SCHEMA_MAX_WORKSPACES', 32)), schema_cache, journal is not None)
+WORKSPACE_COOKIE = 'workspace'
+
+# uploads are stored in the directory SCHEMA_LIBRARY to be reopened without uploading them again, see /library;
+# open schemas are closed once their headers take more than SCHEMA_LIBRARY_BYTES
+library = SchemaLibrary(os.environ['SCHEMA_LIBRARY'], int(os.environ.get('SCHEMA_LIBRARY_BYTES', 64 * 1024 * 1024))) \
+    if os.environ.get('SCHEMA_LIBRARY') else None
+
+# placeholder entity for participants without one
+DUMMY_ENTITY = 'Entities/20000/'
 
 def create_node(_id, _label, _type, _shape=''):
     """Creates a node.
@@ -33,15 +67,7 @@ def create_node(_id, _label, _type, _shape=''):
     _shape (str): shape as visualized in graph
     
     """
-    return {
-        'data': {
-            'id': _id,
-            '_label': _label if _label else _id,
-            '_type': _type,
-            '_shape': _shape
-        },
-        'classes': ''
-    }
+    return Node(_id, _label if _label else _id, _type, _shape)
 
 def create_edge(_source, _target, _label='', _edge_type=''):
     """Creates an edge whose id is "source_target".
@@ -53,38 +79,22 @@ def create_edge(_source, _target, _label='', _edge_type=''):
     _edge_type (str): type of edge, influences shape on graph
     
     """
-    return {
-        'data': {
-            'id': f"{_source}__{_target}",
-            '_label': f"\n\u2060{_label}\n\u2060",
-            'name': _label,
-            'source': _source,
-            'target': _target,
-            '_edge_type': _edge_type
-        },
-        'classes': ''
-    }
+    return Edge(_source, _target, _label, _edge_type)
 
 def extend_node(node, obj):
     """Adds values to the node according to the node type.
 
+    The values are taken from obj when the node is serialized, see Node.to_dict.
+
     Parameters:
-    node (dict): node to extend
+    node (Node): node to extend
     obj (dict): schema with data on the node
     
     Returns:
-    node (dict): extended node
+    node (Node): extended node
     """
-
-    for key in obj.keys():
-        if key in schema_key_dict[node['data']['_type']]:
-            if key == 'optional' and obj[key]:
-                node['classes'] = 'optional'
-            node['data'][key] = obj[key]
-    if 'privateData' in obj.keys() and len(obj['privateData']) > 0:
-        for key in obj['privateData'].keys():
-            if key in schema_key_dict['privateData']:
-                node['data'][key] = obj['privateData'][key]
+    node.kind = node.type
+    node.source = obj
     # print("\nnode from extend_node:", node)
     return node
 
@@ -102,10 +112,6 @@ def get_entities(entities):
         _label = entity['name']
         entity_id = entity['@id']
         nodes[entity_id] = extend_node(create_node(entity_id, _label, 'entity'), entity)
-        
-    # if entities is empty, add a dummy node
-    if len(nodes) == 0:
-        nodes['Entities/20000/'] = create_node('Entities/20000/', 'Entity', 'entity')
 
     # print("\nnodes from get_entities:", nodes)
     return nodes
@@ -127,61 +133,402 @@ def get_relations(relations):
                            _target = relation['relationObject'],
                            _label = relation['name'],
                            _edge_type = 'relation')
-        edge['data']['@id'] = relation['@id']
-        edge['data']['predicate'] = relation.get('relationPredicate', relation.get('wd_node', ''))
+        edge.element_id = relation['@id']
+        edge.predicate = frozen(relation.get('relationPredicate', relation.get('wd_node', '')))
         edges.append(edge)
 
     # print("\nedges from get_relations:", edges)
     return edges
 
-def handle_containers(nodes, edges, containers):
+def is_repeatable(event):
+    """Returns whether an event is repeatable, privateData taking precedence as in extend_node."""
+    private_data = event.get('privateData') or {}
+    if 'repeatable' in private_data:
+        return bool(private_data['repeatable'])
+    return bool(event.get('repeatable'))
+
+def link_edge(graph, edge, touched):
+    """Adds an edge to the graph, or to the record of the spliced container it touches.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    edge (Edge): edge to add
+    touched (set): collects ids of nodes whose edges changed
+    """
+    source = edge.source
+    target = edge.target
+    if source in graph.containers or target in graph.containers:
+        # self loops of containers are kept aside and never visualized
+        if source == target:
+            graph.containers[source]['loops'].append(edge)
+            return
+        # between two containers, the one spliced first when building the graph takes the edge
+        if source in graph.containers and (target not in graph.containers or graph.order[source] < graph.order[target]):
+            container, side = source, 'out'
+        else:
+            container, side = target, 'in'
+        graph.containers[container][side].append(edge)
+        splice_container(graph, container, touched)
+    else:
+        graph.add_edge(edge)
+        touched.add(source)
+        touched.add(target)
+
+def unlink_edge(graph, edge, touched):
+    """Removes an edge from the graph, or from the record of the spliced container holding it.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    edge (Edge): edge previously passed to link_edge
+    touched (set): collects ids of nodes whose edges changed
+    """
+    source = edge.source
+    target = edge.target
+    if graph.has_edge(edge):
+        graph.remove_edge(edge)
+        touched.add(source)
+        touched.add(target)
+        return
+    for container, side in ((source, 'out'), (target, 'in'), (source, 'loops')):
+        record = graph.containers.get(container)
+        if record is None:
+            continue
+        for index, recorded in enumerate(record[side]):
+            if recorded is edge:
+                del record[side][index]
+                if side != 'loops':
+                    splice_container(graph, container, touched)
+                return
+
+def splice_container(graph, container, touched):
+    """Connects incoming and outgoing edges of a container and removes it from the graph.
+
+    The first call moves the container's edges into graph.containers. Later calls
+    replace the edges spliced from that record after one of its edges changed.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    container (str): @id of the container event
+    touched (set): collects ids of nodes whose edges changed
+    """
+    if container in graph.splicing:
+        return
+    graph.splicing.add(container)
+    record = graph.containers.get(container)
+    if record is None:
+        record = {'in': [], 'out': [], 'loops': [], 'spliced': []}
+        graph.containers[container] = record
+        # detach all edges connected to the container
+        for edge in graph.in_edges(container):
+            graph.remove_edge(edge)
+            touched.add(edge.source)
+            if edge.source == container:
+                record['loops'].append(edge)
+            else:
+                record['in'].append(edge)
+        for edge in graph.out_edges(container):
+            graph.remove_edge(edge)
+            touched.add(edge.target)
+            record['out'].append(edge)
+        graph.nodes.pop(container, None)
+        touched.add(container)
+    else:
+        for edge in record['spliced']:
+            graph.spliced_by.pop(id(edge), None)
+            unlink_edge(graph, edge, touched)
+
+    # the parent and first outlink are picked by position, so edges linked again by an edit
+    # are put back in the order building the graph gives them
+    def document_order(edge):
+        producer = graph.spliced_by.get(id(edge))
+        if producer is None:
+            return 0, graph.order.get(edge.source, -1)
+        return 1, graph.order.get(producer, -1)
+
+    record['in'].sort(key=document_order)
+    record['out'].sort(key=document_order)
+    in_edges = []
+    out_edges = []
+    parent_edge = ['', '']
+    for edge in record['in']:
+        if edge.type == 'step_child':
+            parent_edge[0] = edge.source
+        else:
+            in_edges.append(edge.source)
+    for edge in record['out']:
+        if edge.type == 'step_child':
+            parent_edge[1] = edge.target
+        out_edges.append(edge.target)
+
+    spliced = []
+    # add hierarchical edge
+    if parent_edge[0] != '' and parent_edge[1] != '':
+        spliced.append(create_edge(parent_edge[0], parent_edge[1], _edge_type='step_child'))
+    # attach other edges
+    if len(in_edges) == 1:
+        for out in out_edges:
+            spliced.append(create_edge(in_edges[0], out, _edge_type='child_outlink'))
+    elif out_edges:
+        for edge in in_edges:
+            spliced.append(create_edge(edge, out_edges[0], _edge_type='child_outlink'))
+    record['spliced'] = spliced
+    for edge in spliced:
+        graph.spliced_by[id(edge)] = container
+        link_edge(graph, edge, touched)
+    graph.splicing.discard(container)
+
+def unsplice_container(graph, container, touched):
+    """Puts the recorded edges of a spliced container back into the graph."""
+    record = graph.containers.pop(container)
+    for edge in record['spliced']:
+        graph.spliced_by.pop(id(edge), None)
+        unlink_edge(graph, edge, touched)
+    for edge in record['in'] + record['out'] + record['loops']:
+        link_edge(graph, edge, touched)
+
+@timed('handle_containers')
+def handle_containers(graph, containers):
     """Connects incoming and outgoing edges and removes all unvisualized nodes and edges.
-    
+
     Parameters:
-    nodes (dict): nodes in the schema
-    edges (list): edges in the schema
+    graph (GraphStore): indexed nodes and edges of the schema
     containers (list): list of containers to be processed and removed
 
     Returns:
-    nodes (dict): nodes in the schema
-    edges (list): edges in the schema
+    graph (GraphStore): nodes and edges of the schema without containers
     """
-    edges_to_remove = []
+    touched = set()
     for container in containers:
-        in_edges = []
-        out_edges = []
-        parent_edge = ['', '']
-        # find all edges connected to the container
-        for edge in edges:
-            if edge['data']['target'] == container:
-                if edge['data']['_edge_type'] == 'step_child':
-                    parent_edge[0] = edge['data']['source']
-                else:
-                    in_edges.append(edge['data']['source'])
-                edges_to_remove.append(edge)
-            if edge['data']['source'] == container:
-                if edge['data']['_edge_type'] == 'step_child':
-                    parent_edge[1] = edge['data']['target']
-                out_edges.append(edge['data']['target'])
-                edges_to_remove.append(edge)
-        # add hierarchical edge
-        if parent_edge[0] != '' and parent_edge[1] != '':
-            edges.append(create_edge(parent_edge[0], parent_edge[1], _edge_type='step_child'))
-        # attach other edges
-        if len(in_edges) == 1:
-            for out in out_edges:
-                edges.append(create_edge(in_edges[0], out, _edge_type='child_outlink'))
-        else:
-            for edge in in_edges:
-                edges.append(create_edge(edge, out_edges[0], _edge_type='child_outlink'))
-        nodes.pop(container)
+        splice_container(graph, container, touched)
 
-    for index in edges_to_remove:
-        edges.remove(index)
-    
-    # print("\nnodes from handle_containers:", nodes)
-    # print("\nedges from handle_containers:", edges)
-    return nodes, edges
+    # print("\nnodes from handle_containers:", graph.nodes)
+    # print("\nedges from handle_containers:", graph.edges)
+    return graph
+
+def update_roots(graph, node_ids):
+    """Marks nodes with outgoing but no incoming edges as root, and unmarks former roots.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    node_ids (iterable): ids of the nodes to check
+    """
+    for node_id in node_ids:
+        node = graph.nodes.get(node_id)
+        if node is None:
+            continue
+        is_root = graph.has_out_edges(node_id) and not graph.has_in_edges(node_id)
+        if node.type == 'root':
+            if not is_root:
+                node.type = graph.root_prior.pop(node_id, 'parent')
+        elif is_root and node.type != 'entity':
+            graph.root_prior[node_id] = node.type
+            node.type = 'root'
+
+def retain_node(graph, node_id, referrer, create, touched):
+    """Counts a reference from an event to a node, creating the node with create() if needed.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    node_id (str): id of the referenced node
+    referrer (str): @id of the event holding the reference
+    create (function): returns the node when it does not exist yet
+    touched (set): collects ids of nodes that were created
+    """
+    if node_id not in graph.nodes and node_id not in graph.containers:
+        graph.nodes[node_id] = create()
+        touched.add(node_id)
+    referrers = graph.refs.setdefault(node_id, {})
+    referrers[referrer] = referrers.get(referrer, 0) + 1
+
+def release_node(graph, node_id, referrer, touched):
+    """Drops a reference from an event to a node, removing the node once nothing refers to it."""
+    touched.add(node_id)
+    referrers = graph.refs[node_id]
+    referrers[referrer] -= 1
+    if referrers[referrer] == 0:
+        del referrers[referrer]
+    if referrers:
+        return
+    del graph.refs[node_id]
+    if node_id in graph.containers:
+        unsplice_container(graph, node_id, touched)
+    graph.nodes.pop(node_id, None)
+    graph.root_prior.pop(node_id, None)
+
+def is_container(graph, event_id):
+    """Returns whether an event is shown as a container.
+
+    As when building the graph, an event is a container if it has children, its name
+    mentions outlinks and an event listed before it already refers to it.
+    """
+    event = graph.contributions[event_id]['event']
+    if 'children' not in event or 'outlinks' not in event['name'].lower():
+        return False
+    position = graph.order[event_id]
+    return any(graph.order[referrer] < position
+               for referrer in graph.refs.get(event_id, {}) if referrer != event_id)
+
+def sync_dummy_entity(graph, touched):
+    """Keeps the dummy entity node only while the schema defines no entities."""
+    if not graph.entity_refs:
+        if DUMMY_ENTITY not in graph.nodes:
+            graph.nodes[DUMMY_ENTITY] = create_node(DUMMY_ENTITY, 'Entity', 'entity')
+            touched.add(DUMMY_ENTITY)
+    elif DUMMY_ENTITY not in graph.entity_refs and DUMMY_ENTITY in graph.nodes \
+            and graph.nodes[DUMMY_ENTITY].type == 'entity':
+        graph.nodes.pop(DUMMY_ENTITY)
+        touched.add(DUMMY_ENTITY)
+
+def link_entities(graph, event, touched):
+    """Creates the entity nodes defined in an event.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    event (dict): event whose entities are added
+    touched (set): collects ids of nodes that were created
+    """
+    contribution = graph.contributions.setdefault(event['@id'], {'entities': [], 'refs': [], 'edges': []})
+    contribution['event'] = event
+    for entity_id, node in get_entities(event.get('entities', [])).items():
+        existing = graph.nodes.get(entity_id)
+        if existing is None or existing.type == 'entity':
+            graph.nodes[entity_id] = node
+            touched.add(entity_id)
+        graph.entity_refs[entity_id] = graph.entity_refs.get(entity_id, 0) + 1
+        contribution['entities'].append(entity_id)
+
+def link_relations(graph, event, touched):
+    """Creates the relation edges defined in an event.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    event (dict): event whose relations are added
+    touched (set): collects ids of nodes whose edges changed
+    """
+    contribution = graph.contributions[event['@id']]
+    for edge in get_relations(event.get('relations', [])):
+        contribution['edges'].append(edge)
+        link_edge(graph, edge, touched)
+
+def create_event_node(event):
+    """Creates the node of an event, a leaf if it has no children."""
+    _label = event['name'].split('/')[-1].replace('_', ' ').replace('-', ' ')
+    node = extend_node(create_node(event['@id'], _label, 'event', 'diamond'), event)
+    if 'children' in event:
+        node.type = 'parent'
+    else:
+        # not hierarchical node, change node type to a leaf
+        node.type = 'child'
+        node.shape = 'ellipse'
+    return node
+
+def link_event_node(graph, event, touched, order=None):
+    """Creates the node of a new event.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    event (dict): event to add
+    touched (set): collects ids of nodes that were created
+    order (float): place of the event in graph.order, after all events by default
+
+    Returns:
+    bool: whether the event is a container that has to be spliced
+    """
+    event_id = event['@id']
+    node = create_event_node(event)
+    # an event that was already referenced and only links other events is a container
+    is_container = event_id in graph.nodes and 'children' in event \
+        and 'outlinks' in event['name'].lower()
+    if is_container:
+        node.type = 'container'
+    graph.nodes[event_id] = node
+    graph.root_prior.pop(event_id, None)
+    graph.order[event_id] = next(graph.sequence) if order is None else order
+    retain_node(graph, event_id, event_id, lambda: node, touched)
+    return is_container
+
+def link_event_edges(graph, event, touched):
+    """Creates the participant, children and outlink edges of an event.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    event (dict): event whose edges are added
+    touched (set): collects ids of nodes whose edges changed
+    """
+    event_id = event['@id']
+    contribution = graph.contributions[event_id]
+
+    def add(edge):
+        contribution['edges'].append(edge)
+        link_edge(graph, edge, touched)
+
+    def reference(node_id, create):
+        retain_node(graph, node_id, event_id, create, touched)
+        contribution['refs'].append(node_id)
+
+    # handle repeatable
+    if is_repeatable(event):
+        add(create_edge(event_id, event_id, _edge_type='child_outlink'))
+
+    # link participants to entities
+    if 'participants' in event:
+        for participant in event['participants']:
+            _label = participant['roleName']
+            entity_id = participant['entity']
+            if entity_id == '':
+                entity_id = DUMMY_ENTITY
+            edge = create_edge(event_id, entity_id, _label, _edge_type='step_participant')
+            edge.element_id = participant['@id']
+            add(edge)
+
+    # children
+    if 'children' in event:
+        gate = 'or'
+        if event['children_gate'] == 'xor':
+            gate = 'xor'
+            xor_id = f'{event_id}xor'
+            reference(xor_id, lambda: create_node(xor_id, 'XOR', 'gate', 'rectangle'))
+        elif event['children_gate'] == 'and':
+            gate = 'and'
+
+        for child_id in event['children']:
+            reference(child_id, lambda: create_node(child_id, child_id, 'child', 'ellipse'))
+
+            # handle xor gate or just add edges
+            if gate == 'xor':
+                add(create_edge(xor_id, child_id, _edge_type='child_outlink'))
+                add(create_edge(event_id, xor_id, _edge_type='step_child'))
+            else:
+                add(create_edge(event_id, child_id, _edge_type='child_outlink' if gate == 'and' else 'step_child'))
+
+    # add outlinks
+    if event['outlinks']:
+        for outlink in event['outlinks']:
+            _label = outlink.split('/')[-1].replace('_', '')
+            reference(outlink, lambda: create_node(outlink, _label, 'child', 'ellipse'))
+            add(create_edge(event_id, outlink, _edge_type='child_outlink'))
+
+def unlink_event(graph, event_id, touched):
+    """Removes everything an event contributed to the graph except its own node.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    event_id (str): @id of the event
+    touched (set): collects ids of nodes whose edges changed
+    """
+    contribution = graph.contributions[event_id]
+    for edge in contribution['edges']:
+        unlink_edge(graph, edge, touched)
+    for node_id in contribution['refs']:
+        release_node(graph, node_id, event_id, touched)
+    for entity_id in contribution['entities']:
+        graph.entity_refs[entity_id] -= 1
+        if graph.entity_refs[entity_id] == 0:
+            del graph.entity_refs[entity_id]
+            if entity_id in graph.nodes and graph.nodes[entity_id].type == 'entity':
+                del graph.nodes[entity_id]
+                touched.add(entity_id)
+    contribution.update({'entities': [], 'refs': [], 'edges': []})
 
 def get_nodes_and_edges(schema_json):
     """Creates lists of nodes and edges through the schema event ontology.
@@ -193,119 +540,689 @@ def get_nodes_and_edges(schema_json):
     nodes (dict): nodes in the schema
     edges (list): edges in the schema
     """
-    # Iterate through all events. Inside every event, check if there is 'entities', or 'relations' value. If there is, append to entity or relations list
-    entity = []
-    relations = []
+    graph = build_graph(schema_json)
+    return graph.nodes, graph.edges
 
-    for event in schema_json['events']:
-        if 'entities' in event.keys():
-            entity.extend(event['entities'])
-        if 'relations' in event.keys():
-            relations.extend(event['relations'])
+@timed('build_graph')
+def build_graph(schema_json):
+    """Creates the indexed graph of the schema through the schema event ontology.
 
+    Parameters:
+    schemaJson (dict): entire schema in json form
 
-    # get entities and relations
-    nodes = get_entities(entity)
-    edges = get_relations(relations)
+    Returns:
+    graph (GraphStore): nodes and edges in the schema
+    """
+    graph = GraphStore()
+    touched = set()
+    events = schema_json['events']
+
+    # get entities and relations of all events
+    for event in events:
+        link_entities(graph, event, touched)
+    sync_dummy_entity(graph, touched)
+    for event in events:
+        link_relations(graph, event, touched)
 
     # get events and attach entities to them
     containers_to_remove = []
-    events = schema_json['events']
+    for event in events:
+        if link_event_node(graph, event, touched):
+            containers_to_remove.append(event['@id'])
+        link_event_edges(graph, event, touched)
+
+    handle_containers(graph, containers_to_remove)
+
+    # find root node(s)
+    update_roots(graph, graph.sources())
+
+    # the entity-first view, with groups of events around entities in clusters, is built by get_entity_view
+        # Q: are we able to make a tab on the viewer itself to switch between views?
+
+    return graph
+
+@timed('update_graph')
+def update_graph(graph, events, removed=(), order=None):
+    """Applies edits of a few events to an existing graph instead of rebuilding it.
+
+    Only the nodes and edges contributed by the given events are replaced, container
+    splicing is redone for the containers they touch and root status is rechecked
+    for the nodes whose edges changed.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    events (list): new or edited events, as they now are in the schema
+    removed (list): @ids of events deleted from the schema
+    order (dict): {@id: place in graph.order} of new events that are not last in the schema, see insert_order
+
+    Returns:
+    graph (GraphStore): the updated graph
+    """
+    touched = set()
+    for event_id in removed:
+        if event_id not in graph.contributions:
+            continue
+        unlink_event(graph, event_id, touched)
+        del graph.contributions[event_id]
+        if event_id in graph.containers:
+            unsplice_container(graph, event_id, touched)
+        # events that still refer to it keep a placeholder node
+        graph.nodes[event_id] = create_node(event_id, event_id, 'child', 'ellipse')
+        graph.root_prior.pop(event_id, None)
+        release_node(graph, event_id, event_id, touched)
+        del graph.order[event_id]
 
     for event in events:
-        # if node already exists, add information
-        _label = event['name'].split('/')[-1].replace('_', ' ').replace('-', ' ')
         event_id = event['@id']
-        if event_id in nodes:
-            nodes[event_id]['data']['_type'] = 'event'
-            nodes[event_id]['data']['_label'] = _label
-            nodes[event_id] = extend_node(nodes[event_id], event)
-            if 'children' not in event:
-                nodes[event_id]['data']['_type'] = 'child'
-            elif 'outlinks' in nodes[event_id]['data']['name'].lower():
-                nodes[event_id]['data']['_type'] = 'container'
-                containers_to_remove.append(event_id)
-            else:
-                nodes[event_id]['data']['_type'] = 'parent'
-                nodes[event_id]['data']['_shape'] = 'diamond'
+        touched.add(event_id)
+        if event_id in graph.contributions:
+            unlink_event(graph, event_id, touched)
+            link_entities(graph, event, touched)
+            link_relations(graph, event, touched)
+            if event_id not in graph.containers:
+                graph.nodes[event_id] = create_event_node(event)
+                graph.root_prior.pop(event_id, None)
         else:
-            nodes[event_id] = extend_node(create_node(event_id, _label, 'event', 'diamond'), event)
-            nodes[event_id]['data']['_type'] = 'parent'
+            link_entities(graph, event, touched)
+            link_relations(graph, event, touched)
+            link_event_node(graph, event, touched, order.get(event_id) if order else None)
+        link_event_edges(graph, event, touched)
+
+    # splice or restore events whose container status changed
+    for event_id in list(touched):
+        if event_id not in graph.contributions:
+            continue
+        if is_container(graph, event_id):
+            if event_id not in graph.containers:
+                graph.nodes[event_id].type = 'container'
+                splice_container(graph, event_id, touched)
+        elif event_id in graph.containers:
+            unsplice_container(graph, event_id, touched)
+            graph.nodes[event_id] = create_event_node(graph.contributions[event_id]['event'])
+            graph.root_prior.pop(event_id, None)
+
+    sync_dummy_entity(graph, touched)
+    update_roots(graph, touched)
+    graph.note_nodes(touched)
+    return graph
+
+def get_workspace_id():
+    """Returns the workspace id of the request, or None for a new session.
+
+    The id is taken from the ?workspace= argument, the X-Workspace-Id header
+    or the workspace cookie, in that order.
+    """
+    return (request.args.get('workspace') or request.headers.get('X-Workspace-Id')
+            or request.cookies.get(WORKSPACE_COOKIE))
 
-        # not hierarchical node, change node type to a leaf
-        if 'children' not in event:
-            nodes[event_id]['data']['_type'] = 'child'
-            nodes[event_id]['data']['_shape'] = 'ellipse'
-        # handle repeatable
-        if 'repeatable' in nodes[event_id]['data'] and nodes[event_id]['data']['repeatable']:
-            edges.append(create_edge(event_id, event_id, _edge_type='child_outlink'))
-
-        # link participants to entities
-        if 'participants' in event:
-            for participant in event['participants']:
-                _label = participant['roleName']
-                entity_id = participant['entity']
-                if entity_id == '':
-                    entity_id = "Entities/20000/"
-                edge = create_edge(event_id, entity_id, _label, _edge_type='step_participant')
-                edge['data']['@id'] = participant['@id']
-                edges.append(edge)
-
-        # children
-        if 'children' in event:
-            gate = 'or'
-            if nodes[event_id]['data']['children_gate'] == 'xor':
-                gate = 'xor'
-                xor_id = f'{event_id}xor'
-                nodes[xor_id] = create_node(xor_id, 'XOR', 'gate', 'rectangle')
-            elif nodes[event_id]['data']['children_gate'] == 'and':
-                gate = 'and'
-            
-            for child in event['children']:       
-                child_id = child
-                if child_id in nodes:
-                    prev_type = nodes[child_id]['data']['_type']
-                    nodes[child_id]['data']['_type'] = 'child'
-                    # nodes[child_id] = extend_node(nodes[child_id], child)
-                    nodes[child_id]['data']['_type'] = prev_type
-                else:                    
-                    nodes[child_id] = (create_node(child_id, child_id, 'child', 'ellipse'))
-
-                # handle xor gate or just add edges
-                if gate == 'xor':
-                    edges.append(create_edge(xor_id, child_id, _edge_type='child_outlink'))
-                    edges.append(create_edge(event_id, xor_id, _edge_type='step_child'))
-                else:
-                    edges.append(create_edge(event_id, child_id, _edge_type='child_outlink' if gate == 'and' else 'step_child'))
-
-        # add outlinks
-        if event['outlinks']:
-            for outlink in event['outlinks']:
-                if outlink not in nodes:
-                    _label = outlink.split('/')[-1].replace('_', '')
-                    nodes[outlink] = create_node(outlink, _label, 'child', 'ellipse')
-                edges.append(create_edge(event_id, outlink, _edge_type='child_outlink'))
- 
-    nodes, edges = handle_containers(nodes, edges, containers_to_remove)
+def acquire_workspace(workspace_id, create):
+    """Acquires the workspace with the given id, restored from the journal if it has entries there.
 
-    # find root node(s)
-    parentless_edge = {}
-    for edge in edges:
-        if edge['data']['source'] not in parentless_edge:
-            if nodes[edge['data']['source']]['data']['_type'] == 'entity':
-                parentless_edge[edge['data']['source']] = False
+    Parameters:
+    workspace_id (str): session or workspace id, may be None
+    create (bool): whether to keep a new workspace for an unknown id
+
+    Returns:
+    workspace (Workspace): the workspace, or None for an unknown id if create is False
+    """
+    if not create and workspace_id:
+        create = journal is not None and journal.head(workspace_id) is not None
+    return workspaces.acquire(workspace_id, create) if workspace_id else None
+
+def with_workspace(view):
+    """Passes the workspace of the request to a route, locked for the whole request.
+
+    Requests changing a workspace get a new one if they have no workspace id,
+    remembered in a cookie. GET requests for an unknown workspace are answered
+    from an empty workspace that is not kept, so they never evict another one.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        workspace_id = get_workspace_id()
+        create = request.method not in ('GET', 'HEAD')
+        if not workspace_id and create:
+            workspace_id = g.new_workspace_id = uuid.uuid4().hex
+        try:
+            workspace = acquire_workspace(workspace_id, create)
+        except WorkspaceLimitError as error:
+            app.logger.warning('Refused a new workspace: %s', error)
+            return f'{error} Try again once a session ends.', 503
+        if workspace is None:
+            return view(Workspace(workspace_id), *args, **kwargs)
+        try:
+            with workspace.lock:
+                # after a restart or once evicted, workspaces come back from the journal
+                if journal is not None and not workspace.schema_json:
+                    restore_workspace(workspace)
+                # serialize while holding the lock, other requests may edit the document afterwards
+                response = app.make_response(view(workspace, *args, **kwargs))
+                metrics.count('graph_nodes', len(workspace.graph.nodes))
+                metrics.count('graph_edges', len(workspace.graph))
+                return response
+        finally:
+            workspaces.release(workspace)
+    return wrapper
+
+@contextlib.contextmanager
+def locked_workspaces(workspace_ids):
+    """Acquires and locks several workspaces for a route reading more than one, like /compare.
+
+    Locks are taken in order of id, so two requests locking the same
+    workspaces never wait for each other.
+
+    Parameters:
+    workspace_ids (list): ids of the workspaces, may repeat
+
+    Yields:
+    workspaces (list): the workspaces, in the order of workspace_ids
+    """
+    acquired = {workspace_id: acquire_workspace(workspace_id, False) for workspace_id in sorted(set(workspace_ids))}
+    try:
+        with contextlib.ExitStack() as stack:
+            for workspace in acquired.values():
+                if workspace is None:
+                    continue
+                stack.enter_context(workspace.lock)
+                if journal is not None and not workspace.schema_json:
+                    restore_workspace(workspace)
+            # unknown workspaces are read as empty ones, without keeping them
+            yield [acquired[workspace_id] or Workspace(workspace_id) for workspace_id in workspace_ids]
+    finally:
+        for workspace in acquired.values():
+            if workspace is not None:
+                workspaces.release(workspace)
+
+def with_stored_schema(view):
+    """Passes the schema of the library with the <schema_id> of the URL to a route, open for the whole request.
+
+    Stored schemas never change, GET requests are answered with 304 Not
+    Modified once the client has the response, see conditional_response.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, schema_id, **kwargs):
+        if library is None:
+            return 'The schema library is off, set SCHEMA_LIBRARY to a directory.', 404
+        schema = library.acquire(schema_id)
+        if schema is None:
+            return f'Schema {schema_id} not found.', 404
+        try:
+            # events are read from the file, the response is made before it may be closed
+            if request.method in ('GET', 'HEAD'):
+                return conditional_response(schema.schema_id, lambda: view(*args, schema, **kwargs))
+            return app.make_response(view(*args, schema, **kwargs))
+        finally:
+            library.release(schema)
+    return wrapper
+
+def workspace_etag(*tagged):
+    """Returns the ETag of responses derived from the current versions of the given workspaces."""
+    return '-'.join(f'{workspace.epoch}.{workspace.version}' for workspace in tagged)
+
+def conditional_response(etag, respond):
+    """Answers a GET request with 304 Not Modified if the client holds the ETag, else with respond().
+
+    ETags are weak, as the body of a response may be compressed differently
+    for other clients.
+
+    Parameters:
+    etag (str): tag of the current response, see workspace_etag
+    respond (function): returns the response, only called when it is sent
+
+    Returns:
+    response (Response): the response, successful ones tagged with etag
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = app.make_response(respond())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag, weak=True)
+    return response
+
+def with_etag(view):
+    """Makes the GET requests of a workspace route conditional on the version of the schema.
+
+    Every edit bumps the version, so a client sending back the ETag of its
+    last response in If-None-Match gets 304 Not Modified until the schema
+    changes. Responses also carry the version in X-Schema-Version. Has to
+    come after with_workspace; other methods are passed through.
+    """
+    @functools.wraps(view)
+    def wrapper(workspace, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(workspace, *args, **kwargs)
+        response = conditional_response(workspace_etag(workspace), lambda: view(workspace, *args, **kwargs))
+        response.headers['X-Schema-Version'] = str(workspace.version)
+        return response
+    return wrapper
+
+def request_route():
+    """Returns the method and URL rule of the request, e.g. 'GET /node'."""
+    return f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+
+@app.before_request
+def start_metrics():
+    profiler.start()
+    if metrics.enabled:
+        metrics.start_request()
+
+# registered before compress so that it runs after it
+@app.after_request
+def finish_metrics(response):
+    route = request_route()
+    if metrics.enabled and 'metrics' in g:
+        metrics.count('request_bytes', request.content_length or 0)
+        if not (response.is_streamed or response.direct_passthrough):
+            metrics.count('response_bytes', response.calculate_content_length())
+        metrics.finish_request(route)
+    path = profiler.finish(route)
+    if path:
+        app.logger.warning('Slow request %s, profile written to %s', route, path)
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    # requests that failed before finish_metrics
+    profiler.stop()
+
+@app.after_request
+def compress(response):
+    with stage('compress'):
+        return compress_response(response, request.accept_encodings)
+
+@app.after_request
+def set_workspace_cookie(response):
+    if 'new_workspace_id' in g:
+        response.set_cookie(WORKSPACE_COOKIE, g.new_workspace_id, httponly=True, samesite='Lax')
+    return response
+
+def load_schema(workspace, schema_bytes):
+    """Replaces the schema of a workspace, reusing the graph of a previous upload of the same bytes.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    schema_bytes (bytes): uploaded schema file, possibly gzip compressed
+    """
+    schema_bytes = decompress(schema_bytes, MAX_SCHEMA_BYTES)
+    key = content_key(schema_bytes)
+    entry = schema_cache.acquire(key)
+    if entry is None:
+        schema_json = loads(schema_bytes)
+        with stage('validate'):
+            report = validator.validate(schema_json)
+        if not report.valid:
+            raise SchemaValidationError(report)
+        entry = CachedSchema(key, len(schema_bytes), schema_json, build_graph(schema_json), SchemaIndex(schema_json),
+                             report)
+        schema_cache.add(entry)
+    use_cached_schema(workspace, entry)
+
+def stream_schema(workspace, stream):
+    """Replaces the schema of a workspace with a large upload, linking the graph while events are parsed.
+
+    Unlike load_schema, the upload is parsed before its hash is known, so a
+    cached entry only replaces the parsed objects afterwards.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    stream (file): binary stream of the schema file, possibly gzip compressed
+    """
+    reader = UploadReader(stream, max_bytes=MAX_SCHEMA_BYTES)
+    graph = GraphStore()
+    duplicates = []
+    run = validator.start()
+
+    def link_event(event):
+        # the graph of an invalid document is never used
+        if not run.check_event(event):
+            return
+        # events sharing an @id can only be handled by a full build
+        if duplicates or event['@id'] in graph.contributions:
+            duplicates.append(event)
+        else:
+            update_graph(graph, [event])
+
+    with stage('parse_stream'):
+        schema_json = parse_schema(reader.text(), link_event)
+    report = run.finish(schema_json)
+    if not report.valid:
+        raise SchemaValidationError(report)
+    if duplicates:
+        graph = build_graph(schema_json)
+    key = reader.digest.hexdigest()
+    entry = schema_cache.acquire(key)
+    if entry is None:
+        entry = CachedSchema(key, reader.size, schema_json, graph, SchemaIndex(schema_json), report)
+        schema_cache.add(entry)
+    use_cached_schema(workspace, entry)
+
+def load_stored_schema(workspace, schema):
+    """Replaces the schema of a workspace with a schema of the library, reusing the graph of the same upload.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    schema (StoredSchema): the schema, validated when it was stored
+    """
+    entry = schema_cache.acquire(schema.key)
+    if entry is None:
+        with stage('library'):
+            schema_json = schema.to_json()
+        entry = CachedSchema(schema.key, schema.events_size, schema_json, build_graph(schema_json),
+                             SchemaIndex(schema_json))
+        schema_cache.add(entry)
+    use_cached_schema(workspace, entry)
+
+def upload_response(workspace, stream, read, name=None, store=False):
+    """Replaces the schema of a workspace with an upload, answering /upload and /reload.
+
+    Uploads that are not JSON or fail validation leave the workspace as it
+    was and get a 400 response with all their errors, see ValidationReport.
+    Valid ones are stored in the library, if there is one and store is set:
+    the viewer posts to /reload on every change in its editor, and those
+    drafts are not kept.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    stream (file): binary stream of the upload, read while parsing large uploads
+    read (function): returns the whole upload
+    name (str): file name of the upload, listed in the library
+    store (bool): whether to store the upload in the library
+
+    Returns:
+    response (Response): see replaced_response
+    """
+    old_schema, old_graph = workspace.schema_json, workspace.graph
+    try:
+        if (request.content_length or 0) > STREAM_UPLOAD_BYTES:
+            stream_schema(workspace, stream)
+        else:
+            load_schema(workspace, read())
+    except SchemaValidationError as error:
+        return json_response(error.report.to_dict(), 400)
+    except DECODE_ERRORS as error:
+        return json_response(parse_error_report(error).to_dict(), 400)
+    if store and library is not None:
+        with stage('library'):
+            library.add(workspace.cached.key, workspace.schema_json, name)
+    return replaced_response(workspace, old_schema, old_graph)
+
+def replaced_response(workspace, old_schema, old_graph):
+    """Finishes a route that replaced the whole schema of a workspace, like /upload.
+
+    Returns:
+    response (Response): the graph of the root node and the schema document, or patches from the old ones,
+    with the number of validation warnings in X-Schema-Warnings
+    """
+    g.replaced_schema = old_schema
+    response = edit_response(workspace, lambda: full_schema_response(workspace),
+                             lambda: (diff_json(old_schema, workspace.schema_json), diff_graphs(old_graph, workspace.graph)))
+    report = workspace.cached.report
+    response.headers['X-Schema-Warnings'] = str(report.warning_count if report else 0)
+    return response
+
+def use_cached_schema(workspace, entry):
+    """Points a workspace at the shared objects of a cache entry the caller acquired."""
+    if workspace.cached is not None:
+        schema_cache.release(workspace.cached)
+    workspace.cached = entry
+    workspace.schema_json, workspace.graph, workspace.index = entry.schema_json, entry.graph, entry.index
+
+def detach_workspace(workspace):
+    """Gives a workspace its own schema objects before they are edited.
+
+    The objects of the cache entry are taken over when no other workspace
+    uses them, otherwise the document is copied and its graph built again.
+    """
+    entry, workspace.cached = workspace.cached, None
+    if entry is None or schema_cache.release(entry, take=True):
+        return
+    schema_json = loads(dumps(entry.schema_json))
+    workspace.schema_json, workspace.graph, workspace.index = schema_json, build_graph(schema_json), SchemaIndex(schema_json)
+
+def begin_edit(workspace):
+    """Starts recording the changes a mutation route makes for a delta response.
+
+    Has to be called before the route reads the schema objects of the workspace.
+    """
+    detach_workspace(workspace)
+    g.schema_patch = SchemaPatch(workspace.index)
+    workspace.graph.begin_changes()
+
+def edit_response(workspace, payload, patches=None, record=True):
+    """Finishes a mutation route and bumps the schema version.
+
+    A client that passes ?delta=<version> and still holds that version gets
+    {'version', 'schemaPatch', 'graphPatch'} instead of the full payload:
+    schemaPatch is a JSON Patch of the schema document, graphPatch lists the
+    nodes and edges that changed. Any other request gets the payload as before.
+
+    Parameters:
+    payload (function): returns the full response
+    patches (function): returns (schemaPatch, graphPatch), defaults to the changes since begin_edit
+    record (bool): whether to append the edit to the journal, see journal_edit
+
+    Returns:
+    response (Response): the response, with the new version in X-Schema-Version
+    """
+    previous = workspace.version
+    workspace.version += 1
+    if journal is not None and record:
+        journal_edit(workspace)
+    node_ids, added_edges, removed_edges = workspace.graph.pop_changes()
+    if request.args.get('delta') == str(previous):
+        if patches:
+            schema_ops, graph_ops = patches()
+        else:
+            schema_ops = g.schema_patch.ops()
+            if 'graph_before' in g:
+                graph_ops = diff_graphs(g.graph_before[0], workspace.graph, g.graph_before[1])
             else:
-                parentless_edge[edge['data']['source']] = True
-        parentless_edge[edge['data']['target']] = False
-    roots = [edge for edge in parentless_edge if parentless_edge[edge] == True]
-    for root in roots:
-        nodes[root]['data']['_type'] = 'root'
-
-    # TODO: entities and relations
-    # Zoey wants an entity-first view, so all entities are shown, with groups of events around them in clusters
-        # Q: are we able to make a tab on the viewer itself to switch between views?
-        
-    return nodes, edges
+                graph_ops = graph_patch(workspace.graph, node_ids, added_edges, removed_edges)
+        response = json_response({'version': workspace.version, 'schemaPatch': schema_ops, 'graphPatch': graph_ops})
+    else:
+        response = make_response(payload())
+    response.headers['X-Schema-Version'] = str(workspace.version)
+    return response
+
+def journal_edit(workspace):
+    """Appends the edit of the current request to the journal.
+
+    Routes that called begin_edit are recorded as the events they changed.
+    Documents replacing the current one, like those the viewer posts to
+    /reload on every change in its editor, are recorded as the events that
+    differ when they have the same header, else as the whole document.
+    """
+    with stage('journal'):
+        changes = g.schema_patch.changes() if 'schema_patch' in g else \
+            document_changes(g.get('replaced_schema'), workspace.schema_json)
+        if changes is not None:
+            journal.record(workspace.workspace_id, request_route(), workspace.version,
+                           changes, workspace.schema_json)
+        else:
+            journal.record(workspace.workspace_id, request_route(), workspace.version,
+                           document=workspace.schema_json, document_key=workspace.cached and workspace.cached.key)
+
+def restore_workspace(workspace):
+    """Restores the document of a workspace and its version from the journal, if it has any."""
+    head = journal.head(workspace.workspace_id)
+    if head is None:
+        return
+    with stage('journal'):
+        replace_schema(workspace, journal.document(head[0]))
+    workspace.version = head[1]
+
+def replace_schema(workspace, schema_json):
+    """Gives a workspace a document of its own, building its graph and index."""
+    if workspace.cached is not None:
+        schema_cache.release(workspace.cached)
+        workspace.cached = None
+    workspace.schema_json, workspace.graph, workspace.index = schema_json, build_graph(schema_json), SchemaIndex(schema_json)
+
+def insert_order(graph, events, position, orders):
+    """Returns a place in graph.order for an event inserted into the events list, between its neighbours.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    events (list): events list of the document, the event being at position
+    position (int): position of the event
+    orders (dict): places of the events inserted before it
+
+    Returns:
+    order (float): the place, or None to place it last
+    """
+    if position + 1 >= len(events):
+        return None
+    following = events[position + 1]['@id']
+    following = orders.get(following, graph.order.get(following))
+    if following is None:
+        return None
+    if position == 0:
+        return following - 1
+    preceding = events[position - 1]['@id']
+    preceding = orders.get(preceding, graph.order.get(preceding))
+    return None if preceding is None else (preceding + following) / 2
+
+def replay_changes(workspace, changes, undo=False, graph=True):
+    """Applies the changes of a journal entry to the document and graph, or reverts them.
+
+    Edited events are updated in place, like rollback_edit does, so that
+    the graph nodes refer to the objects of the document.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    changes (dict): changes of the entry, see SchemaPatch.changes
+    undo (bool): whether to revert the changes
+    graph (bool): whether to update the graph, or only the document and index
+    """
+    events, index = workspace.schema_json['events'], workspace.index
+    if undo:
+        deleted = list(range(len(events) - len(changes['added']), len(events)))
+        replaced = [(position, before) for position, before, _ in changes['changed']]
+        inserted = changes['removed']
+    else:
+        deleted = [position for position, _ in changes['removed']]
+        replaced = [(position, after) for position, _, after in changes['changed']]
+        inserted = [(None, event) for event in changes['added']]
+
+    removed = [events[position]['@id'] for position in deleted]
+    for position in reversed(deleted):
+        del events[position]
+    for event_id in removed:
+        index.remove_event(event_id)
+    changed_events = []
+    for position, values in replaced:
+        event = events[position]
+        if event['@id'] != values['@id']:
+            index.remove_event(event['@id'])
+            removed.append(event['@id'])
+        if graph:
+            event.clear()
+            event.update(values)
+        else:
+            # the graph built afterwards is compared with the one referring to the old objects
+            index.remove_event(event['@id'])
+            event = events[position] = values
+        index.index_event(event)
+        changed_events.append(event)
+    orders = {}
+    for position, event in inserted:
+        # the patch sent to the client refers to the journaled event, later entries edit this one
+        event = dict(event)
+        if position is None:
+            events.append(event)
+        else:
+            events.insert(position, event)
+            order = insert_order(workspace.graph, events, position, orders) if graph else None
+            if order is not None:
+                orders[event['@id']] = order
+        index.index_event(event)
+        changed_events.append(event)
+    if graph:
+        update_graph(workspace.graph, changed_events, removed, orders)
+
+def may_be_container(event):
+    """Returns whether an event would be a container if an earlier event listed it, see is_container."""
+    return event is not None and 'children' in event and 'outlinks' in event['name'].lower()
+
+def edited_node_ids(changes):
+    """Returns the ids of the nodes showing the events and entities of changes, see SchemaPatch.changes.
+
+    Nodes refer to the objects of the document, so a graph built before
+    the changes were made in place shows them too and diff_graphs has to
+    be told about them.
+    """
+    events = changes['added'] + [event for _, before, after in changes['changed'] for event in (before, after)]
+    return {element['@id'] for event in events for element in (event, *event.get('entities', ()))}
+
+def changes_containers(index, changes):
+    """Returns whether applying or undoing changes may make or unmake a container, or relink one.
+
+    Containers sharing edges are spliced in document order, which
+    update_graph only follows while containers and the events listing
+    them are left alone.
+
+    Parameters:
+    index (SchemaIndex): index of the document
+    changes (dict): changes of an edit or journal entry, see SchemaPatch.changes
+    """
+    def listed(event):
+        return set(event.get('children', [])).union(event.get('outlinks', []))
+
+    def lists_container(event_ids):
+        return any(may_be_container(index.get_event(event_id)) for event_id in event_ids)
+
+    for event in [event for _, event in changes['removed']] + changes['added']:
+        if may_be_container(event) or lists_container(listed(event)):
+            return True
+    for _, before, after in changes['changed']:
+        if may_be_container(before) != may_be_container(after):
+            return True
+        relinked = listed(before) ^ listed(after)
+        if relinked and (may_be_container(after) or lists_container(relinked)):
+            return True
+    return False
+
+def travel(workspace, target):
+    """Brings a workspace to the state after a journal entry, by undoing and redoing entries.
+
+    Entries further apart than the snapshot interval, or across an upload,
+    are reached from the nearest snapshot instead.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    target (int): id of the entry
+
+    Returns:
+    response (Response): the graph of the root node and the schema document, like /upload
+    """
+    head = journal.head(workspace.workspace_id)
+    path = journal.steps(head[0], target, journal.snapshot_every) if head else None
+    if path is None or any(entry['changes'] is None for entries in path for entry in entries):
+        old_schema, old_graph = workspace.schema_json, workspace.graph
+        with stage('journal'):
+            replace_schema(workspace, journal.document(target))
+        patches = lambda: (diff_json(old_schema, workspace.schema_json), diff_graphs(old_graph, workspace.graph))
+    else:
+        begin_edit(workspace)
+        events = workspace.schema_json['events']
+        old_graph = workspace.graph
+        rebuild = any(changes_containers(workspace.index, entry['changes']) for entries in path for entry in entries)
+        schema_ops = []
+        for entries, undo in ((path[0], True), (path[1], False)):
+            for entry in entries:
+                schema_ops.extend(changes_ops(entry['changes'], len(events), undo))
+                replay_changes(workspace, entry['changes'], undo, not rebuild)
+        node_ids, added_edges, removed_edges = old_graph.pop_changes()
+        if rebuild:
+            workspace.graph = build_graph(workspace.schema_json)
+            edited = set().union(*(edited_node_ids(entry['changes']) for entries in path for entry in entries))
+            patches = lambda: (schema_ops, diff_graphs(old_graph, workspace.graph, edited))
+        else:
+            patches = lambda: (schema_ops, graph_patch(workspace.graph, node_ids, added_edges, removed_edges))
+    response = edit_response(workspace, lambda: full_schema_response(workspace), patches, record=False)
+    journal.move(workspace.workspace_id, target, workspace.version)
+    return response
 
 # NOTE: These are new??
 
@@ -333,34 +1250,39 @@ def fix_entities(schema_json):
 
 # TODO: update sideEditor to handle SDF 3.0
 @app.route('/update_json', methods=['POST'])
-def update_json(values):
+def update_json(workspace, values):
     """Updates JSON with values.
 
     Parameters:
+    workspace (Workspace): schema state of the session
     values (dict): contains node id, and updatedFields dictionary of both keys, and values to change.
     e.g. {'id': 'node_id', 'updatedFields': {key: value, key: value, ...}}
 
     Returns:
     schemaJson (dict): new JSON 
     """
-    global schema_json
+    update_graph(workspace.graph, *apply_update_node(workspace, values))
+    return workspace.schema_json
+
+def apply_update_node(workspace, values):
+    """Sets fields of an event or entity, see update_json.
+
+    Returns:
+    events (list): events to update in the graph
+    removed (list): @ids of events removed from the graph
+    """
+    schema_json, index = workspace.schema_json, workspace.index
     node_id = values['id']
     # print("values:", values)
-    node_to_update = None
-    for event in schema_json['events']:
-        if node_id == event["@id"]:
-            node_to_update = event
-            break
-        if not node_to_update and 'entities' in event:
-            for entity in event['entities']:
-                if entity['@id'] == node_id:
-                    node_to_update = entity
-                    break
-        if node_to_update:
-            break
+    node_to_update = index.get_event(node_id)
+    owner_event = node_to_update
+    if not node_to_update:
+        node_to_update, owner_event = index.get_entity(node_id)
     
     # Update the node with the new values
     if node_to_update:
+        if 'schema_patch' in g:
+            g.schema_patch.touch(owner_event)
         for key, value in values["updatedFields"].items():
             if key != 'id':
                 node_to_update[key] = (value == "true") if key in ["repeatable", "optional", "isSchema"] else value
@@ -375,15 +1297,67 @@ def update_json(values):
     fix_participants(schema_json)
     # fix_entities(schema_json)
 
-    return schema_json
+    # refresh the graph around the edited event, dropping its old @id if it was renamed
+    if not owner_event:
+        return [], []
+    renamed = [node_id] if owner_event['@id'] != node_id and node_to_update is owner_event else []
+    for event_id in renamed:
+        index.remove_event(event_id)
+    index.index_event(owner_event)
+    return [owner_event], renamed
+
+
+
+def version_views(workspace):
+    """Returns a dict for results derived from the current version of the schema, emptied by every edit."""
+    if workspace.views is None or workspace.views[0] != workspace.version:
+        workspace.views = (workspace.version, {})
+    return workspace.views[1]
+
+@timed('layout')
+def view_layout(workspace, view, node_ids, edges):
+    """Returns the positions of a view of the graph, computed once per schema version.
 
+    Parameters:
+    workspace (Workspace): schema state of the session
+    view (tuple): key of the view, e.g. (selected node, depth)
+    node_ids (list): ids of the nodes shown, may repeat
+    edges (list): edges shown
 
+    Returns:
+    positions (dict): {node_id: {'x': x, 'y': y}}
+    """
+    views = version_views(workspace)
+    key = ('layout',) + view
+    if key not in views:
+        views[key] = layered_layout(list(dict.fromkeys(node_ids)), edges)
+    return views[key]
+
+def full_schema_response(workspace):
+    """Returns the graph of the root node, with the positions of its nodes, together with the schema document."""
+    entry = workspace.cached
+    if entry is not None and entry.response is not None:
+        workspace.schema_name = entry.schema_name
+        return Response(entry.response, mimetype='application/json')
+    workspace.schema_name, parsed_schema = get_connected_nodes(workspace.graph, 'root')
+    parsed_schema['positions'] = view_layout(workspace, ('root', 1), [node.id for node in parsed_schema['nodes']],
+                                             parsed_schema['edges'])
+    body = dumps({
+        'parsedSchema': parsed_schema,
+        'name': workspace.schema_name,
+        'schemaJson': workspace.schema_json
+    })
+    if entry is not None:
+        entry.schema_name, entry.response = workspace.schema_name, body
+    return Response(body, mimetype='application/json')
 
 # not passed through here either!
-def get_connected_nodes(selected_node):
+@timed('subtree')
+def get_connected_nodes(graph, selected_node):
     """Constructs graph to be visualized by the viewer.
 
     Parameters:
+    graph (GraphStore): nodes and edges of the schema
     selected_node (str): name of node that serves as the topmost node.
 
     Returns:
@@ -394,64 +1368,308 @@ def get_connected_nodes(selected_node):
 
     n = []
     e = []
-    id_set = set()
+    id_set = {}
     
     if selected_node == 'root':
-        for _, node in nodes.items():
-            if node['data']['_type'] == 'root':
+        for _, node in graph.nodes.items():
+            if node.type == 'root':
                 root_node = node
                 n.append(node)
-                id_set.add(node['data']['id'])
+                id_set[node.id] = None
                 break
     else:
-        root_node = nodes[selected_node]
-    # print("Nodes:", nodes)
+        root_node = graph.nodes[selected_node]
     # node children
-    for edge in edges:
-        if edge['data']['source'] == root_node['data']['id']:
-            # print("Edge causing KeyError:", edge)
-            node = nodes[edge['data']['target']]
-            # skip entities
-            if selected_node == 'root' and node['data']['_type'] == 'entity':
-                continue
-            e.append(edge)
-            n.append(nodes[edge['data']['target']])
-            id_set.add(nodes[edge['data']['target']]['data']['id'])
+    for edge in graph.out_edges(root_node.id):
+        node = graph.nodes[edge.target]
+        # skip entities
+        if selected_node == 'root' and node.type == 'entity':
+            continue
+        e.append(edge)
+        n.append(node)
+        id_set[node.id] = None
     
     # causal edges between children
-    for id in id_set:
-        for edge in edges:
-            if edge['data']['source'] == id:
-                if edge['data']['_edge_type'] == 'child_outlink':
-                    # check if node was created previously
-                    if edge['data']['target'] not in id_set:
-                        n.append(nodes[edge['data']['target']])
-                    e.append(edge)
-                if edge['data']['target'] in id_set and edge['data']['_edge_type'] == 'relation':
-                    e.append(edge)
-
-
+    for id in list(id_set):
+        for edge in graph.out_edges(id):
+            if edge.type == 'child_outlink':
+                # check if node was created previously
+                if edge.target not in id_set:
+                    n.append(graph.nodes[edge.target])
+                e.append(edge)
+            if edge.target in id_set and edge.type == 'relation':
+                e.append(edge)
+
+
+    metrics.count('subtree_nodes', len(n))
+    metrics.count('subtree_edges', len(e))
     # print("\nroot_node from get_connected_nodes:", root_node)
     # print("\nnodes from get_connected_nodes:", n)
     # print("\nedges from get_connected_nodes:", e)
-    return root_node['data']['name'], {'nodes': n, 'edges': e}
+    return root_node.to_dict()['data']['name'], {'nodes': n, 'edges': e}
+
+def child_count(graph, node_id):
+    """Returns the number of children of an event or gate node, shown on collapsed nodes."""
+    contribution = graph.contributions.get(node_id)
+    if contribution is not None:
+        return len(contribution['event'].get('children') or ())
+    if graph.nodes[node_id].type == 'gate':
+        return len(graph.out_edges(node_id))
+    return 0
+
+@timed('subtree')
+def get_neighborhood(graph, selected_node, depth=1):
+    """Collects the nodes and edges up to depth levels below a node, in breadth first order.
+
+    With depth=1 these are the nodes and edges of get_connected_nodes, without
+    the selected node and without duplicates. Every
+    level follows the outgoing edges of the events and gates of the level
+    above; entities are not expanded. Outlinks and relations between the
+    collected nodes are added as in get_connected_nodes.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    selected_node (str): id of the topmost node, or 'root'
+    depth (int): number of levels
+
+    Returns:
+    nodes (list): ids of the collected nodes, in order
+    ranks (list): position in nodes of the later end of each edge, sorted, -1 for edges between known nodes
+    edges (list): edges ordered like ranks
+    expanded (set): ids of the nodes whose children were collected
+    """
+    order = {}
+    seen_edges = set()
+    edges = []
+
+    # e.g. the edge to a xor gate is linked once per child
+    def add_edge(edge):
+        key = edge.key()
+        if key not in seen_edges:
+            seen_edges.add(key)
+            edges.append(edge)
+
+    if selected_node == 'root':
+        root_node = next((node for node in graph.nodes.values() if node.type == 'root'), None)
+        if root_node is None:
+            raise KeyError(selected_node)
+        order[root_node.id] = 0
+    else:
+        root_node = graph.nodes[selected_node]
+    expanded = set()
+    frontier = [root_node.id]
+    for _ in range(depth):
+        level = []
+        for node_id in frontier:
+            expanded.add(node_id)
+            for edge in graph.out_edges(node_id):
+                node = graph.nodes[edge.target]
+                # skip entities
+                if selected_node == 'root' and node.type == 'entity':
+                    continue
+                add_edge(edge)
+                if node.id not in order and node.id != root_node.id:
+                    order[node.id] = len(order)
+                    if node.type != 'entity':
+                        level.append(node.id)
+        frontier = level
+
+    # causal edges between collected nodes
+    for node_id in list(order):
+        for edge in graph.out_edges(node_id):
+            if edge.type == 'child_outlink':
+                if edge.target not in order and edge.target != root_node.id:
+                    order[edge.target] = len(order)
+                add_edge(edge)
+            if edge.target in order and edge.type == 'relation':
+                add_edge(edge)
+
+    # an edge is sent with the later of its ends, the selected node is known to the client
+    ranks = [max(order.get(edge.source, -1), order.get(edge.target, -1)) for edge in edges]
+    ranked = sorted(range(len(edges)), key=ranks.__getitem__)
+    return list(order), [ranks[i] for i in ranked], [edges[i] for i in ranked], expanded
+
+def get_neighborhood_page(workspace, selected_node, depth=1, limit=None, cursor=None, counts=False, layout=False):
+    """Returns one page of the neighborhood of a node for GET /node.
+
+    Pages hold at most limit nodes, and the edges whose later end is on the
+    page, so that no edge refers to a node the client has not received yet.
+    The neighborhood is kept for the next pages until the schema changes.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    selected_node (str): id of the topmost node, or 'root'
+    depth (int): number of levels below the node
+    limit (int): maximum number of nodes per page, None for all
+    cursor (str): cursor of the previous page, None for the first page
+    counts (bool): add the number of children of nodes that were not expanded
+    layout (bool): add the positions of the nodes of the page in the layout of the whole neighborhood
+
+    Returns:
+    page (dict): nodes, edges, total number of nodes, cursor of the next page or None, childCounts and positions
+    """
+    views = version_views(workspace)
+    key = ('neighborhood', selected_node, depth)
+    if key not in views:
+        views[key] = get_neighborhood(workspace.graph, selected_node, depth)
+    node_ids, ranks, edges, expanded = views[key]
+
+    start = 0
+    if cursor:
+        version, _, offset = cursor.partition('.')
+        if version != str(workspace.version):
+            raise ValueError('stale cursor')
+        start = int(offset)
+    end = len(node_ids) if limit is None else min(start + limit, len(node_ids))
+    # edges between the selected node and known nodes come with the first page
+    first = bisect.bisect_left(ranks, start) if start else 0
+    last = bisect.bisect_left(ranks, end)
+    nodes = [workspace.graph.nodes[node_id] for node_id in node_ids[start:end]]
+    page = {
+        'nodes': nodes,
+        'edges': edges[first:last],
+        'total': len(node_ids),
+        'cursor': f'{workspace.version}.{end}' if end < len(node_ids) else None
+    }
+    if counts:
+        page['childCounts'] = {node.id: count for node in nodes
+                               if node.id not in expanded and (count := child_count(workspace.graph, node.id))}
+    if layout:
+        # the selected node is the first rank, unless it is the root which is already listed
+        shown = node_ids if selected_node == 'root' else [selected_node] + node_ids
+        positions = view_layout(workspace, (selected_node, depth), shown, edges)
+        page['positions'] = {node.id: positions[node.id] for node in nodes}
+    metrics.count('subtree_nodes', len(nodes))
+    metrics.count('subtree_edges', last - first)
+    return page
+
+def get_entity_summaries(index):
+    """Lists every entity with the names of the events defining it and having it as a participant.
+
+    Parameters:
+    index (SchemaIndex): index of the schema document
+
+    Returns:
+    entities (list): @id, name, wd_node, wd_label, wd_description, created_in and participant_in
+                     of each entity, in the order they are first defined
+    """
+    entities = []
+    for entity_id in index.get_entity_ids():
+        usage = index.get_entity_usage(entity_id)
+        entity = usage['definitions'][0][0]
+        entities.append({
+            '@id': entity_id,
+            'name': entity.get('name'),
+            'wd_node': entity.get('wd_node'),
+            'wd_label': entity.get('wd_label'),
+            'wd_description': entity.get('wd_description'),
+            'created_in': [event.get('name') for _, event in usage['definitions']],
+            'participant_in': [event.get('name') for event in usage['participant_in']]
+        })
+    return entities
+
+def get_entity_view(graph, index, entity_id=None):
+    """Constructs the entity-first view, each entity in a cluster with its events.
+
+    A cluster is a compound node holding the entity and the events defining
+    it or having it as a participant. An event is shown once, in the cluster
+    of the first entity listing it. Participant edges and relations between
+    the shown nodes are kept.
+
+    Parameters:
+    graph (GraphStore): nodes and edges of the schema
+    index (SchemaIndex): index of the schema document
+    entity_id (str): entity to show with the entities related to it, None for all entities
+
+    Returns:
+    dict: list of nodes and list of edges
+    """
+    nodes = []
+    shown = {}
+
+    def show(node_id, parent=None):
+        node = graph.nodes.get(node_id)
+        if node is None or node_id in shown:
+            return
+        shown[node_id] = None
+        element = node.to_dict()
+        if parent:
+            element['data']['parent'] = parent
+        nodes.append(element)
+
+    for clustered_id in index.get_entity_ids() if entity_id is None else [entity_id]:
+        if clustered_id not in graph.nodes:
+            continue
+        usage = index.get_entity_usage(clustered_id)
+        cluster_id = f'{clustered_id}__cluster'
+        nodes.append({'data': {
+            'id': cluster_id,
+            '_label': graph.nodes[clustered_id].label,
+            '_type': 'entity_cluster',
+            '_shape': 'roundrectangle'
+        }, 'classes': ''})
+        show(clustered_id, cluster_id)
+        for _, event in usage['definitions']:
+            show(event['@id'], cluster_id)
+        for event in usage['participant_in']:
+            show(event['@id'], cluster_id)
+        if entity_id is not None:
+            for relation, _ in usage['relations']:
+                show(relation.get('relationSubject'))
+                show(relation.get('relationObject'))
+
+    edges = [edge for node_id in shown for edge in graph.out_edges(node_id)
+             if edge.type in ('step_participant', 'relation') and edge.target in shown]
+    metrics.count('subtree_nodes', len(nodes))
+    metrics.count('subtree_edges', len(edges))
+    return {'nodes': nodes, 'edges': edges}
+
+def library_root_view(schema):
+    """Returns the body of GET /library/<schema_id>, the graph of the root of a stored schema.
+
+    Only the events of the view are read and linked, see StoredSchema.subtree,
+    so opening a schema takes about the same time whatever its size beyond
+    its header.
+    """
+    roots = schema.roots()
+    root_id = roots[0] if roots else schema.ids[0]
+    graph = build_graph({'events': schema.subtree(root_id)})
+    # events read for containers may be roots of the partial graph as well
+    first_root = next((node.id for node in graph.nodes.values() if node.type == 'root'), None)
+    selected = 'root' if first_root == root_id else root_id
+    root_name, parsed_schema = get_connected_nodes(graph, selected)
+    parsed_schema['positions'] = layered_layout(list(dict.fromkeys(node.id for node in parsed_schema['nodes'])),
+                                                parsed_schema['edges'])
+    return dumps({
+        'id': schema.schema_id,
+        'schemaName': schema.name,
+        'events': len(schema),
+        'roots': roots,
+        'parsedSchema': parsed_schema,
+        'name': root_name,
+        'document': schema.document
+    })
 
 @app.route('/')
 def homepage():
     return render_template('index.html')
 
-@app.route('/add_event', methods=['GET','POST'])
-def append_node():
-    """Appends a new event to the schema_json event list.
+def apply_add_event(workspace, new_event):
+    """Appends a new event to the events list and to the children of its parent.
 
-    input: An already fully generated event.
+    Like the other apply_ functions, it edits the document and its index
+    but leaves updating the graph to the caller, so that /batch can update
+    it once for several edits.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    new_event (dict): fully generated event, with {'@id': parent @id} under 'parent_id'
 
     Returns:
-    schemaJson (dict): updated schema_json with the input appended in the 'events' list.
+    events (list): events to update in the graph
+    removed (list): @ids of events removed from the graph
     """
-    global schema_json
-    new_event = request.get_json()
-    print('Received data:', new_event)
+    schema_json, index = workspace.schema_json, workspace.index
     selected_element = new_event['parent_id'] #request.args.get('selected_element')
     del new_event['parent_id']
 
@@ -461,274 +1679,731 @@ def append_node():
 
     # add new event to events list in schema json
     schema_json['events'].append(new_event)
+    index.index_event(new_event)
+    g.schema_patch.add(new_event)
 
     # add new event ID to children list of selected element
-    for element in schema_json['events']:
-        if element.get('@id') == selected_element.get('@id'):
-            if 'children' not in element:
-                element['children'] = [new_event['@id']]
-            else:
-                element['children'].append(new_event['@id'])
-            break
+    changed_events = []
+    element = index.get_event(selected_element.get('@id'))
+    if element:
+        g.schema_patch.touch(element)
+        if 'children' not in element:
+            element['children'] = [new_event['@id']]
+            element.setdefault('children_gate', 'or')
+        else:
+            element['children'].append(new_event['@id'])
+        index.index_event(element)
+        changed_events.append(element)
+    changed_events.append(new_event)
+    return changed_events, []
+
+def apply_remove_elements(workspace, data):
+    """Removes events, {'id': @id} or {'ids': [@id, ...]}, and the children and outlinks referring to them."""
+    schema_json, index = workspace.schema_json, workspace.index
+    element_ids = data.get('ids') or [data['id']]
+    element_set = set(element_ids)
+
+    # Remove elements from schema_json['events'] list in a single pass
+    removed = [element_id for element_id in element_set if index.get_event(element_id)]
+    if removed:
+        for element_id in removed:
+            g.schema_patch.remove(index.get_event(element_id))
+        removed_events = {id(index.get_event(element_id)) for element_id in removed}
+        schema_json['events'][:] = [event for event in schema_json['events'] if id(event) not in removed_events]
+        for element_id in removed:
+            index.remove_event(element_id)
+
+    # Remove elements from the children and outlinks lists that refer to them
+    changed_events = {}
+    for element_id in element_set:
+        for event, keys in index.get_referrers(element_id):
+            keys &= {'children', 'outlinks'}
+            if keys:
+                changed_events.setdefault(event['@id'], (event, set()))[1].update(keys)
+    for event, keys in changed_events.values():
+        g.schema_patch.touch(event)
+        for key in keys:
+            event[key][:] = [reference for reference in event[key] if reference not in element_set]
+        index.index_event(event)
+
+    return [event for event, _ in changed_events.values()], removed
+
+def apply_add_entity(workspace, data):
+    """Adds {'event_id', 'entity_data'} to the entities of the event."""
+    index = workspace.index
+    event_id = data.get('event_id')
+    entity_data = data.get('entity_data')
+
+    # Find the event with the given ID and add the entity to its entities list
+    event = index.get_event(event_id)
+    if not event:
+        return [], []
+    g.schema_patch.touch(event)
+    # Ensure the 'entities' key exists in the event dictionary
+    if 'entities' not in event:
+        event['entities'] = []
+    event['entities'].append(entity_data)
+    index.index_event(event)
+    return [event], []
+
+def apply_add_participant(workspace, data):
+    """Adds {'event_id', 'participant_data'} to the participants of the event."""
+    index = workspace.index
+    event_id = data.get('event_id')
+    participant_data = data.get('participant_data')
+
+    # Find the event with the given ID and add the participant to its participants list
+    event = index.get_event(event_id)
+    if not event:
+        return [], []
+    g.schema_patch.touch(event)
+    event['participants'].append(participant_data)
+    index.index_event(event)
+    return [event], []
+
+def apply_add_outlink(workspace, data):
+    """Adds an outlink {'fromNodeId', 'toNodeId'} between two events."""
+    index = workspace.index
+    from_node_id = data.get('fromNodeId')
+    to_node_id = data.get('toNodeId')
+
+    # Find the event with the matching @id field
+    event = index.get_event(from_node_id)
+    if not event:
+        return [], []
+    g.schema_patch.touch(event)
+    # Check if to_node_id already exists in outlinks
+    if 'outlinks' not in event:
+        event['outlinks'] = [to_node_id]
+    elif to_node_id not in event['outlinks']:
+        event['outlinks'].append(to_node_id)
+    # update the index around the event
+    index.index_event(event)
+    return [event], []
+
+def apply_add_relation(workspace, data):
+    """Adds {'fromNodeId', 'toNodeId', 'relation'} to the event defining the entity fromNodeId."""
+    index = workspace.index
+    from_node_id = data.get('fromNodeId')
+    relation = data.get('relation')
+
+    # Find the event which contains the relationSubject entity
+    _, event = index.get_entity(from_node_id)
+    if not event:
+        return [], []
+    g.schema_patch.touch(event)
+    if 'relations' not in event:
+        event['relations'] = [relation]
+    else:
+        event['relations'].append(relation)
+    index.index_event(event)
+    return [event], []
+
+def apply_delete_entities(workspace, data):
+    """Deletes entities, {'entity_id': @id} or {'entity_ids': [@id, ...]}, with their participants and relations."""
+    index = workspace.index
+    entity_ids = set(data.get('entity_ids') or [data.get('entity_id')])
+
+    # Find the events defining or referring to the entities
+    changed_events = {}
+    for entity_id in entity_ids:
+        for event in index.get_definers('entities', entity_id):
+            changed_events.setdefault(event['@id'], (event, set()))[1].add('entities')
+        for event, keys in index.get_referrers(entity_id):
+            keys &= {'participants', 'relations'}
+            if keys:
+                changed_events.setdefault(event['@id'], (event, set()))[1].update(keys)
+
+    for event, keys in changed_events.values():
+        g.schema_patch.touch(event)
+        # Remove the entity from the schema_json['events']['entities']
+        if 'entities' in keys:
+            event['entities'][:] = [entity for entity in event['entities'] if entity.get('@id') not in entity_ids]
+        # Remove the entity from the participants' 'entity' field
+        if 'participants' in keys:
+            event['participants'][:] = [
+                participant for participant in event['participants'] if participant.get('entity') not in entity_ids
+            ]
+        # Remove relations with matching relationSubject or relationObject
+        if 'relations' in keys:
+            event['relations'][:] = [
+                relation for relation in event['relations']
+                if relation.get('relationSubject') not in entity_ids and relation.get('relationObject') not in entity_ids
+            ]
+        index.index_event(event)
+
+    return [event for event, _ in changed_events.values()], []
+
+# operations of /batch, named after their routes
+BATCH_OPERATIONS = {
+    'add_event': apply_add_event,
+    'remove_element': apply_remove_elements,
+    'add_entity': apply_add_entity,
+    'add_participant': apply_add_participant,
+    'add_outlink': apply_add_outlink,
+    'add_relation': apply_add_relation,
+    'delete_entity': apply_delete_entities,
+    'node': apply_update_node
+}
+
+def rollback_edit(workspace, events, rebuild=False):
+    """Restores the document as it was at begin_edit, and its graph.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    events (list): the events list of the document at begin_edit
+    rebuild (bool): whether the graph was partly updated and has to be built again
+    """
+    restored = []
+    for event, before in g.schema_patch.originals():
+        event.clear()
+        event.update(before)
+        restored.append(event)
+    workspace.schema_json['events'][:] = events
+    workspace.index = SchemaIndex(workspace.schema_json)
+    if rebuild:
+        workspace.graph.pop_changes()
+        workspace.graph = build_graph(workspace.schema_json)
+        return
+    # nodes of entities and relations refer to the replaced objects
+    update_graph(workspace.graph, restored)
+    workspace.graph.pop_changes()
+
+def check_edited(workspace, events):
+    """Raises SchemaValidationError for the first edited event the graph cannot be built from."""
+    for event in events:
+        report = validator.validate_event(event, f'/events/{workspace.index.position(event)}')
+        if not report.valid:
+            raise SchemaValidationError(report)
+
+def apply_edit(workspace, apply, data):
+    """Starts an edit and applies one of BATCH_OPERATIONS with the graph update, or nothing at all.
+
+    If the operation fails or leaves an event that is not valid, the
+    document, index and graph are restored as they were.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    apply (function): the apply_ function of the route
+    data (dict): body of the request
+
+    Returns:
+    response (Response): a 400 response if nothing was applied, else None
+    """
+    begin_edit(workspace)
+    events_before = list(workspace.schema_json['events'])
+    try:
+        events, removed = apply(workspace, data)
+        check_edited(workspace, [event for event in events if workspace.index.position(event) is not None])
+    except SchemaValidationError as error:
+        rollback_edit(workspace, events_before)
+        return json_response(error.report.to_dict(), 400)
+    except Exception as error:
+        rollback_edit(workspace, events_before)
+        return make_response(f'The edit failed, nothing was applied: {error!r}', 400)
+    try:
+        update_edited_graph(workspace, events, removed)
+    except Exception as error:
+        rollback_edit(workspace, events_before, rebuild=True)
+        return make_response(f'The edit failed, nothing was applied: {error!r}', 400)
+    return None
+
+def update_edited_graph(workspace, events, removed):
+    """Updates the graph of a workspace after an edit, see update_graph.
+
+    Edits that may make or unmake containers rebuild the graph instead,
+    see changes_containers; the graph patch of the response is then the
+    difference with the graph before the edit.
+
+    Parameters:
+    workspace (Workspace): schema state of the session
+    events (list): new or edited events, as they now are in the schema
+    removed (list): @ids of events deleted from the schema
+    """
+    changes = g.schema_patch.changes()
+    if changes_containers(workspace.index, changes):
+        g.graph_before = workspace.graph, edited_node_ids(changes)
+        workspace.graph.pop_changes()
+        workspace.graph = build_graph(workspace.schema_json)
+    else:
+        update_graph(workspace.graph, events, removed)
+
+@app.route('/add_event', methods=['GET','POST'])
+@with_workspace
+def append_node(workspace):
+    """Appends a new event to the schema_json event list.
+
+    input: An already fully generated event.
+
+    Returns:
+    schemaJson (dict): updated schema_json with the input appended in the 'events' list.
+    """
+    new_event = request.get_json()
+    app.logger.debug('/add_event %s', new_event)
+    if not isinstance(new_event, dict) or not isinstance(new_event.get('parent_id'), dict):
+        return "Expecting an event with {'@id': parent @id} under 'parent_id'.", 400
+    report = validator.validate_event(new_event)
+    if not report.valid:
+        return json_response(report.to_dict(), 400)
+    failed = apply_edit(workspace, apply_add_event, new_event)
+    if failed:
+        return failed
 
     # print(f"schema_json: {schema_json}")
-    return schema_json
+    return edit_response(workspace, lambda: json_response(workspace.schema_json))
 
 @app.route('/remove_element', methods=['POST'])
-def remove_element():
+@with_workspace
+def remove_element(workspace):
   data = request.json
-  element_id = data['id']
-  print("element_id:", element_id)
-#   element_type = data['type']
-
-  # Remove element from schema_json['events'] list
-  for event in schema_json['events']:
-    if event['@id'] == element_id:
-      schema_json['events'].remove(event)
-      break
-
-  # Remove element from all children lists
-  for event in schema_json['events']:
-    for child in event.get('children', []):
-      if child == element_id:
-        event['children'].remove(child)
-
-  # Remove element from all outlinks lists
-  for event in schema_json['events']:
-    outlink_removed = False
-    for outlink in event.get('outlinks', []):
-      if outlink == element_id:
-        event['outlinks'].remove(outlink)
-        outlink_removed = True
-    if outlink_removed:
-      break
-
-  return {'success': True}
+  app.logger.debug('/remove_element %s', data)
+  failed = apply_edit(workspace, apply_remove_elements, data)
+  if failed:
+      return failed
 
-@app.route('/add_entity', methods=['POST'])
-def add_entity_to_event():
-    data = request.json
-    event_id = data.get('event_id')
-    entity_data = data.get('entity_data')
+  return edit_response(workspace, lambda: json_response({'success': True}))
 
-    # Find the event with the given ID and add the entity to its entities list
-    for event in schema_json['events']:
-        if event['@id'] == event_id:
-            # Ensure the 'entities' key exists in the event dictionary
-            if 'entities' not in event:
-                event['entities'] = []
-            event['entities'].append(entity_data)
+@app.route('/add_entity', methods=['POST'])
+@with_workspace
+def add_entity_to_event(workspace):
+    failed = apply_edit(workspace, apply_add_entity, request.json)
+    if failed:
+        return failed
     
     # Print the updated schema for confirmation
     # print(json.dumps(schema_json, indent=2))
     
     # Return a success response
-    return schema_json
+    return edit_response(workspace, lambda: json_response(workspace.schema_json))
 
 @app.route('/add_participant', methods=['POST'])
-def add_participant_to_event():
-    data = request.json
-    event_id = data.get('event_id')
-    participant_data = data.get('participant_data')
-
-    # Find the event with the given ID and add the participant to its participants list
-    for event in schema_json['events']:
-        if event['@id'] == event_id:
-            event['participants'].append(participant_data)
+@with_workspace
+def add_participant_to_event(workspace):
+    failed = apply_edit(workspace, apply_add_participant, request.json)
+    if failed:
+        return failed
     
     # Print the updated schema for confirmation
     # print(json.dumps(schema_json, indent=2))
     
     # Return a success response
-    return schema_json
+    return edit_response(workspace, lambda: json_response(workspace.schema_json))
 
 @app.route('/add_outlink', methods=['POST'])
-def add_outlink():
-    global schema_json
+@with_workspace
+def add_outlink(workspace):
     data = request.get_json()
-    from_node_id = data.get('fromNodeId')
-    to_node_id = data.get('toNodeId')
-    print(f"from_node_id: {from_node_id}")
-    print(f"to_node_id: {to_node_id}")
-
-    # Find the event with the matching @id field
-    for event in schema_json['events']:
-        if event.get('@id') == from_node_id:
-            # Check if to_node_id already exists in outlinks
-            if 'outlinks' not in event:
-                event['outlinks'] = [to_node_id]
-            elif to_node_id not in event['outlinks']:
-                event['outlinks'].append(to_node_id)
-            break
-
-    # get the updated nodes and edges
-    global nodes
-    global edges
-    nodes, edges = get_nodes_and_edges(schema_json)
-    schema_name, parsed_schema = get_connected_nodes('root')
+    app.logger.debug('/add_outlink %s', data)
+    failed = apply_edit(workspace, apply_add_outlink, data)
+    if failed:
+        return failed
 
     # return the updated parsedSchema and schemaJson
-    return json.dumps({
-        'parsedSchema': parsed_schema,
-        'name': schema_name,
-        'schemaJson': schema_json
-    })
+    return edit_response(workspace, lambda: full_schema_response(workspace))
 
 @app.route('/add_relation', methods=['POST'])
-def add_relation():
-    global schema_json
+@with_workspace
+def add_relation(workspace):
     data = request.get_json()
-    from_node_id = data.get('fromNodeId')
-    to_node_id = data.get('toNodeId')
-    relation = data.get('relation')
-
-    print(f"from_node_id: {from_node_id}")
-    print(f"to_node_id: {to_node_id}")
-    print(f"relation: {relation}")
-
-    # Find the event which contains the relationSubject entity
-    for event in schema_json['events']:
-        for entity in event.get('entities', []):
-            if entity.get('@id') == from_node_id:
-                if 'relations' not in event:
-                    event['relations'] = [relation]
-                else:
-                    event['relations'].append(relation)
-                break
+    app.logger.debug('/add_relation %s', data)
+    failed = apply_edit(workspace, apply_add_relation, data)
+    if failed:
+        return failed
     
-    nodes, edges = get_nodes_and_edges(schema_json)
-    schema_name, parsed_schema = get_connected_nodes('root')
-    
-    return json.dumps({
-        'parsedSchema': parsed_schema,
-        'name': schema_name,
-        'schemaJson': schema_json
-    })
+    return edit_response(workspace, lambda: full_schema_response(workspace))
 
 @app.route('/get_all_entities', methods=['GET'])
-def get_all_entities():
-    entities_dict = {}
-
-    # Populate the entities_dict with basic information about the entities
-    for event in schema_json['events']:
-        for entity in event.get('entities', []):
-            entity_id = entity.get('@id')
-            if entity_id not in entities_dict:
-                entity_info = {
-                    '@id': entity_id,
-                    'name': entity.get('name'),
-                    'wd_node': entity.get('wd_node'),
-                    'wd_label': entity.get('wd_label'),
-                    'wd_description': entity.get('wd_description'),
-                    'created_in': [],
-                    'participant_in': []
-                }
-                entities_dict[entity_id] = entity_info
-
-            if event.get('@id') not in entities_dict[entity_id]['created_in']:
-                entities_dict[entity_id]['created_in'].append(event.get('name'))
-
-    # Add participant information to the entities in entities_dict
-    for event in schema_json['events']:
-        participants = event.get('participants', [])
-        for participant in participants:
-            participant_entity_id = participant.get('entity')
-            if participant_entity_id in entities_dict:
-                if event.get('@id') not in entities_dict[participant_entity_id]['participant_in']:
-                    entities_dict[participant_entity_id]['participant_in'].append(event.get('name'))
-
-    entities = list(entities_dict.values())
-    return jsonify(entities)
+@with_workspace
+@with_etag
+def get_all_entities(workspace):
+    """Gets every entity with the names of the events defining it and having it as a participant."""
+    views = version_views(workspace)
+    if 'entities' not in views:
+        views['entities'] = dumps(get_entity_summaries(workspace.index))
+    return Response(views['entities'], mimetype='application/json')
+
+@app.route('/entity_view', methods=['GET'])
+@with_workspace
+@with_etag
+def get_entity_graph(workspace):
+    """Gets the entity-first view of all entities, or of entity ?ID= and the entities related to it."""
+    entity_id = request.args.get('ID')
+    views = version_views(workspace)
+    key = ('entity_view', entity_id)
+    if key not in views:
+        if entity_id is not None and workspace.index.get_entity(entity_id)[0] is None:
+            return f'Entity {entity_id} not found.', 404
+        views[key] = dumps(get_entity_view(workspace.graph, workspace.index, entity_id))
+    return Response(views[key], mimetype='application/json')
+
+@app.route('/search', methods=['GET'])
+@with_workspace
+@with_etag
+def search(workspace):
+    """Finds events, entities, relations and participants by name, description, Wikidata id or label and role name.
+
+    ?q=<words>&kind=<event|entity|relation|participant, repeatable>&limit=<results, default 20>
+    """
+    query = request.args.get('q', '')
+    kinds = set(request.args.getlist('kind')) or None
+    try:
+        limit = int(request.args.get('limit', 20))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return 'limit must be a positive integer.', 400
+    with stage('search'):
+        results, total = workspace.index.search_index().search(query, limit, kinds)
+    return json_response({'results': results, 'total': total})
 
 @app.route('/upload', methods=['POST'])
-def upload():
+@with_workspace
+def upload(workspace):
     """Uploads JSON and processes it for graph view."""
     file = request.files['file']
-    schema_string = file.read().decode("utf-8")
-    global schema_json
-    global nodes
-    global edges
-    global schema_name
-    schema_json = json.loads(schema_string)
     
     # if is_ta2_format(schema_json):
     #     schema_json = convert_ta2_to_ta1_format(schema_json)
         
-    nodes, edges = get_nodes_and_edges(schema_json)
-    schema_name, parsed_schema = get_connected_nodes('root')
-    return json.dumps({
-        'parsedSchema': parsed_schema,
-        'name': schema_name,
-        'schemaJson': schema_json
-    })
+    return upload_response(workspace, file.stream, file.read, file.filename, store=True)
 
 @app.route('/delete_entity', methods=['DELETE'])
-def delete_entity():
-    entity_id = request.json.get('entity_id')
-
-    # Remove the entity from the schema_json['events']['entities']
-    for event in schema_json['events']:
-        if 'entities' in event:
-            event['entities'] = [entity for entity in event['entities'] if entity.get('@id') != entity_id]
+@with_workspace
+def delete_entity(workspace):
+    failed = apply_edit(workspace, apply_delete_entities, request.json)
+    if failed:
+        return failed
+    graph = workspace.graph
+
+    return edit_response(workspace, lambda: json_response({
+        'nodes': graph.nodes,
+        'edges': graph.edges
+    }))
+
+@app.route('/batch', methods=['POST'])
+@with_workspace
+def batch(workspace):
+    """Applies several edits at once and updates the graph a single time.
+
+    input: {'operations': [{'op': name, 'data': body of the route}, ...]}, the names being
+    those of BATCH_OPERATIONS. If an operation fails, none of them is applied.
 
-    # Remove the entity from the participants' 'entity' field
-    for event in schema_json['events']:
-        if 'participants' in event:
-            event['participants'] = [
-                participant for participant in event['participants'] if participant.get('entity') != entity_id
-            ]
-            
-    # Remove relations with matching relationSubject or relationObject
-    for event in schema_json['events']:
-        if 'relations' in event:
-            event['relations'] = [
-                relation for relation in event['relations']
-                if relation.get('relationSubject') != entity_id and relation.get('relationObject') != entity_id
-            ]
-    
-    # Reload the schema to update the nodes and edges
-    nodes, edges = get_nodes_and_edges(schema_json)
-    
-    return jsonify({
-        'nodes': nodes,
-        'edges': edges
-    })
+    Returns:
+    the graph of the root node and the schema document, like /upload
+    """
+    body = request.get_json()
+    operations = body.get('operations') if isinstance(body, dict) else body
+    if not isinstance(operations, list):
+        return 'Expecting {"operations": [{"op": ..., "data": ...}, ...]}.', 400
+
+    begin_edit(workspace)
+    events_before = list(workspace.schema_json['events'])
+    changed = {}
+    removed = []
+    for position, operation in enumerate(operations):
+        try:
+            events, removed_ids = BATCH_OPERATIONS[operation['op']](workspace, operation.get('data') or {})
+        except Exception as error:
+            rollback_edit(workspace, events_before)
+            return f'Operation {position} failed, nothing was applied: {error!r}', 400
+        for event in events:
+            changed[id(event)] = event
+        removed.extend(removed_ids)
+
+    # events deleted by a later operation are only removed
+    index = workspace.index
+    events = [event for event in changed.values() if index.position(event) is not None]
+    try:
+        check_edited(workspace, events)
+    except SchemaValidationError as error:
+        rollback_edit(workspace, events_before)
+        return json_response(error.report.to_dict(), 400)
+    try:
+        update_edited_graph(workspace, events, removed)
+    except Exception as error:
+        rollback_edit(workspace, events_before, rebuild=True)
+        return f'The edits failed, nothing was applied: {error!r}', 400
+    return edit_response(workspace, lambda: full_schema_response(workspace))
 
 # TODO: get_subtree_or_update_node not accessed
 @app.route('/node', methods=['GET', 'POST'])
-def get_subtree_or_update_node():
-    if not (bool(nodes) and bool(edges)):
+@with_workspace
+@with_etag
+def get_subtree_or_update_node(workspace):
+    graph = workspace.graph
+    if not (graph.nodes and len(graph)):
         return 'Parsing error! Upload the file again.', 400
 
     if request.method == 'GET':        
         """Gets subtree of the selected node."""
         node_id = request.args.get('ID')
-        _, subtree = get_connected_nodes(node_id)
-        return json.dumps(subtree)
+        if not any(arg in request.args for arg in ('depth', 'limit', 'cursor', 'counts', 'layout')):
+            _, subtree = get_connected_nodes(graph, node_id)
+            return json_response(subtree)
+        # ?depth=<levels>&limit=<nodes per page>&cursor=<from the previous page>&counts=1&layout=1
+        try:
+            depth = int(request.args.get('depth', 1))
+            limit = request.args.get('limit')
+            limit = int(limit) if limit else None
+            if depth < 1 or (limit is not None and limit < 1):
+                raise ValueError
+        except ValueError:
+            return 'depth and limit must be positive integers.', 400
+        try:
+            page = get_neighborhood_page(workspace, node_id, depth, limit, request.args.get('cursor'),
+                                         request.args.get('counts', '') not in ('', '0', 'false'),
+                                         request.args.get('layout', '') not in ('', '0', 'false'))
+        except ValueError:
+            return 'The schema changed or the cursor is invalid, request the first page again.', 409
+        except KeyError:
+            return f'Node {node_id} not found.', 404
+        return json_response(page)
     else:
         """Posts updates to selected node and reloads schema."""
-        values = json.loads(request.data.decode("utf-8"))
-        new_json = update_json(values)
+        values = loads(request.data)
+        failed = apply_edit(workspace, apply_update_node, values)
+        if failed:
+            return failed
+        new_json = workspace.schema_json
         # print("\nnew_json from get_subtree_or_update_node:", new_json)
-        return json.dumps(new_json)
+        return edit_response(workspace, lambda: json_response(new_json))
 
 # TODO: reload_schema not accessed
 @app.route('/reload', methods=['POST'])
-def reload_schema():
+@with_workspace
+def reload_schema(workspace):
     """Reloads schema; does the same thing as upload."""
-    schema_string = request.data.decode("utf-8")
-    global schema_json
-    global nodes
-    global edges
-    global schema_name
-    schema_json = json.loads(schema_string)
-    nodes, edges = get_nodes_and_edges(schema_json)
-    schema_name, parsed_schema = get_connected_nodes('root')
     # print("\nschema_name from reload_schema:", schema_name)
     # print("\nparsed_schema from reload_schema:", parsed_schema)
     # print("\nschema_json from reload_schema:", schema_json)    
-    return json.dumps({
-        'parsedSchema': parsed_schema,
-        'name': schema_name,
-        'schemaJson': schema_json
-    })
\ No newline at end of file
+    return upload_response(workspace, request.stream, request.get_data)
+
+@app.route('/validate', methods=['POST'])
+def validate_schema():
+    """Checks a schema without loading it, sent like to /upload or /reload.
+
+    Returns:
+    {'valid', 'errorCount', 'warningCount', 'errors', 'warnings'}, errors and warnings
+    being {'path': JSON Pointer, 'message'}, see ValidationReport
+    """
+    file = request.files.get('file')
+    try:
+        schema_json = loads(decompress(file.read() if file else request.get_data(), MAX_SCHEMA_BYTES))
+    except DECODE_ERRORS as error:
+        return json_response(parse_error_report(error).to_dict(), 400)
+    with stage('validate'):
+        report = validator.validate(schema_json)
+    return json_response(report.to_dict())
+
+@app.route('/compare', methods=['GET'])
+def compare():
+    """Compares the schemas of two workspaces by @id.
+
+    input: ?other=<workspace id>, and ?base=<workspace id> for another
+    workspace than the one of the request.
+
+    Returns:
+    {'base', 'other', 'events', 'entities', 'participants', 'relations', 'edges', 'summary'}, the
+    versions of both workspaces and what the schema of other adds, removes and changes, see diff_schemas
+    """
+    base_id, other_id = request.args.get('base') or get_workspace_id(), request.args.get('other')
+    if not base_id or not other_id:
+        return 'Expecting ?other=<workspace id> and a workspace for the base schema.', 400
+    with locked_workspaces([base_id, other_id]) as (base, other):
+        for workspace in (base, other):
+            if not workspace.schema_json:
+                return f'Workspace {workspace.workspace_id} has no schema.', 404
+
+        def respond():
+            # results of the base version, kept for the latest version of each other workspace
+            views = version_views(base)
+            key = ('compare', other_id)
+            if key not in views or views[key][0] != other.version:
+                with stage('compare'):
+                    diff = diff_schemas(base.index, other.index, base.graph, other.graph)
+                diff['base'] = {'workspace': base_id, 'version': base.version}
+                diff['other'] = {'workspace': other_id, 'version': other.version}
+                views[key] = (other.version, dumps(diff))
+            return Response(views[key][1], mimetype='application/json')
+        return conditional_response(workspace_etag(base, other), respond)
+
+@app.route('/library', methods=['GET', 'POST'])
+def schema_library():
+    """Lists the schemas of the library, or stores an upload in it without opening it.
+
+    input (POST): the schema as 'file' like /upload, or as the body, and ?name= to list it under another name.
+
+    Returns:
+    GET: {'schemas': [{'id', 'name', 'events', 'bytes', 'created'}]}
+    POST: {'id'} of the stored schema, or the ValidationReport of an invalid upload with 400
+    """
+    if library is None:
+        return 'The schema library is off, set SCHEMA_LIBRARY to a directory.', 404
+    if request.method == 'GET':
+        schemas = library.schemas()
+        # schemas are only ever added
+        etag = f'{len(schemas)}.{max(schema["created"] for schema in schemas)}' if schemas else '0'
+        return conditional_response(etag, lambda: json_response({'schemas': schemas}))
+    file = request.files.get('file')
+    try:
+        schema_bytes = decompress(file.read() if file else request.get_data(), MAX_SCHEMA_BYTES)
+    except DECODE_ERRORS as error:
+        return json_response(parse_error_report(error).to_dict(), 400)
+    key = content_key(schema_bytes)
+    if key not in library:
+        try:
+            schema_json = loads(schema_bytes)
+        except DECODE_ERRORS as error:
+            return json_response(parse_error_report(error).to_dict(), 400)
+        with stage('validate'):
+            report = validator.validate(schema_json)
+        if not report.valid:
+            return json_response(report.to_dict(), 400)
+        with stage('library'):
+            library.add(key, schema_json, request.args.get('name') or (file.filename if file else None))
+    return json_response({'id': key})
+
+@app.route('/library/<schema_id>', methods=['GET'])
+@with_stored_schema
+def get_stored_schema(schema):
+    """Opens a schema of the library, reading only the events of its root view.
+
+    Returns:
+    {'id', 'schemaName', 'events', 'roots', 'parsedSchema', 'name', 'document'}: the number of events,
+    the @ids of events no other event lists, the graph of the root node with positions like /upload,
+    the name of the root node and the fields of the document other than its events
+    """
+    if not len(schema):
+        return f'Schema {schema.schema_id} has no events.', 400
+    if 'root' not in schema.views:
+        schema.views['root'] = library_root_view(schema)
+    return Response(schema.views['root'], mimetype='application/json')
+
+@app.route('/library/<schema_id>/event', methods=['GET'])
+@with_stored_schema
+def get_stored_event(schema):
+    """Returns one event of a schema of the library, ?ID=<event @id>, as it is stored."""
+    data = schema.event_bytes(request.args.get('ID'))
+    if data is None:
+        return f'Event {request.args.get("ID")} not found.', 404
+    return Response(data, mimetype='application/json')
+
+@app.route('/library/<schema_id>/node', methods=['GET'])
+@with_stored_schema
+def get_stored_subtree(schema):
+    """Gets the subtree of an event of a schema of the library, ?ID=<event @id>, like GET /node.
+
+    Only the events of the subtree are read, see StoredSchema.subtree.
+    """
+    node_id = request.args.get('ID')
+    if node_id not in schema:
+        return f'Node {node_id} not found.', 404
+    graph = build_graph({'events': schema.subtree(node_id)})
+    try:
+        _, subtree = get_connected_nodes(graph, node_id)
+    except KeyError:
+        # e.g. a container, which is spliced out of the graph
+        return f'Node {node_id} not found.', 404
+    return json_response(subtree)
+
+@app.route('/library/<schema_id>/open', methods=['POST'])
+@with_workspace
+@with_stored_schema
+def open_stored_schema(workspace, schema):
+    """Replaces the schema of the workspace with a schema of the library, to edit it.
+
+    Returns:
+    the same as /upload
+    """
+    old_schema, old_graph = workspace.schema_json, workspace.graph
+    load_stored_schema(workspace, schema)
+    return replaced_response(workspace, old_schema, old_graph)
+
+@app.route('/schema', methods=['GET'])
+@with_workspace
+@with_etag
+def get_schema(workspace):
+    """Gets the graph of the root node and the schema document of the workspace, like /upload."""
+    if not workspace.schema_json:
+        return 'The workspace has no schema, upload one first.', 404
+    return full_schema_response(workspace)
+
+@app.route('/version', methods=['GET'])
+@with_workspace
+@with_etag
+def get_version(workspace):
+    """Gets the schema version of the workspace, for clients polling for changes.
+
+    input: ?since=<version> held by the client, answered with 304 Not Modified while it is current;
+    sending back the ETag of the last response in If-None-Match does the same.
+
+    Returns:
+    {'version'}
+    """
+    if request.args.get('since') == str(workspace.version):
+        return Response(status=304)
+    return json_response({'version': workspace.version})
+
+@app.route('/undo', methods=['POST'])
+@with_workspace
+def undo(workspace):
+    """Undoes the last edit or upload of the workspace.
+
+    Returns:
+    the graph of the root node and the schema document, like /upload
+    """
+    if journal is None:
+        return 'The edit journal is disabled, start the server with SCHEMA_JOURNAL=<file>.', 404
+    head = journal.head(workspace.workspace_id)
+    parent = journal.entry(head[0])['parent'] if head else None
+    if parent is None:
+        return 'Nothing to undo.', 409
+    return travel(workspace, parent)
+
+@app.route('/redo', methods=['POST'])
+@with_workspace
+def redo(workspace):
+    """Redoes the last undone edit of the workspace, the latest one if several edits were undone to the same state."""
+    if journal is None:
+        return 'The edit journal is disabled, start the server with SCHEMA_JOURNAL=<file>.', 404
+    head = journal.head(workspace.workspace_id)
+    child = journal.latest_child(head[0]) if head else None
+    if child is None:
+        return 'Nothing to redo.', 409
+    return travel(workspace, child)
+
+@app.route('/history', methods=['GET', 'POST'])
+@with_workspace
+@with_etag
+def history(workspace):
+    """Lists the journal entries of the workspace; POST {'entry': id} brings it back to one of them.
+
+    Returns:
+    GET: {'current': id of the current entry, 'entries': [{'id', 'parent', 'operation', 'version', 'created'}, ...]}
+    POST: the graph of the root node and the schema document, like /upload
+    """
+    if journal is None:
+        return 'The edit journal is disabled, start the server with SCHEMA_JOURNAL=<file>.', 404
+    head = journal.head(workspace.workspace_id)
+    if request.method == 'GET':
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return 'limit must be an integer.', 400
+        entries = [{key: entry[key] for key in ('id', 'parent', 'operation', 'version', 'created')}
+                   for entry in journal.history(workspace.workspace_id, limit)]
+        return json_response({'current': head[0] if head else None, 'entries': entries})
+    target = (request.get_json(silent=True) or {}).get('entry')
+    entry = journal.entry(target) if isinstance(target, int) else None
+    if entry is None or entry['workspace'] != workspace.workspace_id:
+        return f'Entry {target} not found.', 404
+    return travel(workspace, target)
+
+@app.route('/metrics', methods=['GET', 'DELETE'])
+def get_metrics():
+    """Returns histograms of request and stage timings and counters; DELETE starts them over."""
+    if not metrics.enabled:
+        return 'Metrics are disabled, start the server with SCHEMA_METRICS=1.', 404
+    if request.method == 'DELETE':
+        metrics.reset()
+    return json_response(metrics.snapshot())
@@ -0,0 +1,324 @@
+# ===============================================
+# edit_journal.py
+# ------------
+# journal of workspace edits with document snapshots, pruned to the recent history of each workspace
+# ===============================================
+
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from schema_patch import diff_json
+from serialization import dumps, loads
+
+# entries between two snapshots of the document on the way from the first upload
+SNAPSHOT_EVERY = 50
+# entries kept per workspace, counted back from its current entry
+KEEP_ENTRIES = 1000
+SNAPSHOT_LEVEL = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    workspace TEXT NOT NULL,
+    parent INTEGER,
+    depth INTEGER NOT NULL,
+    distance INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created REAL NOT NULL,
+    changes BLOB,
+    snapshot TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE INDEX IF NOT EXISTS entries_workspace ON entries (workspace, id);
+CREATE INDEX IF NOT EXISTS entries_snapshot ON entries (snapshot);
+CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, document BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS heads (workspace TEXT PRIMARY KEY, entry INTEGER NOT NULL, version INTEGER NOT NULL);
+"""
+
+ENTRY_COLUMNS = ('id', 'workspace', 'parent', 'depth', 'distance', 'operation', 'version', 'created', 'snapshot')
+
+
+def apply_changes(events, changes):
+    """Applies the changes of a journal entry to an events list, see SchemaPatch.changes."""
+    for position, _ in reversed(changes['removed']):
+        del events[position]
+    for position, _, after in changes['changed']:
+        events[position] = after
+    events.extend(changes['added'])
+
+
+def revert_changes(events, changes):
+    """Undoes apply_changes on an events list."""
+    del events[len(events) - len(changes['added']):]
+    for position, before, _ in changes['changed']:
+        events[position] = before
+    for position, event in changes['removed']:
+        events.insert(position, event)
+
+
+def document_changes(old, new):
+    """Finds the changes turning one document into another, in the format of SchemaPatch.changes.
+
+    Events equal at the start and at the end of both lists are left out;
+    in between, events are compared position by position, events only in
+    the old list are removed and events only in the new list are added at
+    the end. Documents differing in more than their events, or in more than
+    half of their events, are better stored whole.
+
+    Parameters:
+    old (dict): document before, e.g. the current document of a workspace
+    new (dict): document after, e.g. one posted to /reload
+
+    Returns:
+    changes (dict): the changes, or None if the new document has to be stored whole
+    """
+    if not old or {key: value for key, value in old.items() if key != 'events'} != \
+            {key: value for key, value in new.items() if key != 'events'}:
+        return None
+    before, after = old['events'], new['events']
+    start = 0
+    while start < len(before) and start < len(after) and before[start] == after[start]:
+        start += 1
+    end = 0
+    while end < min(len(before), len(after)) - start and before[-1 - end] == after[-1 - end]:
+        end += 1
+    if len(after) - end - start > len(before) - end - start:
+        # events can only be added at the end, the events after them are changed instead
+        end = 0
+    kept = len(after) - end - start if end else min(len(before), len(after)) - start
+    removed = [[position, before[position]] for position in range(start + kept, len(before) - end)]
+    changed = [[position, before[position], after[position]] for position in range(start, start + kept)
+               if before[position] != after[position]]
+    added = after[len(before) - len(removed):] if not end else []
+    if 2 * (len(removed) + len(changed) + len(added)) > max(len(after), 1):
+        return None
+    return {'removed': removed, 'changed': changed, 'added': added}
+
+
+def changes_ops(changes, length, undo=False):
+    """Creates the JSON Patch operations of apply_changes or revert_changes.
+
+    Parameters:
+    changes (dict): changes of a journal entry
+    length (int): number of events before the changes are applied or reverted
+    undo (bool): whether the changes are reverted
+
+    Returns:
+    ops (list): patch operations
+    """
+    if not undo:
+        ops = [{'op': 'remove', 'path': f'/events/{position}'} for position, _ in reversed(changes['removed'])]
+        for position, before, after in changes['changed']:
+            ops.extend(diff_json(before, after, f'/events/{position}'))
+        ops.extend({'op': 'add', 'path': '/events/-', 'value': event} for event in changes['added'])
+        return ops
+    ops = [{'op': 'remove', 'path': f'/events/{position}'}
+           for position in range(length - 1, length - len(changes['added']) - 1, -1)]
+    for position, before, after in changes['changed']:
+        ops.extend(diff_json(after, before, f'/events/{position}'))
+    ops.extend({'op': 'add', 'path': f'/events/{position}', 'value': event} for position, event in changes['removed'])
+    return ops
+
+
+class EditJournal:
+    """Edits of every workspace in an SQLite database, to restore and undo them.
+
+    Each entry holds the events an edit removed, changed and added (see
+    SchemaPatch.changes) and points at the entry it was made after, so the
+    entries of a workspace form a tree: undoing moves to the parent and an
+    edit made after undoing starts a new branch. Uploads, and every
+    snapshot_every-th entry on the way from them, also store the whole
+    document, so the document after any entry is its nearest snapshot plus
+    at most snapshot_every entries.
+
+    Whenever a snapshot is stored, a workspace with more than keep entries
+    is pruned to the last keep entries leading to its current entry: other
+    branches and older entries are deleted, the oldest entry kept becomes a
+    snapshot and documents no entry refers to any more are deleted.
+
+    The current entry and version of each workspace are kept in the heads
+    table. The database is in WAL mode, an edit costs one small transaction.
+
+    Parameters:
+    path (str): SQLite database file
+    snapshot_every (int): entries between snapshots
+    keep (int): entries kept per workspace
+    """
+
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY, keep=KEEP_ENTRIES):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def record(self, workspace_id, operation, version, changes=None, document=None, document_key=None):
+        """Appends an entry after the current entry of a workspace and makes it the current one.
+
+        Parameters:
+        workspace_id (str): id of the workspace
+        operation (str): route of the edit, e.g. 'POST /add_event'
+        version (int): version of the workspace after the edit
+        changes (dict): changes of the edit, None for an upload replacing the document, see document_changes
+        document (dict): document after the edit, stored when there are no changes or a snapshot is due
+        document_key (str): key of the uploaded document, to store the same upload once
+
+        Returns:
+        entry_id (int): id of the new entry
+        """
+        with self.lock, self.connection:
+            head = self._head(workspace_id)
+            parent = self._entry(head[0]) if head else None
+            depth = parent['depth'] + 1 if parent else 0
+            distance = parent['distance'] + 1 if parent and changes is not None else 0
+            snapshot = None
+            if changes is None or parent is None or distance >= self.snapshot_every:
+                distance = 0
+                snapshot = document_key or uuid.uuid4().hex
+                exists = self.connection.execute('SELECT 1 FROM documents WHERE key = ?', (snapshot,)).fetchone()
+                if not exists:
+                    self.connection.execute('INSERT INTO documents VALUES (?, ?)',
+                                            (snapshot, zlib.compress(dumps(document), SNAPSHOT_LEVEL)))
+            cursor = self.connection.execute(
+                'INSERT INTO entries (workspace, parent, depth, distance, operation, version, created, changes, snapshot)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (workspace_id, parent['id'] if parent else None, depth, distance, operation, version, time.time(),
+                 dumps(changes) if changes is not None else None, snapshot))
+            self._move(workspace_id, cursor.lastrowid, version)
+            if snapshot is not None:
+                self._prune(workspace_id, cursor.lastrowid)
+            return cursor.lastrowid
+
+    def move(self, workspace_id, entry_id, version):
+        """Makes an entry the current entry of a workspace, after undoing or redoing."""
+        with self.lock, self.connection:
+            self._move(workspace_id, entry_id, version)
+
+    def head(self, workspace_id):
+        """Returns (entry id, version) of the current entry of a workspace, or None."""
+        with self.lock:
+            return self._head(workspace_id)
+
+    def entry(self, entry_id):
+        """Returns an entry as a dict, with its changes, or None."""
+        with self.lock:
+            entry = self._entry(entry_id, changes=True)
+        if entry is not None and entry['changes'] is not None:
+            entry['changes'] = loads(entry['changes'])
+        return entry
+
+    def latest_child(self, entry_id):
+        """Returns the id of the last entry made after an entry, the one /redo goes to, or None."""
+        with self.lock:
+            row = self.connection.execute('SELECT MAX(id) FROM entries WHERE parent = ?', (entry_id,)).fetchone()
+        return row[0]
+
+    def history(self, workspace_id, limit=100):
+        """Returns the last entries of a workspace, oldest first, without their changes."""
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT {", ".join(ENTRY_COLUMNS)} FROM entries WHERE workspace = ? ORDER BY id DESC LIMIT ?',
+                (workspace_id, limit)).fetchall()
+        return [dict(zip(ENTRY_COLUMNS, row)) for row in reversed(rows)]
+
+    def steps(self, source, target, limit):
+        """Finds the entries to undo and redo to get from one entry to another.
+
+        Parameters:
+        source (int): id of the current entry
+        target (int): id of the entry to go to
+        limit (int): maximum number of entries to walk on each side
+
+        Returns:
+        undo (list): entries from source up to the common ancestor, which is excluded
+        redo (list): entries from below the common ancestor down to target
+        or None if the entries are further apart than limit
+        """
+        undo, redo = [], []
+        first, second = self.entry(source), self.entry(target)
+        while first['id'] != second['id']:
+            if len(undo) > limit or len(redo) > limit:
+                return None
+            if first['depth'] >= second['depth']:
+                undo.append(first)
+                first = self.entry(first['parent']) if first['parent'] is not None else None
+            else:
+                redo.append(second)
+                second = self.entry(second['parent']) if second['parent'] is not None else None
+            # entries of different uploads without a common ancestor
+            if first is None or second is None:
+                return None
+        redo.reverse()
+        return undo, redo
+
+    def document(self, entry_id):
+        """Rebuilds the document after an entry from the nearest snapshot before it.
+
+        Returns:
+        schema_json (dict): the document
+        """
+        with self.lock:
+            return self._document(entry_id)
+
+    def _document(self, entry_id):
+        entries = []
+        entry = self._entry(entry_id, changes=True)
+        while entry['snapshot'] is None:
+            entries.append(entry)
+            entry = self._entry(entry['parent'], changes=True)
+        row = self.connection.execute('SELECT document FROM documents WHERE key = ?', (entry['snapshot'],)).fetchone()
+        schema_json = loads(zlib.decompress(row[0]))
+        for entry in reversed(entries):
+            apply_changes(schema_json['events'], loads(entry['changes']))
+        return schema_json
+
+    def _prune(self, workspace_id, head_id):
+        # deletes the entries of a workspace except the last keep ones leading to its head
+        count = self.connection.execute('SELECT COUNT(*) FROM entries WHERE workspace = ?', (workspace_id,)).fetchone()[0]
+        if count <= self.keep:
+            return
+        kept = []
+        entry = self._entry(head_id)
+        while entry is not None and len(kept) < self.keep:
+            kept.append(entry)
+            entry = self._entry(entry['parent']) if entry['parent'] is not None else None
+        oldest = kept[-1]
+        if oldest['parent'] is not None:
+            snapshot = oldest['snapshot']
+            if snapshot is None:
+                snapshot = uuid.uuid4().hex
+                self.connection.execute('INSERT INTO documents VALUES (?, ?)',
+                                        (snapshot, zlib.compress(dumps(self._document(oldest['id'])), SNAPSHOT_LEVEL)))
+            self.connection.execute('UPDATE entries SET parent = NULL, distance = 0, snapshot = ? WHERE id = ?',
+                                    (snapshot, oldest['id']))
+        kept_ids = {entry['id'] for entry in kept}
+        deleted = [row for row in self.connection.execute(
+            'SELECT id, snapshot FROM entries WHERE workspace = ?', (workspace_id,)) if row[0] not in kept_ids]
+        self.connection.executemany('DELETE FROM entries WHERE id = ?', [(row[0],) for row in deleted])
+        for snapshot in {row[1] for row in deleted if row[1] is not None}:
+            if not self.connection.execute('SELECT 1 FROM entries WHERE snapshot = ?', (snapshot,)).fetchone():
+                self.connection.execute('DELETE FROM documents WHERE key = ?', (snapshot,))
+
+    def _head(self, workspace_id):
+        row = self.connection.execute('SELECT entry, version FROM heads WHERE workspace = ?', (workspace_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def _move(self, workspace_id, entry_id, version):
+        self.connection.execute('INSERT OR REPLACE INTO heads VALUES (?, ?, ?)', (workspace_id, entry_id, version))
+
+    def _entry(self, entry_id, changes=False):
+        columns = ENTRY_COLUMNS + ('changes',) if changes else ENTRY_COLUMNS
+        row = self.connection.execute(f'SELECT {", ".join(columns)} FROM entries WHERE id = ?', (entry_id,)).fetchone()
+        return dict(zip(columns, row)) if row else None
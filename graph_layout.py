@@ -0,0 +1,110 @@
+# ===============================================
+# graph_layout.py
+# ------------
+# layered left to right layout of graph views
+# ===============================================
+
+# edges that place their target in a later rank
+LAYOUT_EDGE_TYPES = frozenset(('step_child', 'child_outlink', 'step_participant'))
+RANK_SEP = 250
+NODE_SEP = 80
+# passes reordering the ranks to reduce crossings
+SWEEPS = 4
+
+
+def layered_layout(node_ids, edges, rank_sep=RANK_SEP, node_sep=NODE_SEP, sweeps=SWEEPS):
+    """Computes positions like the dagre layout of the viewer, ranks going from left to right.
+
+    Nodes are ranked by the longest path to them along step_child,
+    child_outlink and step_participant edges, ignoring the edges closing
+    cycles. Within a rank, nodes are ordered by the mean position of their
+    neighbours in the ranks before and after them, and each rank is
+    centered on y = 0.
+
+    Parameters:
+    node_ids (list): ids of the nodes to place, in the order they are shown
+    edges (list): edges between them, other edges are ignored
+    rank_sep (float): distance between ranks
+    node_sep (float): distance between nodes of a rank
+    sweeps (int): number of reordering passes
+
+    Returns:
+    positions (dict): {node_id: {'x': x, 'y': y}}
+    """
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    count = len(node_ids)
+    successors = [[] for _ in range(count)]
+    for edge in edges:
+        if edge.type not in LAYOUT_EDGE_TYPES:
+            continue
+        source, target = index.get(edge.source), index.get(edge.target)
+        if source is not None and target is not None and source != target:
+            successors[source].append(target)
+
+    # depth first search dropping edges back to nodes on the stack
+    state = [0] * count
+    dag = [[] for _ in range(count)]
+    for start in range(count):
+        if state[start]:
+            continue
+        state[start] = 1
+        stack = [(start, iter(successors[start]))]
+        while stack:
+            node, targets = stack[-1]
+            for target in targets:
+                if state[target] == 1:
+                    continue
+                dag[node].append(target)
+                if state[target] == 0:
+                    state[target] = 1
+                    stack.append((target, iter(successors[target])))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+
+    # longest path ranks in topological order
+    predecessors = [[] for _ in range(count)]
+    for node, targets in enumerate(dag):
+        for target in targets:
+            predecessors[target].append(node)
+    missing = [len(sources) for sources in predecessors]
+    topological = [node for node in range(count) if not missing[node]]
+    rank = [0] * count
+    for node in topological:
+        for target in dag[node]:
+            rank[target] = max(rank[target], rank[node] + 1)
+            missing[target] -= 1
+            if not missing[target]:
+                topological.append(target)
+
+    ranks = [[] for _ in range(max(rank, default=-1) + 1)]
+    for node in topological:
+        ranks[rank[node]].append(node)
+    position = [0] * count
+    for nodes in ranks:
+        for i, node in enumerate(nodes):
+            position[node] = i
+
+    def reorder(nodes, neighbours):
+        def key(node):
+            linked = neighbours[node]
+            if not linked:
+                return position[node]
+            return sum(position[other] for other in linked) / len(linked)
+        nodes.sort(key=key)
+        for i, node in enumerate(nodes):
+            position[node] = i
+
+    for _ in range(sweeps):
+        for nodes in ranks[1:]:
+            reorder(nodes, predecessors)
+        for nodes in reversed(ranks[:-1]):
+            reorder(nodes, dag)
+
+    positions = {}
+    for r, nodes in enumerate(ranks):
+        offset = (len(nodes) - 1) / 2
+        for i, node in enumerate(nodes):
+            positions[node_ids[node]] = {'x': r * rank_sep, 'y': (i - offset) * node_sep}
+    return positions
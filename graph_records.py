@@ -0,0 +1,121 @@
+# ===============================================
+# graph_records.py
+# ------------
+# compact nodes and edges of a schema graph
+# ===============================================
+
+import operator
+
+# SDF version 3.0
+schema_key_dict = {
+    'event': ['@id', 'name', 'comment', 'description', 'aka', 'qnode', 'qlabel', 'isSchema', 'goal', 'ta1explanation', 'importance', 'children_gate', 'instanceOf', 'probParent', 'probChild', 'probability', 'liklihood', 'wd_node', 'wd_label', 'wd_description', 'modality', 'participants', 'privateData', 'outlinks', 'entities', 'relations', 'children', 'optional', 'repeatable'],
+    'children': ['child', 'comment', 'optional', 'importance', 'outlinks'],
+    'privateData': ['@type', 'template', 'repeatable', 'importance'],
+    'entity': ['name', '@id', 'qnode', 'qlabel', 'centrality', 'wd_node', 'wd_label', 'wd_description', 'modality', 'aka','properties'],
+    'properties': ['property values'],
+    'relation': ['name', 'wd_node', 'wd_label', 'modality', 'wd_description', 'ta1ref', 'relationSubject', 'relationObject', 'relationPredicate']
+}
+SCHEMA_KEYS = {key: frozenset(keys) for key, keys in schema_key_dict.items()}
+
+
+class Node:
+    """Node of the schema graph.
+
+    Instead of copying the fields of the schema object it shows, the node
+    refers to the object and picks the fields listed in schema_key_dict when
+    it is turned into a Cytoscape node by to_dict(). The graph is rebuilt
+    around an event whenever the event is edited, so the fields are the same
+    as when the node was created.
+    """
+
+    __slots__ = ('id', 'label', 'type', 'shape', 'kind', 'source')
+
+    def __init__(self, node_id, label, node_type, shape=''):
+        self.id = node_id
+        self.label = label
+        self.type = node_type
+        self.shape = shape
+        # schema_key_dict key of the fields shown from source
+        self.kind = None
+        self.source = None
+
+    def to_dict(self):
+        """Returns the node in Cytoscape format, {'data': {...}, 'classes': ''}."""
+        data = {
+            'id': self.id,
+            '_label': self.label,
+            '_type': self.type,
+            '_shape': self.shape
+        }
+        classes = ''
+        source = self.source
+        if source is not None:
+            keys = SCHEMA_KEYS[self.kind]
+            for key, value in source.items():
+                if key in keys:
+                    if key == 'optional' and value:
+                        classes = 'optional'
+                    data[key] = value
+            if 'privateData' in source and len(source['privateData']) > 0:
+                keys = SCHEMA_KEYS['privateData']
+                for key in source['privateData'].keys():
+                    if key in keys:
+                        data[key] = source['privateData'][key]
+        return {'data': data, 'classes': classes}
+
+
+class Edge:
+    """Edge of the schema graph, turned into a Cytoscape edge by to_dict().
+
+    Edges are identified by the object, several edges may share the id
+    "source__target".
+    """
+
+    __slots__ = ('source', 'target', 'name', 'type', 'element_id', 'predicate')
+
+    def __init__(self, source, target, name='', edge_type=''):
+        self.source = source
+        self.target = target
+        self.name = name
+        self.type = edge_type
+        # @id of the participant or relation the edge shows, and the relation predicate
+        self.element_id = None
+        self.predicate = None
+
+    @property
+    def id(self):
+        return f"{self.source}__{self.target}"
+
+    def key(self):
+        """Returns a tuple of everything to_dict() shows, for comparing edges."""
+        return edge_key(self)
+
+    def to_dict(self):
+        """Returns the edge in Cytoscape format, {'data': {...}, 'classes': ''}."""
+        data = {
+            'id': self.id,
+            '_label': f"\n\u2060{self.name}\n\u2060",
+            'name': self.name,
+            'source': self.source,
+            'target': self.target,
+            '_edge_type': self.type
+        }
+        if self.element_id is not None:
+            data['@id'] = self.element_id
+        if self.predicate is not None:
+            data['predicate'] = self.predicate
+        return {'data': data, 'classes': ''}
+
+
+def frozen(value):
+    """Returns a JSON value with its lists as tuples, so that it can be part of an edge key.
+
+    Tuples are serialized as arrays, so the edge is shown the same.
+    """
+    if isinstance(value, list):
+        return tuple(map(frozen, value))
+    return value
+
+
+# Edge.key of many edges at once, e.g. map(edge_key, edges)
+edge_key = operator.attrgetter('source', 'target', 'name', 'type', 'element_id', 'predicate')
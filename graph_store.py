@@ -0,0 +1,136 @@
+# ===============================================
+# graph_store.py
+# ------------
+# indexed storage for the nodes and edges of a schema graph
+# ===============================================
+
+import itertools
+
+
+class GraphStore:
+    """Nodes and edges of a schema graph with adjacency indexes.
+
+    Edges keep their insertion order and are indexed by source, target and
+    _edge_type, so finding or removing the edges around a node does not scan
+    the whole edge list. An edge is identified by the edge dict itself.
+    """
+
+    def __init__(self, nodes=None):
+        self.nodes = nodes if nodes is not None else {}
+        self._edges = {}
+        self._by_source = {}
+        self._by_target = {}
+        self._by_type = {}
+        # bookkeeping for incremental updates, maintained by app.update_graph
+        self.contributions = {}
+        self.containers = {}
+        self.splicing = set()
+        # id() of each edge created by splicing a container -> @id of that container
+        self.spliced_by = {}
+        self.refs = {}
+        self.entity_refs = {}
+        self.root_prior = {}
+        self.order = {}
+        self.sequence = itertools.count()
+        self._changes = None
+
+    def __len__(self):
+        return len(self._edges)
+
+    @property
+    def edges(self):
+        """list: all edges in insertion order."""
+        return list(self._edges.values())
+
+    def add_edge(self, edge):
+        """Adds an edge and indexes it.
+
+        Parameters:
+        edge (Edge): edge created by create_edge
+
+        Returns:
+        edge (Edge): the added edge
+        """
+        key = id(edge)
+        self._edges[key] = edge
+        self._by_source.setdefault(edge.source, {})[key] = edge
+        self._by_target.setdefault(edge.target, {})[key] = edge
+        self._by_type.setdefault(edge.type, {})[key] = edge
+        if self._changes is not None:
+            self._changes['added'][key] = edge
+        return edge
+
+    def remove_edge(self, edge):
+        """Removes an edge and drops it from every index.
+
+        Parameters:
+        edge (Edge): edge previously passed to add_edge
+        """
+        key = id(edge)
+        if self._edges.pop(key, None) is None:
+            return
+        if self._changes is not None:
+            if key in self._changes['added']:
+                del self._changes['added'][key]
+            else:
+                self._changes['removed'][key] = edge
+        for index, value in ((self._by_source, edge.source),
+                             (self._by_target, edge.target),
+                             (self._by_type, edge.type)):
+            bucket = index[value]
+            del bucket[key]
+            if not bucket:
+                del index[value]
+
+    def out_edges(self, node_id, edge_type=None):
+        """Returns edges whose source is node_id, optionally of one _edge_type."""
+        edges = self._by_source.get(node_id, {}).values()
+        if edge_type is None:
+            return list(edges)
+        return [edge for edge in edges if edge.type == edge_type]
+
+    def in_edges(self, node_id, edge_type=None):
+        """Returns edges whose target is node_id, optionally of one _edge_type."""
+        edges = self._by_target.get(node_id, {}).values()
+        if edge_type is None:
+            return list(edges)
+        return [edge for edge in edges if edge.type == edge_type]
+
+    def edges_of_type(self, edge_type):
+        """Returns all edges of the given _edge_type."""
+        return list(self._by_type.get(edge_type, {}).values())
+
+    def has_edge(self, edge):
+        return id(edge) in self._edges
+
+    def has_in_edges(self, node_id):
+        return node_id in self._by_target
+
+    def has_out_edges(self, node_id):
+        return node_id in self._by_source
+
+    def sources(self):
+        """Returns ids of all nodes with at least one outgoing edge."""
+        return list(self._by_source)
+
+    def begin_changes(self):
+        """Starts recording the nodes and edges that change."""
+        self._changes = {'nodes': set(), 'added': {}, 'removed': {}}
+
+    def note_nodes(self, node_ids):
+        """Records nodes that were added, removed or edited while recording changes."""
+        if self._changes is not None:
+            self._changes['nodes'].update(node_ids)
+
+    def pop_changes(self):
+        """Stops recording changes.
+
+        Returns:
+        node_ids (set): ids of nodes that may have changed
+        added (list): edges added since begin_changes
+        removed (list): edges removed since begin_changes
+        """
+        changes, self._changes = self._changes, None
+        if changes is None:
+            return set(), [], []
+        return changes['nodes'], list(changes['added'].values()), list(changes['removed'].values())
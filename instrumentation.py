@@ -0,0 +1,237 @@
+# ===============================================
+# instrumentation.py
+# ------------
+# opt-in timings and counters of the request pipeline
+# ===============================================
+
+import bisect
+import cProfile
+import functools
+import os
+import re
+import threading
+import time
+
+from flask import g, has_request_context
+
+# upper bounds of the histogram buckets, the last bucket has no bound
+SECONDS_BOUNDS = tuple(0.0005 * 2 ** i for i in range(17))
+SIZE_BOUNDS = tuple(4 ** i for i in range(16))
+
+
+class Histogram:
+    """Count, sum, extremes and bucket counts of observed values.
+
+    Parameters:
+    bounds (tuple): increasing upper bounds of the buckets
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-quantile, or max for the last bucket."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': [{'le': bound, 'count': count}
+                        for bound, count in zip(self.bounds + ('+Inf',), self.buckets) if count]
+        }
+
+
+class Metrics:
+    """Histograms of stage timings and counters, aggregated per request.
+
+    Stages and counters of a request are summed while it runs and observed
+    once when it finishes, so a histogram shows e.g. the serialization time
+    per request rather than per call. Outside of requests they are observed
+    right away. Stages may nest, the time of a stage includes the stages
+    inside it.
+
+    Parameters:
+    enabled (bool): record anything at all, stage() costs next to nothing otherwise
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {}
+
+    def observe(self, metric, label, value, bounds=SECONDS_BOUNDS):
+        with self.lock:
+            histogram = self.histograms.get((metric, label))
+            if histogram is None:
+                histogram = self.histograms[metric, label] = Histogram(bounds)
+            histogram.observe(value)
+
+    def add(self, name, value, metric='stage_seconds'):
+        """Adds to a stage timing or counter of the current request."""
+        if has_request_context() and 'metrics' in g:
+            stages = g.metrics.setdefault(metric, {})
+            stages[name] = stages.get(name, 0) + value
+        else:
+            self.observe(metric, name, value, SECONDS_BOUNDS if metric == 'stage_seconds' else SIZE_BOUNDS)
+
+    def count(self, name, value):
+        """Records a counter of the current request, like the number of nodes sent."""
+        if self.enabled:
+            self.add(name, value, 'count')
+
+    def start_request(self):
+        g.metrics = {}
+        g.metrics_start = time.perf_counter()
+
+    def finish_request(self, route):
+        """Observes the timings and counters the current request collected."""
+        seconds = time.perf_counter() - g.metrics_start
+        self.observe('request_seconds', route, seconds)
+        for name, value in g.metrics.get('stage_seconds', {}).items():
+            self.observe('stage_seconds', name, value)
+        for name, value in g.metrics.get('count', {}).items():
+            self.observe('count', name, value, SIZE_BOUNDS)
+        del g.metrics
+        return seconds
+
+    def snapshot(self):
+        """Returns all histograms as {metric: {label: histogram}}."""
+        with self.lock:
+            result = {'uptime_seconds': time.time() - self.started}
+            for (metric, label), histogram in sorted(self.histograms.items()):
+                result.setdefault(metric, {})[label] = histogram.to_dict()
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.started = time.time()
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        metrics.add(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_STAGE = _NoStage()
+
+# enabled with SCHEMA_METRICS=1
+metrics = Metrics(os.environ.get('SCHEMA_METRICS', '') not in ('', '0'))
+
+
+def stage(name):
+    """Times the with block as a stage of the current request, e.g. with stage('serialize'): ..."""
+    if not metrics.enabled:
+        return NO_STAGE
+    return _Stage(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestProfiler:
+    """Profiles requests with cProfile and keeps the profiles of slow ones.
+
+    Profiles are written by Profile.dump_stats(), they can be read with
+    python -m pstats or snakeviz.
+
+    Parameters:
+    threshold (float): seconds above which a request is slow, 0 disables profiling
+    directory (str): where the profiles of slow requests are written
+    """
+
+    def __init__(self, threshold=0, directory='profiles'):
+        self.threshold = threshold
+        self.directory = directory
+
+    def start(self):
+        if not self.threshold:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            return
+        g.profile = profile
+        g.profile_start = time.perf_counter()
+
+    def stop(self):
+        """Stops profiling the current request, returns the profile and its duration or None."""
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None
+        profile.disable()
+        return profile, time.perf_counter() - g.pop('profile_start')
+
+    def finish(self, route):
+        """Stops profiling and writes the profile if the request was slow.
+
+        Returns:
+        path (str): file of the profile, or None
+        """
+        stopped = self.stop()
+        if stopped is None or stopped[1] < self.threshold:
+            return None
+        profile, seconds = stopped
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{int(seconds * 1000)}ms.prof')
+        profile.dump_stats(path)
+        return path
@@ -0,0 +1,105 @@
+# ===============================================
+# schema_cache.py
+# ------------
+# parsed schemas and graphs keyed by a hash of the uploaded bytes
+# ===============================================
+
+import collections
+import hashlib
+import threading
+
+
+def content_key(schema_bytes):
+    """Returns the cache key of an uploaded schema."""
+    return hashlib.sha256(schema_bytes).hexdigest()
+
+
+class CachedSchema:
+    """Parsed document, graph and index of one uploaded schema.
+
+    The objects are shared by every workspace that loaded the same bytes and
+    must not be edited in place; a workspace detaches from the entry before
+    its first edit (see app.begin_edit).
+    """
+
+    def __init__(self, key, size, schema_json, graph, index, report=None):
+        self.key = key
+        # bytes of the uploaded schema, used to bound the cache
+        self.size = size
+        self.schema_json = schema_json
+        self.graph = graph
+        self.index = index
+        # ValidationReport of the document, with its warnings
+        self.report = report
+        # body of the full /upload and /reload response and root name, filled in on first use
+        self.response = None
+        self.schema_name = None
+        # number of workspaces currently holding the entry
+        self.users = 0
+
+
+class SchemaCache:
+    """Least recently used cache of CachedSchema entries bounded by the size of their schemas.
+
+    Parameters:
+    max_bytes (int): total size of the cached schema files
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, key):
+        """Returns the entry for a key and counts the caller as a user, or returns None.
+
+        Every acquired or added entry has to be passed to release() once the
+        caller stops using it.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+            return entry
+
+    def add(self, entry):
+        """Adds an entry used by the caller, evicting the least recently used ones beyond max_bytes."""
+        with self._lock:
+            entry.users += 1
+            self._pop(entry.key)
+            if entry.size > self.max_bytes:
+                return
+            self._entries[entry.key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def release(self, entry, take=False):
+        """Stops using an entry.
+
+        Parameters:
+        entry (CachedSchema): entry returned by acquire() or passed to add()
+        take (bool): whether the caller wants to keep and edit the objects of the entry
+
+        Returns:
+        bool: True if the caller was the last user and now owns the objects,
+        which are then removed from the cache
+        """
+        with self._lock:
+            entry.users -= 1
+            if not take or entry.users > 0:
+                return False
+            if self._entries.get(entry.key) is entry:
+                self._pop(entry.key)
+            return True
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+        return entry
@@ -0,0 +1,126 @@
+# ===============================================
+# schema_diff.py
+# ------------
+# differences between two schema documents and their graphs, keyed by @id
+# ===============================================
+
+import collections
+
+from graph_records import edge_key
+from schema_index import DEFINITION_KEYS
+from schema_patch import diff_json
+
+MISSING = object()
+
+
+def changed_fields(old, new, ignored=()):
+    """Returns the top-level keys whose values differ between two elements, leaving out ignored ones."""
+    return [key for key in dict.fromkeys([*old, *new])
+            if key not in ignored and old.get(key, MISSING) != new.get(key, MISSING)]
+
+
+def diff_keyed(old, new, definitions=True, ignored=()):
+    """Compares the elements of two documents with the same @ids.
+
+    Parameters:
+    old (dict): {@id: [(element, event), ...]} of the first document, see SchemaIndex.get_definitions,
+                or {@id: event} with definitions False
+    new (dict): the same for the second document
+    definitions (bool): whether the elements are definitions, compared by their first one, or events
+    ignored (tuple): keys of the elements compared separately, e.g. the lists of events
+
+    Returns:
+    diff (dict): 'added', 'removed' and 'changed' elements, in the order they were indexed, each
+    {'@id', 'event', 'value'}, changed ones with 'fields' and a JSON 'patch' of these fields instead of 'value'
+    """
+    def entry(element_id, value, element):
+        if definitions:
+            return {'@id': element_id, 'event': value[0][1]['@id'], 'value': element}
+        return {'@id': element_id, 'value': element}
+
+    # the values are only unpacked, nothing is allocated for elements that did not change
+    added = []
+    changed = []
+    for element_id, value in new.items():
+        previous = old.get(element_id)
+        element = value[0][0] if definitions else value
+        if previous is None:
+            added.append(entry(element_id, value, element))
+            continue
+        before = previous[0][0] if definitions else previous
+        if before != element:
+            fields = changed_fields(before, element, ignored)
+            if fields:
+                item = entry(element_id, value, element)
+                del item['value']
+                item['fields'] = fields
+                item['patch'] = diff_json({field: before[field] for field in fields if field in before},
+                                          {field: element[field] for field in fields if field in element})
+                changed.append(item)
+    removed = [entry(element_id, value, value[0][0] if definitions else value)
+               for element_id, value in old.items() if element_id not in new]
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def pick_edges(edges, keys, counts):
+    """Returns as many edges of each key as counts holds, the first ones."""
+    picked = []
+    for edge, key in zip(edges, keys):
+        if key in counts and counts[key]:
+            counts[key] -= 1
+            picked.append(edge)
+    return picked
+
+
+def diff_edges(old, new):
+    """Compares the edges of two graphs by everything they show, see Edge.key.
+
+    Parameters:
+    old (GraphStore): graph of the first document
+    new (GraphStore): graph of the second document
+
+    Returns:
+    diff (dict): 'added' and 'removed' edges
+    """
+    old_edges, new_edges = old.edges, new.edges
+    old_keys, new_keys = list(map(edge_key, old_edges)), list(map(edge_key, new_edges))
+    old_counts, new_counts = collections.Counter(old_keys), collections.Counter(new_keys)
+    # the counts are compared as sets, leaving out the many keys counted the same in both without a Python loop
+    added_counts, removed_counts = {}, {}
+    for key, _ in old_counts.items() ^ new_counts.items():
+        difference = new_counts.get(key, 0) - old_counts.get(key, 0)
+        if difference > 0:
+            added_counts[key] = difference
+        elif difference < 0:
+            removed_counts[key] = -difference
+    added = pick_edges(new_edges, new_keys, added_counts)
+    removed = pick_edges(old_edges, old_keys, removed_counts)
+    return {'added': added, 'removed': removed}
+
+
+def diff_schemas(old_index, new_index, old_graph=None, new_graph=None):
+    """Creates the differences between two schema documents, matching elements by @id.
+
+    Events are compared without their entities, participants and
+    relations, which are compared on their own. Elements defined more than
+    once count with their first definition, as SchemaIndex.get_entity and
+    the others return them.
+
+    Parameters:
+    old_index (SchemaIndex): index of the first document
+    new_index (SchemaIndex): index of the second document
+    old_graph (GraphStore): graph of the first document, to compare edges
+    new_graph (GraphStore): graph of the second document
+
+    Returns:
+    diff (dict): 'events', 'entities', 'participants', 'relations' and, with the graphs, 'edges',
+                 each {'added', 'removed', 'changed'} (see diff_keyed), and 'summary' with their sizes
+    """
+    diff = {'events': diff_keyed(old_index.events, new_index.events, False, DEFINITION_KEYS)}
+    for key in DEFINITION_KEYS:
+        diff[key] = diff_keyed(old_index.get_definitions(key), new_index.get_definitions(key))
+    if old_graph is not None and new_graph is not None:
+        diff['edges'] = diff_edges(old_graph, new_graph)
+    diff['summary'] = {key: {change: len(items) for change, items in changes.items()}
+                       for key, changes in diff.items()}
+    return diff
@@ -0,0 +1,233 @@
+# ===============================================
+# schema_index.py
+# ------------
+# @id lookup tables over a schema document
+# ===============================================
+
+import bisect
+
+from search_index import SearchIndex
+
+# lists of an event that define elements with their own @id
+DEFINITION_KEYS = ('entities', 'participants', 'relations')
+
+
+def get_references(event):
+    """Lists the @ids an event refers to.
+
+    Parameters:
+    event (dict): event in the schema document
+
+    Returns:
+    list: (key, referenced @id) pairs, key being the event list holding the reference
+    """
+    references = [('children', child) for child in event.get('children', [])]
+    references.extend(('outlinks', outlink) for outlink in event.get('outlinks', []))
+    references.extend(('participants', participant['entity'])
+                      for participant in event.get('participants', []) if 'entity' in participant)
+    for relation in event.get('relations', []):
+        for key in ('relationSubject', 'relationObject'):
+            if key in relation:
+                references.append(('relations', relation[key]))
+    return references
+
+
+class SchemaIndex:
+    """Maps @ids of events, entities, participants and relations to their objects.
+
+    Entries point at the objects inside the schema document, so edits made
+    through them are edits of the document. Whenever an event or one of its
+    lists changes, index_event() has to be called again for that event.
+
+    The index also records which events refer to an @id through their
+    children, outlinks, participants or relations, so cascading deletes
+    only visit the events that are affected.
+    """
+
+    def __init__(self, schema_json=None):
+        self.events = {}
+        # key -> @id -> [(element, owning event), ...] in document order
+        self._definitions = {key: {} for key in DEFINITION_KEYS}
+        # referenced @id -> referring event @id -> key of the referring list -> number of references
+        self._references = {}
+        self._owned = {}
+        self._event_list = schema_json['events'] if schema_json else None
+        self._positions = None
+        self._search = None
+        if schema_json:
+            for event in schema_json['events']:
+                self.index_event(event)
+
+    def get_event(self, event_id):
+        """Returns the event with the given @id, or None."""
+        return self.events.get(event_id)
+
+    def get_entity(self, entity_id):
+        """Returns the entity with the given @id and the event defining it, or (None, None)."""
+        return self._lookup('entities', entity_id)
+
+    def get_participant(self, participant_id):
+        """Returns the participant with the given @id and its event, or (None, None)."""
+        return self._lookup('participants', participant_id)
+
+    def get_relation(self, relation_id):
+        """Returns the relation with the given @id and the event defining it, or (None, None)."""
+        return self._lookup('relations', relation_id)
+
+    def position(self, event):
+        """Returns the position of an event in the events list of the document, or None."""
+        if self._positions is None:
+            if self._event_list is None:
+                return None
+            self._positions = {id(listed): position for position, listed in enumerate(self._event_list)}
+        return self._positions.get(id(event))
+
+    def get_entity_ids(self):
+        """Returns the @ids of all defined entities, in the order they are first defined in the document."""
+        definitions = self._definitions['entities']
+        return sorted(definitions, key=lambda entity_id: min(
+            self._document_order(event, entity_id) for _, event in definitions[entity_id]))
+
+    def get_entity_usage(self, entity_id):
+        """Lists where an entity is defined and referred to, in document order.
+
+        Parameters:
+        entity_id (str): @id of the entity
+
+        Returns:
+        usage (dict): 'definitions', (entity, event) pairs of the events defining it;
+                      'participant_in', the event of each participant referring to it;
+                      'relations', (relation, event) pairs of relations with it as subject or object
+        """
+        definitions = sorted(self._definitions['entities'].get(entity_id, []),
+                             key=lambda definition: self._document_order(definition[1], entity_id))
+        participant_in = []
+        relations = []
+        referrers = [(self._owned[event_id][0], counts) for event_id, counts in self._references.get(entity_id, {}).items()]
+        for event, counts in sorted(referrers, key=lambda referrer: self._document_order(referrer[0])):
+            participant_in.extend([event] * counts.get('participants', 0))
+            if 'relations' in counts:
+                relations.extend((relation, event) for relation in event.get('relations', [])
+                                 if entity_id in (relation.get('relationSubject'), relation.get('relationObject')))
+        return {'definitions': definitions, 'participant_in': participant_in, 'relations': relations}
+
+    def search_index(self):
+        """Returns the SearchIndex of the document, built on first use and kept up to date afterwards."""
+        if self._search is None:
+            self._search = SearchIndex([event for event, _, _ in self._owned.values()])
+        return self._search
+
+    def get_definers(self, key, element_id):
+        """Returns the events whose list under key defines an element with the given @id."""
+        return [event for _, event in self._definitions[key].get(element_id, [])]
+
+    def get_definitions(self, key):
+        """Returns {@id: [(element, event), ...]} of all elements defined in the lists under key, not to be edited."""
+        return self._definitions[key]
+
+    def get_referrers(self, element_id):
+        """Returns the events that refer to an @id.
+
+        Parameters:
+        element_id (str): referenced @id
+
+        Returns:
+        list: (event, keys) pairs, keys being the set of event lists holding the references
+        """
+        return [(self._owned[event_id][0], set(keys))
+                for event_id, keys in self._references.get(element_id, {}).items()]
+
+    def index_event(self, event):
+        """Adds an event, or refreshes the entries of an event that was edited.
+
+        Parameters:
+        event (dict): event as it is in the schema document
+        """
+        event_id = event['@id']
+        if event_id in self._owned:
+            self._drop_owned(event_id)
+        self.events.setdefault(event_id, event)
+        if self._positions is not None and id(event) not in self._positions:
+            # events are only ever appended, anything else invalidates the positions
+            if self._event_list and self._event_list[-1] is event:
+                self._positions[id(event)] = len(self._event_list) - 1
+            else:
+                self._positions = None
+
+        if self._search is not None:
+            self._search.index_event(event)
+
+        owned = {}
+        for key in DEFINITION_KEYS:
+            ids = []
+            for element in event.get(key, []):
+                if '@id' not in element:
+                    continue
+                self._add_definition(self._definitions[key].setdefault(element['@id'], []), element, event)
+                ids.append(element['@id'])
+            owned[key] = ids
+        references = get_references(event)
+        for key, element_id in references:
+            counts = self._references.setdefault(element_id, {}).setdefault(event_id, {})
+            counts[key] = counts.get(key, 0) + 1
+        self._owned[event_id] = (event, owned, references)
+
+    def remove_event(self, event_id):
+        """Drops an event and everything defined in it.
+
+        Parameters:
+        event_id (str): @id of the removed event
+        """
+        if event_id in self._owned:
+            self._drop_owned(event_id)
+            del self._owned[event_id]
+        if self._search is not None:
+            self._search.remove_event(event_id)
+        self.events.pop(event_id, None)
+        self._positions = None
+
+    def _document_order(self, event, entity_id=None):
+        """Sort key of an event, and of an entity definition within it, by position in the document."""
+        position = self.position(event)
+        if position is None:
+            position = -1
+        if entity_id is None:
+            return position, 0
+        owned = self._owned.get(event['@id'])
+        ids = owned[1]['entities'] if owned and owned[0] is event else ()
+        return position, ids.index(entity_id) if entity_id in ids else 0
+
+    def _add_definition(self, definitions, element, event):
+        """Inserts a definition after those of earlier events, so that the first one is the first in the document."""
+        # an @id defined once, or defined again by the last event, needs no positions
+        if not definitions or definitions[-1][1] is event or (self._event_list and self._event_list[-1] is event):
+            definitions.append((element, event))
+            return
+        position = self.position(event)
+        if position is None:
+            definitions.append((element, event))
+            return
+        positions = [self.position(owner) for _, owner in definitions]
+        definitions.insert(bisect.bisect_right(positions, position), (element, event))
+
+    def _lookup(self, key, element_id):
+        definitions = self._definitions[key].get(element_id)
+        if not definitions:
+            return None, None
+        return definitions[0]
+
+    def _drop_owned(self, event_id):
+        event, owned, references = self._owned[event_id]
+        for element_id in {element_id for _, element_id in references}:
+            referrers = self._references[element_id]
+            referrers.pop(event_id, None)
+            if not referrers:
+                del self._references[element_id]
+        for key, ids in owned.items():
+            definitions = self._definitions[key]
+            for element_id in set(ids):
+                remaining = [(element, owner) for element, owner in definitions[element_id] if owner is not event]
+                if remaining:
+                    definitions[element_id] = remaining
+                else:
+                    del definitions[element_id]
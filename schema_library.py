@@ -0,0 +1,357 @@
+# ===============================================
+# schema_library.py
+# ------------
+# uploaded schemas stored on disk, opened lazily through memory-mapped files
+# ===============================================
+
+import collections
+import itertools
+import mmap
+import os
+import threading
+import time
+import uuid
+
+from serialization import dumps, loads
+
+# file of each stored schema: one line with the JSON header, then the events separated by commas
+SCHEMA_SUFFIX = '.schema'
+# name, number of events and size of each stored schema, so listing them opens no schema file
+CATALOG = 'catalog.json'
+
+
+def write_schema(path, schema_json, key, name):
+    """Writes a document to a file of the library.
+
+    The header holds the fields of the document other than events, the
+    events defining each entity and relation and, for each event, its @id,
+    name, children and outlinks and where it ends, so a schema is browsed
+    without parsing any event it does not show. The events are written one after the other
+    with commas between them, so that the whole list is read back by a
+    single parse.
+
+    Parameters:
+    path (str): file to write, replaced at once when it is complete
+    schema_json (dict): the document, validated
+    key (str): content key of the uploaded bytes, see schema_cache.content_key
+    name (str): name listed in the library
+
+    Returns:
+    header (dict): the header written
+    """
+    events = schema_json['events']
+    chunks = [dumps(event) for event in events]
+    entities = {}
+    relations = {}
+    for position, event in enumerate(events):
+        for entity in event.get('entities', ()):
+            entities.setdefault(entity['@id'], position)
+        for relation in event.get('relations', ()):
+            positions = relations.setdefault(relation['relationSubject'], [])
+            if not positions or positions[-1] != position:
+                positions.append(position)
+    header = {
+        'key': key,
+        'name': name,
+        'document': {field: value for field, value in schema_json.items() if field != 'events'},
+        'ids': [event['@id'] for event in events],
+        'names': [event['name'] for event in events],
+        'children': [event.get('children', []) for event in events],
+        'outlinks': [event['outlinks'] for event in events],
+        # position of the first event defining each entity, and of the events defining relations from each @id
+        'entities': entities,
+        'relations': relations,
+        # end of each event after the header, the next one starts after its comma
+        'ends': list(itertools.accumulate(len(chunk) + 1 for chunk in chunks))
+    }
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(dumps(header))
+        f.write(b'\n')
+        f.write(b','.join(chunks))
+    os.replace(temporary, path)
+    return header
+
+
+class StoredSchema:
+    """A schema of the library opened for reading.
+
+    Only the header is parsed when the schema is opened; events are read
+    from the memory-mapped file when they are asked for, so the operating
+    system keeps in memory only the pages of events actually shown.
+
+    Parameters:
+    schema_id (str): id of the schema in the library
+    path (str): file of the schema, see write_schema
+    """
+
+    def __init__(self, schema_id, path):
+        self.schema_id = schema_id
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        newline = self._map.find(b'\n')
+        header = loads(self._map[:newline])
+        self.key = header['key']
+        self.name = header['name']
+        self.document = header['document']
+        self.ids = header['ids']
+        self.names = header['names']
+        self.children = header['children']
+        self.outlinks = header['outlinks']
+        self._entities = header['entities']
+        self._relations = header['relations']
+        self._base = newline + 1
+        self._ends = header['ends']
+        # @id -> position of the first event with it
+        self.positions = {}
+        for position, event_id in enumerate(self.ids):
+            self.positions.setdefault(event_id, position)
+        # bytes of the header, which its parsed form takes roughly in proportion, used to bound the library
+        self.size = newline
+        # bytes of the events, the size of the schema as uploaded without whitespace
+        self.events_size = len(self._map) - self._base
+        # results derived from the schema, e.g. the body of its root view, kept while it is open
+        self.views = {}
+        # number of requests currently reading the schema
+        self.users = 0
+        self._roots = None
+        self._referrers = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, event_id):
+        return event_id in self.positions
+
+    def _read(self, position):
+        start = self._base + (self._ends[position - 1] if position else 0)
+        return self._map[start:self._base + self._ends[position] - 1]
+
+    def event_bytes(self, event_id):
+        """Returns the JSON of an event as stored, or None if the schema has no such event."""
+        position = self.positions.get(event_id)
+        return None if position is None else self._read(position)
+
+    def event(self, event_id):
+        """Returns an event parsed from the file, or None."""
+        position = self.positions.get(event_id)
+        return None if position is None else loads(self._read(position))
+
+    def events(self, event_ids):
+        """Returns the events with the given @ids that the schema has, in document order."""
+        positions = sorted({self.positions[event_id] for event_id in event_ids if event_id in self.positions})
+        return [loads(self._read(position)) for position in positions]
+
+    def listed(self, event_ids):
+        """Returns the @ids of the children and outlinks of the given events.
+
+        Events whose name mentions outlinks may be shown as containers,
+        which are spliced out of the graph and link to what they list, so
+        what they list is listed too.
+        """
+        listed = []
+        seen = set(event_ids)
+        pending = list(event_ids)
+        while pending:
+            position = self.positions.get(pending.pop())
+            if position is None:
+                continue
+            for event_id in (*self.children[position], *self.outlinks[position]):
+                if event_id in seen:
+                    continue
+                seen.add(event_id)
+                listed.append(event_id)
+                listed_position = self.positions.get(event_id)
+                if listed_position is not None and 'outlinks' in self.names[listed_position].lower():
+                    pending.append(event_id)
+        return listed
+
+    def subtree(self, event_id):
+        """Returns the events building the graph shown when an event is selected, in document order.
+
+        These are the event, the events it lists as children or outlinks,
+        the events those list, which are shown when they are linked to each
+        other or behind a gate, the events defining the entities of their
+        participants and the relations from any of them, and the first
+        events listing those that may be containers.
+        """
+        listed = self.listed([event_id])
+        shown = [event_id, *listed, *self.listed(listed)]
+        events = {self.positions[shown_id]: None for shown_id in shown if shown_id in self.positions}
+        for position in events:
+            events[position] = loads(self._read(position))
+        entity_ids = {participant['entity'] for event in events.values() for participant in event.get('participants', ())}
+        defining = {self._entities[entity_id] for entity_id in entity_ids if entity_id in self._entities}
+        for element_id in (*shown, *entity_ids):
+            defining.update(self._relations.get(element_id, ()))
+        # a container is only spliced after an earlier event lists it
+        referrers = self.referrers()
+        defining.update(referrers[shown_id] for shown_id in shown if shown_id in referrers)
+        for position in defining.difference(events):
+            events[position] = loads(self._read(position))
+        return [events[position] for position in sorted(events)]
+
+    def referrers(self):
+        """Returns {@id: position of the first event listing it} of the events that may be shown as containers.
+
+        As in listed(), events whose name mentions outlinks may be
+        containers; only those listed by an event before them are kept.
+        """
+        if self._referrers is None:
+            candidates = {event_id: position for event_id, position in self.positions.items()
+                          if 'outlinks' in self.names[position].lower()}
+            referrers = {}
+            for position, (children, outlinks) in enumerate(zip(self.children, self.outlinks)):
+                for listed in (*children, *outlinks):
+                    if listed in candidates and listed not in referrers and position < candidates[listed]:
+                        referrers[listed] = position
+            self._referrers = referrers
+        return self._referrers
+
+    def roots(self):
+        """Returns the @ids of the events no other event lists as a child or outlink, those with children first."""
+        if self._roots is None:
+            referenced = set(itertools.chain.from_iterable(self.children))
+            referenced.update(itertools.chain.from_iterable(self.outlinks))
+            roots = [event_id for event_id in self.positions if event_id not in referenced]
+            self._roots = sorted(roots, key=lambda event_id: not self.children[self.positions[event_id]])
+        return self._roots
+
+    def to_json(self):
+        """Returns the whole document, parsed from the file at once."""
+        events = loads(b'[' + self._map[self._base:] + b']') if self.ids else []
+        return dict(self.document, events=events)
+
+    def close(self):
+        self._map.close()
+
+
+class SchemaLibrary:
+    """Schemas stored in a directory, opened on demand and closed again under a memory budget.
+
+    Schemas are stored once per uploaded content and keep the content key
+    as their id. Open schemas are kept from the least to the most recently
+    used, and idle ones are closed from the least recently used end while
+    their headers take more than max_bytes; the events themselves are only
+    mapped and never count.
+
+    Parameters:
+    directory (str): directory of the schema files, created if needed
+    max_bytes (int): total size of the headers of open schemas
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._open = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._catalog = self._read_catalog()
+
+    def __len__(self):
+        return len(self._catalog)
+
+    def __contains__(self, schema_id):
+        return schema_id in self._catalog
+
+    def path(self, schema_id):
+        return os.path.join(self.directory, schema_id + SCHEMA_SUFFIX)
+
+    def schemas(self):
+        """Lists the stored schemas, oldest first, each {'id', 'name', 'events', 'bytes', 'created'}."""
+        with self._lock:
+            return [dict(entry, id=schema_id) for schema_id, entry in self._catalog.items()]
+
+    def add(self, key, schema_json, name=None):
+        """Stores a document unless the library already has the same upload.
+
+        Parameters:
+        key (str): content key of the uploaded bytes, the id of the schema
+        schema_json (dict): the document, validated
+        name (str): name listed in the library, by default the @id of the document
+
+        Returns:
+        schema_id (str): id of the stored schema
+        """
+        if key in self._catalog:
+            return key
+        name = name or schema_json.get('name') or schema_json.get('@id') or key
+        path = self.path(key)
+        write_schema(path, schema_json, key, name)
+        with self._lock:
+            self._catalog[key] = {'name': name, 'events': len(schema_json['events']),
+                                  'bytes': os.path.getsize(path), 'created': time.time()}
+            self._write_catalog()
+        return key
+
+    def acquire(self, schema_id):
+        """Opens a stored schema, or returns it if it is open, and counts the caller as a user.
+
+        Every schema returned has to be passed to release() once the caller
+        stops reading it.
+
+        Returns:
+        schema (StoredSchema): the schema, or None if the library has no such schema
+        """
+        with self._lock:
+            schema = self._open.get(schema_id)
+            if schema is not None:
+                self._open.move_to_end(schema_id)
+                schema.users += 1
+                return schema
+            if schema_id not in self._catalog:
+                return None
+        # parsing the header does not hold up other schemas, the first one opened is kept
+        opened = StoredSchema(schema_id, self.path(schema_id))
+        with self._lock:
+            schema = self._open.get(schema_id)
+            if schema is None:
+                schema = self._open[schema_id] = opened
+                self.size += schema.size
+            else:
+                opened.close()
+                self._open.move_to_end(schema_id)
+            schema.users += 1
+            self._evict()
+        return schema
+
+    def release(self, schema):
+        """Stops reading a schema returned by acquire()."""
+        with self._lock:
+            schema.users -= 1
+            self._evict()
+
+    def _evict(self):
+        # close idle schemas from the least recently used end, never one being read
+        for schema_id, schema in list(self._open.items()):
+            if self.size <= self.max_bytes:
+                break
+            if schema.users == 0:
+                del self._open[schema_id]
+                self.size -= schema.size
+                schema.close()
+
+    def _read_catalog(self):
+        path = os.path.join(self.directory, CATALOG)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return loads(f.read())
+        # e.g. schema files copied from another server, listed from their headers
+        catalog = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            if not file_name.endswith(SCHEMA_SUFFIX):
+                continue
+            schema = StoredSchema(file_name[:-len(SCHEMA_SUFFIX)], os.path.join(self.directory, file_name))
+            path = self.path(schema.schema_id)
+            catalog[schema.schema_id] = {'name': schema.name, 'events': len(schema),
+                                         'bytes': os.path.getsize(path), 'created': os.path.getmtime(path)}
+            schema.close()
+        return catalog
+
+    def _write_catalog(self):
+        path = os.path.join(self.directory, CATALOG)
+        temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(dumps(self._catalog))
+        os.replace(temporary, path)
@@ -0,0 +1,212 @@
+# ===============================================
+# schema_patch.py
+# ------------
+# JSON Patch deltas of the schema document and graph
+# ===============================================
+
+import bisect
+import copy
+
+
+def escape_pointer(key):
+    """Escapes a key for use in a JSON Pointer (RFC 6901)."""
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def diff_json(old, new, path=''):
+    """Creates JSON Patch (RFC 6902) operations turning old into new.
+
+    Dictionaries are compared key by key and lists position by position,
+    with items added or removed at the end of a list.
+
+    Parameters:
+    old: previous value
+    new: current value
+    path (str): JSON Pointer of the values
+
+    Returns:
+    ops (list): patch operations
+    """
+    if type(old) is not type(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    if isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{escape_pointer(key)}'})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': f'{path}/{escape_pointer(key)}', 'value': value})
+            else:
+                ops.extend(diff_json(old[key], value, f'{path}/{escape_pointer(key)}'))
+        return ops
+    if isinstance(new, list):
+        if old == new:
+            return []
+        common = min(len(old), len(new))
+        ops = []
+        for position in range(common):
+            ops.extend(diff_json(old[position], new[position], f'{path}/{position}'))
+        ops.extend({'op': 'add', 'path': f'{path}/-', 'value': value} for value in new[common:])
+        ops.extend({'op': 'remove', 'path': f'{path}/{position}'}
+                   for position in range(len(old) - 1, common - 1, -1))
+        return ops
+    if old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
+
+
+class SchemaPatch:
+    """Records the events a mutation route changes and turns them into a JSON Patch.
+
+    Routes call touch() before editing an event, remove() before deleting one
+    and add() after appending one. Only those events are compared, so the
+    patch costs as much as the edit rather than the whole document. Events
+    passed to remove() are deleted all at once or in the same order.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._before = {}
+        # positions in the document before the edit of the deleted events
+        self._removed = []
+        # (event, position) of events passed to remove() and still in the list
+        self._removing = []
+        # position -> deleted event
+        self._removed_events = {}
+        self._added = {}
+
+    def touch(self, event):
+        """Remembers an event as it was before being edited."""
+        if id(event) not in self._before and id(event) not in self._added:
+            self._before[id(event)] = (event, copy.deepcopy(event))
+
+    def remove(self, event):
+        """Remembers the position of an event that is about to be deleted."""
+        if self._added.pop(id(event), None) is not None:
+            # appended by the same edit, the patch never adds it
+            return
+        if self._removing and self.index.position(self._removing[0][0]) is None:
+            removing = []
+            for removed_event, position in self._removing:
+                if self.index.position(removed_event) is None:
+                    bisect.insort(self._removed, position)
+                else:
+                    removing.append((removed_event, position))
+            self._removing = removing
+        # shift the position past the events deleted before
+        position = self.index.position(event)
+        for removed in self._removed:
+            if removed > position:
+                break
+            position += 1
+        self._removing.append((event, position))
+        self._removed_events[position] = event
+
+    def originals(self):
+        """Returns (event, copy of the event before its first edit) pairs of the touched events."""
+        return list(self._before.values())
+
+    def changes(self):
+        """Returns the recorded changes as stored in the edit journal.
+
+        Returns:
+        changes (dict): {'removed': [[position, event]], 'changed': [[position, before, after]], 'added': [event]},
+        removed positions are those of the document before the edit, changed positions those after the removals
+        """
+        removed = [[position, self._before.get(id(event), (None, event))[1]]
+                   for position, event in sorted(self._removed_events.items())]
+        changed = []
+        for event, before in self._before.values():
+            position = self.index.position(event)
+            if position is not None and event != before:
+                changed.append([position, before, event])
+        return {'removed': removed, 'changed': changed, 'added': list(self._added.values())}
+
+    def add(self, event):
+        """Remembers an event appended to the events list."""
+        self._added[id(event)] = event
+
+    def ops(self):
+        """Returns the JSON Patch operations for all recorded changes.
+
+        Removals come first, in descending position, followed by the edits of
+        remaining events and the appended events.
+        """
+        removed = self._removed + [position for _, position in self._removing]
+        ops = [{'op': 'remove', 'path': f'/events/{position}'}
+               for position in sorted(removed, reverse=True)]
+        for event, before in self._before.values():
+            # deleted events have no position
+            position = self.index.position(event)
+            if position is not None:
+                ops.extend(diff_json(before, event, f'/events/{position}'))
+        ops.extend({'op': 'add', 'path': '/events/-', 'value': event} for event in self._added.values())
+        return ops
+
+
+def graph_patch(graph, node_ids, added_edges, removed_edges):
+    """Creates the delta of a graph from the nodes and edges that changed.
+
+    Edges that were removed and added again unchanged cancel out. Clients
+    apply the removals before the additions. Edge ids are not unique, so an
+    edge sharing its id with a removed one is sent again.
+
+    Parameters:
+    graph (GraphStore): current nodes and edges
+    node_ids (iterable): ids of nodes that may have changed
+    added_edges (list): edges added to the graph
+    removed_edges (list): edges removed from the graph
+
+    Returns:
+    patch (dict): {'nodes': {'update': [...], 'remove': [...]}, 'edges': {'add': [...], 'remove': [...]}}
+    """
+    removed = {}
+    for edge in removed_edges:
+        removed.setdefault(edge.key(), []).append(edge)
+    added = []
+    for edge in added_edges:
+        same = removed.get(edge.key())
+        if same:
+            same.pop()
+        else:
+            added.append(edge)
+    removed_ids = {}
+    for edges in removed.values():
+        for edge in edges:
+            removed_ids[edge.id] = edge.source
+    resent = {id(edge) for edge in added}
+    for edge_id, source in removed_ids.items():
+        for edge in graph.out_edges(source):
+            if edge.id == edge_id and id(edge) not in resent:
+                added.append(edge)
+                resent.add(id(edge))
+    return {
+        'nodes': {
+            'update': [graph.nodes[node_id] for node_id in node_ids if node_id in graph.nodes],
+            'remove': [node_id for node_id in node_ids if node_id not in graph.nodes]
+        },
+        'edges': {
+            'add': added,
+            'remove': list(removed_ids)
+        }
+    }
+
+
+def diff_graphs(old, new, edited=()):
+    """Creates the delta between two graphs, e.g. before and after a reload.
+
+    Parameters:
+    old (GraphStore): previous graph
+    new (GraphStore): current graph
+    edited (iterable): ids of nodes showing objects edited in place, which both graphs show the same
+
+    Returns:
+    patch (dict): same format as graph_patch
+    """
+    node_ids = [node_id for node_id, node in new.nodes.items()
+                if node_id not in old.nodes or old.nodes[node_id].to_dict() != node.to_dict()]
+    node_ids.extend(node_id for node_id in old.nodes if node_id not in new.nodes)
+    changed = set(node_ids)
+    node_ids.extend(node_id for node_id in edited if node_id in new.nodes and node_id not in changed)
+    return graph_patch(new, node_ids, new.edges, old.edges)
@@ -0,0 +1,216 @@
+# ===============================================
+# schema_stream.py
+# ------------
+# incremental parsing of (gzip compressed) schema uploads
+# ===============================================
+
+import codecs
+import hashlib
+import json
+import re
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 1 << 16
+# largest upload accepted, once decompressed
+MAX_SCHEMA_BYTES = 512 << 20
+# longest single value, e.g. one event, the streaming parser reads ahead for
+MAX_VALUE_CHARS = 64 << 20
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+
+class UploadTooLarge(ValueError):
+    """Raised for an upload larger than allowed once decompressed."""
+
+    def __init__(self, max_bytes):
+        super().__init__(f'the upload is larger than {max_bytes} bytes once decompressed')
+
+
+# errors of an upload that cannot be read as a document: not JSON, not UTF-8, corrupt or truncated gzip, or too large
+DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError, zlib.error, EOFError, UploadTooLarge)
+
+
+def decompress(schema_bytes, max_bytes=MAX_SCHEMA_BYTES):
+    """Returns the bytes of an upload, gunzipped if they are gzip compressed.
+
+    Parameters:
+    schema_bytes (bytes): the upload
+    max_bytes (int): largest size of the returned bytes, larger uploads raise UploadTooLarge
+    """
+    if schema_bytes[:2] != GZIP_MAGIC:
+        if len(schema_bytes) > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        return schema_bytes
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # inflating stops one byte past the limit, whatever the compressed data expands to
+    schema_bytes = decompressor.decompress(schema_bytes, max_bytes + 1)
+    if len(schema_bytes) > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    if not decompressor.eof:
+        raise EOFError('the compressed upload is truncated')
+    return schema_bytes
+
+
+class UploadReader:
+    """Iterates over the bytes of an uploaded file in chunks.
+
+    Gzip compressed uploads are recognized by their magic number and
+    decompressed on the fly, at most chunk_size bytes at a time. The digest
+    and size describe the decompressed bytes, so they match decompress() of
+    the same upload.
+
+    Parameters:
+    stream (file): binary file object of the upload
+    chunk_size (int): bytes read at a time
+    max_bytes (int): largest size of the upload once decompressed, more raises UploadTooLarge
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE, max_bytes=MAX_SCHEMA_BYTES):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def __iter__(self):
+        chunk = self.stream.read(self.chunk_size)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == GZIP_MAGIC else None
+        while chunk:
+            if decompressor:
+                while chunk:
+                    yield self._count(decompressor.decompress(chunk, self.chunk_size))
+                    chunk = decompressor.unconsumed_tail
+            else:
+                yield self._count(chunk)
+            chunk = self.stream.read(self.chunk_size)
+        if decompressor:
+            yield self._count(decompressor.flush())
+            if not decompressor.eof:
+                raise EOFError('the compressed upload is truncated')
+
+    def text(self):
+        """Iterates over the upload decoded as UTF-8."""
+        return codecs.iterdecode(self, 'utf-8')
+
+    def _count(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.digest.update(chunk)
+        return chunk
+
+
+class _Buffer:
+    """Text read from chunks, from which consumed text is dropped as parsing goes on."""
+
+    def __init__(self, chunks, max_value=MAX_VALUE_CHARS):
+        self.chunks = iter(chunks)
+        self.max_value = max_value
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, minimum=1):
+        """Reads at least minimum more characters, returns False at the end of the input."""
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        wanted = len(self.text) + minimum
+        while len(self.text) < wanted:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                return False
+            self.text += chunk
+        return True
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or '' at the end of the input."""
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, characters):
+        """Consumes one of the given characters and returns it."""
+        character = self.peek()
+        if not character or character not in characters:
+            self.error(f'Expecting one of {characters!r}')
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Parses the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # the value may continue in the next chunks, read as much again before retrying,
+                # but not past max_value characters, so that malformed JSON does not read the rest of the input
+                pending = len(self.text) - self.pos
+                if pending >= self.max_value:
+                    self.error(f'Expecting a value of at most {self.max_value} characters')
+                if not self.fill(min(max(pending, CHUNK_SIZE), self.max_value - pending)):
+                    return self._last_value()
+                continue
+            # numbers and literals can be cut off at the end of the text
+            if end == len(self.text) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def _last_value(self):
+        value, self.pos = self.decoder.raw_decode(self.text, self.pos)
+        return value
+
+    def error(self, message):
+        raise json.JSONDecodeError(message, self.text, self.pos)
+
+
+def parse_schema(chunks, on_event=None, max_value=MAX_VALUE_CHARS):
+    """Parses a schema document from chunks of text, one event at a time.
+
+    Only the current chunk and the event being parsed are kept as text, so
+    the whole file never has to be held in memory next to the parsed document.
+
+    Parameters:
+    chunks (iterable): text of the document in pieces
+    on_event (function): called with each event right after it is appended to the events list
+    max_value (int): longest text of a single value, e.g. one event, longer ones raise json.JSONDecodeError
+
+    Returns:
+    schema_json (dict): the parsed document, equal to json.loads of the whole text
+    """
+    buffer = _Buffer(chunks, max_value)
+    schema_json = {}
+    buffer.expect('{')
+    if buffer.peek() == '}':
+        buffer.pos += 1
+    else:
+        while True:
+            key = buffer.value()
+            if not isinstance(key, str):
+                buffer.error('Expecting property name enclosed in double quotes')
+            buffer.expect(':')
+            if key == 'events' and buffer.peek() == '[':
+                buffer.pos += 1
+                events = schema_json[key] = []
+                if buffer.peek() == ']':
+                    buffer.pos += 1
+                else:
+                    while True:
+                        events.append(buffer.value())
+                        if on_event:
+                            on_event(events[-1])
+                        if buffer.expect(',]') == ']':
+                            break
+            else:
+                schema_json[key] = buffer.value()
+            if buffer.expect(',}') == '}':
+                break
+    if buffer.peek():
+        buffer.error('Extra data')
+    return schema_json
@@ -0,0 +1,383 @@
+# ===============================================
+# schema_validator.py
+# ------------
+# checks uploaded schema documents before their graph is built
+# ===============================================
+
+# fields of each kind of element, key -> (type, required), covering what building and showing the graph reads;
+# a type is a Python type or a list holding the type or kind of its items
+SDF_SPEC = {
+    'document': {
+        'events': (['event'], True)
+    },
+    'event': {
+        '@id': (str, True),
+        'name': (str, True),
+        'outlinks': ([str], True),
+        'children': ([str], False),
+        'children_gate': (str, False),
+        'participants': (['participant'], False),
+        'entities': (['entity'], False),
+        'relations': (['relation'], False),
+        'privateData': (dict, False)
+    },
+    'participant': {
+        '@id': (str, True),
+        'roleName': (str, True),
+        'entity': (str, True)
+    },
+    'entity': {
+        '@id': (str, True),
+        'name': (str, True)
+    },
+    'relation': {
+        '@id': (str, True),
+        'name': (str, True),
+        'relationSubject': (str, True),
+        'relationObject': (str, True)
+    }
+}
+# fields required by the presence of another one, kind -> {field: required field}
+SDF_DEPENDENCIES = {
+    'event': {'children': 'children_gate'}
+}
+# problems listed in a report, the others are only counted
+MAX_PROBLEMS = 1000
+
+TYPE_NAMES = {str: 'a string', dict: 'an object', list: 'a list', bool: 'a boolean'}
+MISSING = object()
+
+
+class SchemaValidationError(ValueError):
+    """Raised for a document that cannot be loaded, with the report of all its errors."""
+
+    def __init__(self, report):
+        super().__init__(f'{report.error_count} errors, the first one at {report.errors[0]["path"] or "/"}: '
+                         f'{report.errors[0]["message"]}')
+        self.report = report
+
+
+class ValidationReport:
+    """Errors and warnings found in a document, each as {'path': JSON Pointer, 'message': str}.
+
+    Errors are problems building the graph would fail on. Warnings are
+    references to @ids the document does not define and duplicate event
+    @ids, which the graph shows as placeholder nodes or merges.
+    """
+
+    def __init__(self, max_problems=MAX_PROBLEMS):
+        self.max_problems = max_problems
+        self.errors = []
+        self.warnings = []
+        self.error_count = 0
+        self.warning_count = 0
+
+    @property
+    def valid(self):
+        return self.error_count == 0
+
+    def error(self, path, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_problems:
+            self.errors.append({'path': path, 'message': message})
+
+    def warning(self, path, message):
+        self.warning_count += 1
+        if len(self.warnings) < self.max_problems:
+            self.warnings.append({'path': path, 'message': message})
+
+    def to_dict(self):
+        return {
+            'valid': self.valid,
+            'errorCount': self.error_count,
+            'warningCount': self.warning_count,
+            'errors': self.errors,
+            'warnings': self.warnings
+        }
+
+
+def parse_error_report(error):
+    """Returns the report of an upload that is not valid JSON."""
+    report = ValidationReport()
+    report.error('', f'not valid JSON: {error}')
+    return report
+
+
+def describe(allowed):
+    """Returns how a type of SDF_SPEC is named in messages."""
+    if isinstance(allowed, list):
+        return 'a list'
+    return TYPE_NAMES.get(allowed, allowed.__name__)
+
+
+def compile_value(allowed, checkers):
+    """Turns a type of SDF_SPEC into a function reporting what is wrong with a value, check(value, path, report).
+
+    Parameters:
+    allowed: the type
+    checkers (dict): checkers of the kinds of elements, looked up when a list of elements is checked
+
+    Returns:
+    check (function): the checker, path being the JSON Pointer of the value
+    """
+    expected = describe(allowed)
+    if isinstance(allowed, list):
+        item = allowed[0]
+        if isinstance(item, str):
+            def check(value, path, report):
+                if type(value) is not list:
+                    report.error(path, f'must be {expected} of {item}s')
+                    return
+                check_element = checkers[item]
+                for position, element in enumerate(value):
+                    check_element(element, f'{path}/{position}', report)
+        else:
+            item_expected = describe(item)
+
+            def check(value, path, report):
+                if type(value) is not list:
+                    report.error(path, f'must be {expected}')
+                    return
+                for position, element in enumerate(value):
+                    if type(element) is not item:
+                        report.error(f'{path}/{position}', f'must be {item_expected}')
+    else:
+        def check(value, path, report):
+            if type(value) is not allowed:
+                report.error(path, f'must be {expected}')
+    return check
+
+
+def compile_element(kind, fields, dependencies, checkers):
+    """Turns the fields of a kind of element into a function reporting what is wrong with an element.
+
+    Returns:
+    check (function): check(element, path, report), returning whether the element is an object
+    """
+    checks = [(key, required, compile_value(allowed, checkers)) for key, (allowed, required) in fields.items()]
+    dependencies = list(dependencies.items())
+
+    def check(element, path, report):
+        if type(element) is not dict:
+            report.error(path, f'{kind} must be an object')
+            return False
+        for key, required, check_value in checks:
+            value = element.get(key, MISSING)
+            if value is not MISSING:
+                check_value(value, f'{path}/{key}', report)
+            elif required:
+                report.error(path, f'{kind} is missing {key!r}')
+        for key, required_key in dependencies:
+            if key in element and required_key not in element:
+                report.error(path, f'{kind} with {key!r} is missing {required_key!r}')
+        return True
+    return check
+
+
+def compile_test(kind, fields, dependencies, tests):
+    """Turns the fields of a kind of element into a function telling whether an element is valid.
+
+    It does what the function of compile_element does without building
+    paths and messages, which are only needed for the few invalid elements.
+
+    Returns:
+    test (function): test(element), returning whether the element is valid
+    """
+    checks = []
+    for key, (allowed, required) in fields.items():
+        if isinstance(allowed, list):
+            # items are checked by type or by the test of their kind
+            checks.append((key, required, list, allowed[0] if isinstance(allowed[0], str) else None,
+                           None if isinstance(allowed[0], str) else allowed[0]))
+        else:
+            checks.append((key, required, allowed, None, None))
+    dependencies = list(dependencies.items())
+
+    def test(element):
+        if type(element) is not dict:
+            return False
+        for key, required, allowed, item_kind, item_type in checks:
+            value = element.get(key, MISSING)
+            if value is MISSING:
+                if required:
+                    return False
+                continue
+            if type(value) is not allowed:
+                return False
+            if item_type is not None:
+                for item in value:
+                    if type(item) is not item_type:
+                        return False
+            elif item_kind is not None:
+                test_item = tests[item_kind]
+                for item in value:
+                    if not test_item(item):
+                        return False
+        for key, required_key in dependencies:
+            if key in element and required_key not in element:
+                return False
+        return True
+    return test
+
+
+class SchemaValidator:
+    """Checks schema documents against a spec compiled once into checker functions.
+
+    Each event is tested once by the compiled test of its kind, and the
+    @ids it defines and refers to are collected; only invalid events are
+    looked at again to report where and why. References are resolved by
+    set differences once all events are seen, and only unresolved ones are
+    searched for in the document. All problems are reported together, see
+    ValidationReport.
+
+    Parameters:
+    spec (dict): fields of each kind of element, SDF_SPEC by default
+    dependencies (dict): fields required by others, SDF_DEPENDENCIES by default
+    max_problems (int): errors and warnings listed in a report
+    """
+
+    def __init__(self, spec=SDF_SPEC, dependencies=SDF_DEPENDENCIES, max_problems=MAX_PROBLEMS):
+        self.max_problems = max_problems
+        self.checkers = {}
+        self.tests = {}
+        for kind, fields in spec.items():
+            self.checkers[kind] = compile_element(kind, fields, dependencies.get(kind, {}), self.checkers)
+            self.tests[kind] = compile_test(kind, fields, dependencies.get(kind, {}), self.tests)
+        # fields of the document other than events, checked once the document is parsed
+        document = dict(spec['document'])
+        document.pop('events', None)
+        self.check_document = compile_element('document', document, dependencies.get('document', {}), self.checkers)
+
+    def validate(self, schema_json):
+        """Checks a whole document.
+
+        Parameters:
+        schema_json (dict): the document
+
+        Returns:
+        report (ValidationReport): all errors and warnings
+        """
+        run = self.start()
+        events = schema_json.get('events') if type(schema_json) is dict else None
+        if type(events) is list:
+            for event in events:
+                run.check_event(event)
+        return run.finish(schema_json)
+
+    def validate_event(self, event, path=''):
+        """Checks one event on its own, e.g. one sent to or changed by an edit route.
+
+        Parameters:
+        event (dict): the event
+        path (str): JSON Pointer of the event in its document, prefixed to the paths of the errors
+
+        Returns:
+        report (ValidationReport): its errors
+        """
+        report = ValidationReport(self.max_problems)
+        if not self.tests['event'](event):
+            self.checkers['event'](event, path, report)
+        return report
+
+    def start(self):
+        """Starts checking a document whose events come one at a time, e.g. while it is parsed.
+
+        Returns:
+        run (ValidationRun): pass each event to run.check_event, then the document to run.finish
+        """
+        return ValidationRun(self)
+
+
+class ValidationRun:
+    """State of a SchemaValidator going through the events of one document."""
+
+    def __init__(self, validator):
+        self.report = ValidationReport(validator.max_problems)
+        self.test = validator.tests['event']
+        self.check = validator.checkers['event']
+        self.check_document = validator.check_document
+        self.position = 0
+        # event @id -> position of the first event with it
+        self.events = {}
+        self.entities = set()
+        # @ids referred to as events, entities, and either by relations, in valid events
+        self.event_references = []
+        self.entity_references = []
+        self.element_references = []
+
+    def check_event(self, event):
+        """Checks the next event of the document.
+
+        Returns:
+        bool: whether the document has no errors so far
+        """
+        position = self.position
+        self.position += 1
+        if not self.test(event):
+            self.check(event, f'/events/{position}', self.report)
+            return False
+        event_id = event['@id']
+        first = self.events.setdefault(event_id, position)
+        if first != position:
+            self.report.warning(f'/events/{position}/@id', f'{event_id!r} is also the @id of /events/{first}')
+
+        self.event_references.extend(event['outlinks'])
+        if 'children' in event:
+            self.event_references.extend(event['children'])
+        for entity in event.get('entities', ()):
+            self.entities.add(entity['@id'])
+        for participant in event.get('participants', ()):
+            self.entity_references.append(participant['entity'])
+        for relation in event.get('relations', ()):
+            self.element_references.append(relation['relationSubject'])
+            self.element_references.append(relation['relationObject'])
+        return self.report.valid
+
+    def finish(self, schema_json):
+        """Checks the rest of the document and resolves the references of its events.
+
+        Parameters:
+        schema_json (dict): the document, its events having been passed to check_event
+
+        Returns:
+        report (ValidationReport): all errors and warnings
+        """
+        report = self.report
+        if type(schema_json) is not dict:
+            report.error('', 'the document must be an object')
+            return report
+        if 'events' not in schema_json:
+            report.error('', "document is missing 'events'")
+        elif type(schema_json['events']) is not list:
+            report.error('/events', 'must be a list of events')
+        self.check_document(schema_json, '', report)
+
+        events, entities = self.events, self.entities
+        missing_events = set(self.event_references).difference(events)
+        # participants without an entity are shown with a placeholder entity
+        missing_entities = set(self.entity_references).difference(entities, ('',))
+        missing_elements = set(self.element_references).difference(events, entities)
+        if missing_events or missing_entities or missing_elements:
+            self.locate(schema_json['events'], missing_events, missing_entities, missing_elements)
+        return report
+
+    def locate(self, events, missing_events, missing_entities, missing_elements):
+        """Reports where the unresolved references are, in document order."""
+        report, test = self.report, self.test
+        for position, event in enumerate(events):
+            if not test(event):
+                continue
+            path = f'/events/{position}'
+            for key in ('children', 'outlinks'):
+                for item_position, target in enumerate(event.get(key, ())):
+                    if target in missing_events:
+                        report.warning(f'{path}/{key}/{item_position}', f'{target!r} is not the @id of an event')
+            for item_position, participant in enumerate(event.get('participants', ())):
+                if participant['entity'] in missing_entities:
+                    report.warning(f'{path}/participants/{item_position}/entity',
+                                   f'{participant["entity"]!r} is not the @id of an entity')
+            for item_position, relation in enumerate(event.get('relations', ())):
+                for key in ('relationSubject', 'relationObject'):
+                    if relation[key] in missing_elements:
+                        report.warning(f'{path}/relations/{item_position}/{key}',
+                                       f'{relation[key]!r} is not the @id of an event or entity')
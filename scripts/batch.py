@@ -0,0 +1,124 @@
+# ===============================================
+# batch.py
+# ------------
+# runs a script over many schema files in a process pool
+# ===============================================
+
+import concurrent.futures
+import glob
+import os
+import time
+
+
+def expand_inputs(patterns, skip_suffix=''):
+    """Lists the JSON files named by paths, directories and glob patterns.
+
+    Directories are searched recursively for .json files. Each file comes
+    with the path it gets under an output directory: its path relative to
+    the directory it was found in, or its name for files and glob matches.
+
+    Parameters:
+    patterns (list): files, directories or glob patterns like "deliveries/*/*.json"
+    skip_suffix (str): files ending with it are left out of directories and globs, e.g. earlier outputs
+
+    Returns:
+    inputs (list): (input file, relative output path) pairs, without duplicates
+    unmatched (list): patterns that named no JSON file
+    """
+    inputs = {}
+    unmatched = []
+    for pattern in patterns:
+        found = []
+        if os.path.isdir(pattern):
+            for directory, _, names in os.walk(pattern):
+                for name in sorted(names):
+                    if name.endswith('.json') and not (skip_suffix and name.endswith(skip_suffix)):
+                        path = os.path.join(directory, name)
+                        found.append((path, os.path.relpath(path, pattern)))
+        elif os.path.isfile(pattern):
+            found.append((pattern, os.path.basename(pattern)))
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.endswith('.json') \
+                        and not (skip_suffix and path.endswith(skip_suffix)):
+                    found.append((path, os.path.basename(path)))
+        if not found:
+            unmatched.append(pattern)
+        for path, relative in found:
+            inputs.setdefault(os.path.normpath(path), relative)
+    return list(inputs.items()), unmatched
+
+
+def is_batch(patterns, output_dir):
+    """Returns whether the arguments of a script ask for more than its single file mode."""
+    return bool(output_dir) or len(patterns) != 1 or not os.path.isfile(patterns[0])
+
+
+def run_file(function, input_file, output_file, options):
+    """Runs function on one file, returning (input file, output file, error message or None)."""
+    try:
+        return input_file, function(input_file, output_file, *options), None
+    except Exception as error:
+        return input_file, None, f'{type(error).__name__}: {error}'
+
+
+def run_batch(function, jobs, workers=None, options=()):
+    """Calls function(input_file, output_file, *options) for every job, in a pool of processes.
+
+    Failures are reported per file as they happen and do not stop the
+    other files. function has to be defined at the top level of a module
+    so that the worker processes can import it.
+
+    Parameters:
+    function (function): processes one file and returns the file it wrote
+    jobs (list): (input file, output file) pairs
+    workers (int): number of processes, all cores by default, 1 runs the files in this process
+    options (tuple): further arguments of function
+
+    Returns:
+    results (list): (input file, output file, error message or None) of every file, in the order of jobs
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) or 1
+    start = time.perf_counter()
+    # outputs that two inputs would write are errors of the later ones
+    owners = {}
+    results = {}
+    for input_file, output_file in jobs:
+        key = os.path.normcase(os.path.abspath(output_file))
+        if key in owners:
+            results[input_file] = (input_file, None, f'{output_file} is also written for {owners[key]}')
+        else:
+            owners[key] = input_file
+            directory = os.path.dirname(output_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+    pending = [(input_file, output_file) for input_file, output_file in jobs if input_file not in results]
+
+    def report(result):
+        input_file, output_file, error = result
+        results[input_file] = result
+        if error:
+            print(f"FAILED {input_file}: {error}")
+        else:
+            print(f"done   {input_file} -> {output_file}")
+
+    for result in results.values():
+        report(result)
+    if workers == 1:
+        for input_file, output_file in pending:
+            report(run_file(function, input_file, output_file, options))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(run_file, function, input_file, output_file, options)
+                       for input_file, output_file in pending]
+            for future in concurrent.futures.as_completed(futures):
+                report(future.result())
+
+    ordered = [results[input_file] for input_file, _ in jobs]
+    failed = [result for result in ordered if result[2]]
+    print(f"\n{len(ordered)} files in {time.perf_counter() - start:.1f} s "
+          f"with {workers} process{'es' if workers > 1 else ''}: "
+          f"{len(ordered) - len(failed)} succeeded, {len(failed)} failed.")
+    for input_file, _, error in failed:
+        print(f"  {input_file}: {error}")
+    return ordered
@@ -0,0 +1,216 @@
+import contextlib
+import io
+import json
+import getopt, sys
+import os
+import random
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+from generate_schema import generate_schema
+
+WORKSPACE = 'benchmark'
+
+
+class Benchmark:
+    """Times stages of the graph pipeline and records their peak memory.
+
+    Parameters:
+    memory (bool): whether to trace memory, which slows everything down
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = []
+
+    def measure(self, size, stage, function, repeat=1):
+        """Runs function(i) for i in range(repeat) and records time and peak memory.
+
+        Parameters:
+        size (int): number of events of the schema
+        stage (str): name of the stage
+        function (function): stage to run, returns False on failure
+        repeat (int): number of runs
+
+        Returns:
+        result (dict): the recorded result
+        """
+        times = []
+        errors = 0
+        if self.memory:
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+        # the routes print debugging output
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(repeat):
+                start = time.perf_counter()
+                if function(i) is False:
+                    errors += 1
+                times.append(time.perf_counter() - start)
+        peak = 0
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+        times.sort()
+        result = {
+            'events': size,
+            'stage': stage,
+            'runs': repeat,
+            'errors': errors,
+            'total_s': sum(times),
+            'mean_ms': sum(times) / repeat * 1000,
+            'median_ms': times[len(times) // 2] * 1000,
+            'max_ms': times[-1] * 1000,
+            'peak_mib': peak / 2 ** 20
+        }
+        self.results.append(result)
+        print(f"{size:>8} {stage:<28} {repeat:>5} {result['mean_ms']:>10.2f} {result['median_ms']:>10.2f} "
+              f"{result['max_ms']:>10.2f} {result['peak_mib']:>9.2f} {errors:>4}")
+        return result
+
+
+def ok(response):
+    return response.status_code == 200
+
+
+def run(benchmark, size, seed, repeat, options):
+    """Benchmarks one generated schema through the graph functions and the routes."""
+    r = random.Random(seed)
+    schema = generate_schema(seed=seed, events=size, **options)
+    schema_bytes = json.dumps(schema).encode('utf-8')
+    client = app.app.test_client()
+    client.environ_base['HTTP_X_WORKSPACE_ID'] = WORKSPACE
+
+    # graph pipeline
+    parsed = {}
+    benchmark.measure(size, 'json.loads', lambda i: parsed.update(schema=app.loads(schema_bytes)))
+    containers = {}
+    handle_containers = app.handle_containers
+
+    def timed_handle_containers(graph, container_ids):
+        start = time.perf_counter()
+        graph = handle_containers(graph, container_ids)
+        containers['seconds'] = time.perf_counter() - start
+        return graph
+
+    app.handle_containers = timed_handle_containers
+    try:
+        benchmark.measure(size, 'get_nodes_and_edges', lambda i: app.get_nodes_and_edges(parsed['schema']))
+    finally:
+        app.handle_containers = handle_containers
+    print(f"{size:>8} {'  of which handle_containers':<28} {1:>5} {containers['seconds'] * 1000:>10.2f}")
+    graph = app.build_graph(app.loads(schema_bytes))
+    benchmark.measure(size, 'get_connected_nodes', lambda i: app.get_connected_nodes(graph, 'root'))
+    benchmark.measure(size, 'serialize graph', lambda i: app.dumps({'nodes': graph.nodes, 'edges': graph.edges}))
+
+    # loading through the routes
+    def upload(i):
+        app.schema_cache = app.SchemaCache(app.schema_cache.max_bytes)
+        return ok(client.post('/upload', data={'file': (io.BytesIO(schema_bytes), 'schema.json')}))
+
+    benchmark.measure(size, 'POST /upload', upload)
+    benchmark.measure(size, 'POST /reload (cached)', lambda i: ok(client.post('/reload', data=schema_bytes)))
+    benchmark.measure(size, 'GET /get_all_entities', lambda i: ok(client.get('/get_all_entities')), repeat)
+    workspace = app.workspaces.acquire(WORKSPACE)
+    app.workspaces.release(workspace)
+    parents = [node_id for node_id, node in workspace.graph.nodes.items() if node.type in ('parent', 'root')]
+    benchmark.measure(size, 'GET /node',
+                      lambda i: ok(client.get('/node', query_string={'ID': r.choice(parents)})), repeat)
+
+    # mutation routes, the first one detaches the workspace from the cached schema
+    event_ids = [event['@id'] for event in schema['events'] if event['@id'] in workspace.graph.nodes]
+    entity_ids = [entity['@id'] for event in schema['events'] for entity in event['entities']]
+    benchmark.measure(size, 'POST /add_event', lambda i: ok(client.post('/add_event', json={
+        '@id': f'Events/90000/benchmark_{i}', 'name': f'benchmark {i}', 'outlinks': [], 'participants': [],
+        'parent_id': {'@id': r.choice(event_ids)}})), repeat)
+    benchmark.measure(size, 'POST /add_entity', lambda i: ok(client.post('/add_entity', json={
+        'event_id': r.choice(event_ids),
+        'entity_data': {'@id': f'Entities/90000/benchmark_{i}', 'name': f'benchmark {i}'}})), repeat)
+    entity_ids.extend(f'Entities/90000/benchmark_{i}' for i in range(repeat))
+    benchmark.measure(size, 'POST /add_participant', lambda i: ok(client.post('/add_participant', json={
+        'event_id': r.choice(event_ids),
+        'participant_data': {'@id': f'Participants/90000/benchmark_{i}', 'roleName': 'benchmark',
+                             'entity': r.choice(entity_ids)}})), repeat)
+    benchmark.measure(size, 'POST /add_outlink', lambda i: ok(client.post('/add_outlink', json={
+        'fromNodeId': r.choice(event_ids), 'toNodeId': r.choice(event_ids)})), repeat)
+    benchmark.measure(size, 'POST /add_relation', lambda i: ok(client.post('/add_relation', json={
+        'fromNodeId': entity_ids[i], 'toNodeId': r.choice(entity_ids),
+        'relation': {'@id': f'Relations/90000/benchmark_{i}', 'name': 'benchmark',
+                     'relationSubject': entity_ids[i], 'relationObject': r.choice(entity_ids)}})), repeat)
+    benchmark.measure(size, 'POST /node', lambda i: ok(client.post('/node', data=json.dumps({
+        'id': r.choice(event_ids), 'updatedFields': {'description': f'benchmark {i}'}}))), repeat)
+    benchmark.measure(size, 'DELETE /delete_entity', lambda i: ok(client.delete('/delete_entity', json={
+        'entity_id': entity_ids.pop(r.randrange(len(entity_ids)))})), min(repeat, len(entity_ids)))
+    benchmark.measure(size, 'POST /remove_element', lambda i: ok(client.post('/remove_element', json={
+        'id': event_ids.pop(r.randrange(1, len(event_ids)))})), min(repeat, len(event_ids) - 1))
+    app.workspaces.discard(WORKSPACE)
+
+
+def main(argv):
+    h = """
+    benchmark.py
+    ======================================================================
+    Benchmarks the graph pipeline and the routes on generated SDF 3.0
+    schemas of increasing size, reporting time and peak memory per stage.
+    Routes are driven through the Flask test client.
+    ======================================================================
+    -h      help
+
+    Optionals:
+    -n      comma separated numbers of events (default 1000,10000)
+    -s      seed (default 0)
+    -r      runs of each route (default 20)
+    -j      write the results to a JSON file
+    -m      do not trace memory, for more accurate timings
+    -d, -f, -c, -e, -p, -x, -a
+            depth, fan-out, container share, entities, participants,
+            xor and and gate shares, see generate_schema.py
+    """
+    # obtain arguments
+    sizes = [1000, 10000]
+    seed = 0
+    repeat = 20
+    json_file = ''
+    memory = True
+    options = {}
+    flags = {'-d': ('depth', int), '-f': ('fanout', int), '-c': ('containers', float), '-e': ('entities', int),
+             '-p': ('participants', int), '-x': ('xor', float), '-a': ('and_gate', float)}
+    try:
+        opts, _ = getopt.getopt(argv, "hn:s:r:j:md:f:c:e:p:x:a:", ["help"])
+    except getopt.GetoptError:
+        print(h)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(h)
+            sys.exit()
+        if opt == "-n":
+            sizes = [int(size) for size in arg.split(',')]
+        elif opt == "-s":
+            seed = int(arg)
+        elif opt == "-r":
+            repeat = int(arg)
+        elif opt == "-j":
+            json_file = arg
+        elif opt == "-m":
+            memory = False
+        elif opt in flags:
+            name, convert = flags[opt]
+            options[name] = convert(arg)
+
+    benchmark = Benchmark(memory)
+    print(f"{'events':>8} {'stage':<28} {'runs':>5} {'mean ms':>10} {'median ms':>10} {'max ms':>10} {'peak MiB':>9} {'err':>4}")
+    for size in sizes:
+        size_options = {'entities': max(size // 10, 2), 'relations': size // 20}
+        size_options.update(options)
+        run(benchmark, size, seed, repeat, size_options)
+
+    if json_file:
+        with open(json_file, 'w') as outf:
+            json.dump(benchmark.results, outf, indent=4)
+        print(f"Results are available at {json_file}.")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,183 @@
+import json
+import getopt, sys
+import random
+
+
+def generate_schema(seed=0, events=1000, depth=5, fanout=6, containers=0.1, entities=100,
+                    participants=2, relations=50, xor=0.1, and_gate=0.1, repeatable=0.05):
+    """Generates a random SDF 3.0 schema shaped like schema.json.
+
+    The same arguments always give the same schema.
+
+    Parameters:
+    seed (int): seed of the random generator
+    events (int): number of events, including the root
+    depth (int): maximum depth of the event hierarchy
+    fanout (int): usual number of children of a parent event
+    containers (float): share of parent events that are "outlinks" containers
+    entities (int): number of entities, defined in random events
+    participants (int): average number of participants per leaf event
+    relations (int): number of relations between entities
+    xor (float): share of parent events with an xor gate
+    and_gate (float): share of parent events with an and gate
+    repeatable (float): share of repeatable events
+
+    Returns:
+    schemaJson (dict): the generated schema
+    """
+    r = random.Random(seed)
+    ids = [f'Events/{10000 + i}/Event_{i}' for i in range(events)]
+    schema = [{
+        '@id': ids[0],
+        'name': 'Generated Schema',
+        'description': f'generated with seed {seed}',
+        'isSchema': True,
+        'repeatable': False,
+        'outlinks': [],
+        'participants': [],
+        'entities': [],
+        'relations': []
+    }]
+    levels = [0]
+    # events that may have children, and those of them with less than fanout children
+    open_parents = [0]
+    available = [0]
+    for i in range(1, events):
+        if available:
+            slot = r.randrange(len(available))
+            parent = available[slot]
+        else:
+            slot = None
+            parent = r.choice(open_parents)
+        children = schema[parent].setdefault('children', [])
+        children.append(ids[i])
+        if slot is not None and len(children) >= fanout:
+            available[slot] = available[-1]
+            available.pop()
+        levels.append(levels[parent] + 1)
+        event = {
+            '@id': ids[i],
+            'name': f'event {i}',
+            'description': '',
+            'isSchema': False,
+            'repeatable': r.random() < repeatable,
+            'optional': r.random() < 0.1,
+            'outlinks': [],
+            'participants': [],
+            'entities': [],
+            'relations': []
+        }
+        if levels[i] < depth and r.random() < 1 / fanout + 0.1:
+            open_parents.append(i)
+            available.append(i)
+            if r.random() < containers:
+                event['name'] = f'event {i} outlinks'
+        schema.append(event)
+    open_parents = [p for p in open_parents if 'children' in schema[p]]
+
+    # gates and temporal order among siblings
+    position = {event_id: i for i, event_id in enumerate(ids)}
+    for parent in open_parents:
+        gate = r.random()
+        schema[parent]['children_gate'] = 'xor' if gate < xor else 'and' if gate < xor + and_gate else 'or'
+        children = schema[parent]['children']
+        for previous, child in zip(children, children[1:]):
+            if r.random() < 0.7:
+                schema[position[previous]]['outlinks'].append(child)
+
+    # entities, participants and relations
+    entity_ids = [f'Entities/{20000 + i}/entity_{i}' for i in range(entities)]
+    for i, entity_id in enumerate(entity_ids):
+        r.choice(schema)['entities'].append({
+            '@id': entity_id,
+            'name': f'entity {i}',
+            'wd_node': f'wd:Q{r.randint(1, 10 ** 6)}',
+            'wd_label': '',
+            'wd_description': ''
+        })
+    leaves = [event for event in schema if 'children' not in event]
+    count = 0
+    if entity_ids:
+        for event in leaves:
+            for _ in range(r.randint(0, 2 * participants)):
+                event['participants'].append({
+                    '@id': f'Participants/{30000 + count}/',
+                    'roleName': f'role_{count % 7}',
+                    'entity': r.choice(entity_ids)
+                })
+                count += 1
+    if len(entity_ids) > 1:
+        for i in range(relations):
+            subject, obj = r.sample(entity_ids, 2)
+            r.choice(schema)['relations'].append({
+                '@id': f'Relations/{40000 + i}/',
+                'name': f'relation {i}',
+                'relationSubject': subject,
+                'relationObject': obj,
+                'wd_node': f'wdt:P{r.randint(1, 10 ** 4)}',
+                'wd_label': '',
+                'wd_description': ''
+            })
+
+    return {
+        '@id': f'Generated/{seed}/',
+        'sdfVersion': '3.0.0',
+        'version': 'generated',
+        'events': schema
+    }
+
+
+def main(argv):
+    h = """
+    generate_schema.py
+    ======================================================================
+    Generates a random SDF 3.0 schema for testing and benchmarking.
+    The same options always generate the same schema.
+    ======================================================================
+    -h      help
+    -o      output file
+
+    Optionals:
+    -s      seed (default 0)
+    -n      number of events (default 1000)
+    -d      maximum hierarchy depth (default 5)
+    -f      fan-out of parent events (default 6)
+    -c      share of container events (default 0.1)
+    -e      number of entities (default 100)
+    -p      average participants per leaf event (default 2)
+    -r      number of relations (default 50)
+    -x      share of xor gates (default 0.1)
+    -a      share of and gates (default 0.1)
+    """
+    # obtain arguments
+    output_file = ''
+    options = {}
+    flags = {'-s': ('seed', int), '-n': ('events', int), '-d': ('depth', int), '-f': ('fanout', int),
+             '-c': ('containers', float), '-e': ('entities', int), '-p': ('participants', int),
+             '-r': ('relations', int), '-x': ('xor', float), '-a': ('and_gate', float)}
+    try:
+        opts, _ = getopt.getopt(argv, "ho:s:n:d:f:c:e:p:r:x:a:", ["help", "outputfile="])
+    except getopt.GetoptError:
+        print(h)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(h)
+            sys.exit()
+        if opt in ("-o", "--outputfile"):
+            output_file = arg
+        elif opt in flags:
+            name, convert = flags[opt]
+            options[name] = convert(arg)
+
+    # exit with help
+    if output_file == '':
+        print(h)
+        sys.exit(2)
+
+    with open(output_file, 'w') as outf:
+        json.dump(generate_schema(**options), outf, indent=4)
+    print(f"New file is available at {output_file}.")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
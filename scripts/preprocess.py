@@ -1,5 +1,68 @@
 import json
 import getopt, sys
+import os
+
+from batch import expand_inputs, is_batch, run_batch
+from remap import reverse_index, write_json
+
+OUTPUT_SUFFIX = '_processed.json'
+
+
+def preprocess(schemaJson):
+    """Fixes children gates and child lists of a schema in place.
+
+    Parameters:
+    schemaJson (dict): the schema
+
+    Returns:
+    schemaJson (dict): the same schema
+    """
+    schema = schemaJson['events']
+
+    # extract event dictionary and the event ids of names
+    eventDict = {}
+    for scheme in schema:
+        eventDict[scheme['@id']] = scheme['name']
+    nameDict = reverse_index(eventDict)
+
+    # change children_gate and add comments to children
+    for scheme in schema:
+        if 'children' in scheme:
+            scheme['children_gate'] = 'or'
+
+            for child in scheme['children']:
+                # check name
+                if 'Events' not in child['child']:
+                    if child['child'] not in nameDict:
+                        raise ValueError(f"no event is named {child['child']!r}")
+                    child['comment'] = child['child']
+                    child['child'] = nameDict[child['child']]
+                else:
+                    child['comment'] = eventDict[child['child']]
+                
+                if 'optional' not in child:
+                    child['optional'] = False
+
+    schemaJson['events'] = schema
+    return schemaJson
+
+
+def preprocess_file(input_file, output_file, compact=False):
+    """Preprocesses a JSON file and writes the result.
+
+    Parameters:
+    input_file (str): schema to read
+    output_file (str): file to write
+    compact (bool): whether to write without indentation
+
+    Returns:
+    output_file (str): the written file
+    """
+    with open(input_file, encoding='utf8') as f:
+        schemaJson = preprocess(json.load(f))
+    with open(output_file, "w") as outf:
+        write_json(schemaJson, outf, None if compact else 4)
+    return output_file
 
 
 def main(argv):
@@ -18,28 +81,64 @@ def main(argv):
     double quotes, e.g. "path\\to\\file" on Windows.
     ======================================================================
     -h      help
-    -i      input file
+    -i      input file, directory or glob pattern, can be given several times
+
+    Optionals:
+    -o      output directory, by default files are written next to their input
+    -j      number of processes for several files, all cores by default
+    -c      compact output without indentation, smaller and faster to write
+
+    A directory or pattern, e.g. "deliveries/*.json", preprocesses every
+    JSON file it holds in parallel, leaving out earlier *_processed.json
+    files, and prints a summary with the files that failed.
     """
     # obtain arguments
-    input_file = ''
+    inputs = []
+    output_dir = ''
+    workers = None
+    compact = False
     try:
-        opts, _ = getopt.getopt(argv, "hi:", ["help", "inputfile="])
+        opts, args = getopt.gnu_getopt(argv, "hi:o:j:c", ["help", "inputfile=", "outputdir=", "jobs=", "compact"])
     except getopt.GetoptError:
         print('error')
         print(h)
         sys.exit(2)
+    inputs.extend(args)
     for opt, arg in opts:
         if opt in ("-h", "--help"):
             print(h)
             sys.exit()
         if opt in ("-i", "--inputfile"):
-            input_file = arg
+            inputs.append(arg)
+        elif opt in ("-o", "--outputdir"):
+            output_dir = arg
+        elif opt in ("-j", "--jobs"):
+            if not arg.isdigit() or int(arg) < 1:
+                print("ERROR: -j takes a number of processes.")
+                sys.exit(2)
+            workers = int(arg)
+        elif opt in ("-c", "--compact"):
+            compact = True
 
     # exit with help
-    if input_file == '':
+    if not inputs:
         print(h)
         sys.exit(2)
 
+    if is_batch(inputs, output_dir):
+        files, unmatched = expand_inputs(inputs, OUTPUT_SUFFIX)
+        for pattern in unmatched:
+            print(f"WARNING: no JSON file found for {pattern}")
+        if not files:
+            sys.exit(2)
+        jobs = []
+        for input_file, relative in files:
+            output_file = os.path.join(output_dir, relative) if output_dir else input_file
+            jobs.append((input_file, output_file[:-5] + OUTPUT_SUFFIX))
+        results = run_batch(preprocess_file, jobs, workers, (compact,))
+        sys.exit(1 if any(error for _, _, error in results) else 0)
+    input_file = inputs[0]
+
     # check input file is a json
     if 'json' not in input_file[-5:]:
         print("ERROR: please input a JSON file.")
@@ -47,37 +146,7 @@ def main(argv):
         sys.exit(2)
 
     file = input_file[:-5]
-    with open(f'{file}.json', encoding='utf8') as f:
-        schema_string = f.read()
-    schemaJson = json.loads(schema_string)
-    schema = schemaJson['events']
-
-    # extract event dictionary
-    eventDict = {}
-    for scheme in schema:
-        eventDict[scheme['@id']] = scheme['name']
-
-    # change children_gate and add comments to children
-    for scheme in schema:
-        if 'children' in scheme:
-            scheme['children_gate'] = 'or'
-
-            for child in scheme['children']:
-                # check name
-                if 'Events' not in child['child']:
-                    event_id = list(eventDict.keys())[list(eventDict.values()).index(child['child'])]
-                    child['comment'] = child['child']
-                    child['child'] = event_id
-                else:
-                    child['comment'] = eventDict[child['child']]
-                
-                if 'optional' not in child:
-                    child['optional'] = False
-
-    schemaJson['events'] = schema
-    jsonObject = json.dumps(schemaJson, indent = 4)
-    with open(f"{file}_processed.json", "w") as outf:
-        outf.write(jsonObject)
+    preprocess_file(f'{file}.json', f"{file}_processed.json", compact)
     print(f"New file is available at {file}_processed.json.")
 
 if __name__ == "__main__":
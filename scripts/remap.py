@@ -0,0 +1,110 @@
+# ===============================================
+# remap.py
+# ------------
+# id remapping and streaming output shared by the scripts
+# ===============================================
+
+import json
+
+
+def padded_id(old_id, number):
+    """Formats an id like "Events/00042/name", keeping the name of old_id."""
+    parts = old_id.split('/')
+    return f"{parts[0]}/{number:05d}/{parts[-1] if len(parts) > 2 else ''}"
+
+
+def reverse_index(names):
+    """Turns an @id -> name dict into a name -> @id dict.
+
+    Where several ids share a name the first one is kept, as
+    list.index would find it.
+
+    Parameters:
+    names (dict): name of each @id
+
+    Returns:
+    ids (dict): @id of each name
+    """
+    ids = {}
+    for element_id, name in names.items():
+        ids.setdefault(name, element_id)
+    return ids
+
+
+class IdRemapper:
+    """Gives elements consecutive new ids and remembers them to resolve references.
+
+    Parameters:
+    start (int): number of the first new id
+    format_id (function): builds a new id from the old id and its number, padded_id by default
+    """
+
+    def __init__(self, start, format_id=padded_id):
+        self.number = start
+        self.format_id = format_id
+        # old id -> new id
+        self.ids = {}
+
+    def __getitem__(self, old_id):
+        return self.ids[old_id]
+
+    def __contains__(self, old_id):
+        return old_id in self.ids
+
+    def renumber(self, old_id):
+        """Returns the next new id for an element, which references to old_id resolve to from now on."""
+        new_id = self.format_id(old_id, self.number)
+        self.number += 1
+        self.ids[old_id] = new_id
+        return new_id
+
+    def resolve(self, old_id):
+        """Returns the new id of old_id, numbering it first if it has none yet."""
+        new_id = self.ids.get(old_id)
+        if new_id is None:
+            new_id = self.renumber(old_id)
+        return new_id
+
+
+def write_json(document, f, indent=None):
+    """Writes a document to a file one list item at a time.
+
+    Only one event, entity or relation is turned into text at a time
+    instead of the whole document. With an indent the output is the same
+    as json.dumps(document, indent=indent), without one it has no
+    whitespace at all.
+
+    Parameters:
+    document (dict): document to write
+    f (file): text file open for writing
+    indent (int): spaces per level, None for compact output
+    """
+    separators = (',', ': ') if indent is not None else (',', ':')
+    encoder = json.JSONEncoder(indent=indent, separators=separators)
+
+    def newline(level):
+        return '\n' + ' ' * (indent * level) if indent is not None else ''
+
+    def dumps(value, level):
+        text = encoder.encode(value)
+        # strings never contain a raw newline, every newline starts a line of the value
+        return text.replace('\n', newline(level)) if indent is not None and level else text
+
+    if not isinstance(document, dict) or not document:
+        f.write(dumps(document, 0))
+        return
+    f.write('{')
+    for position, (key, value) in enumerate(document.items()):
+        if position:
+            f.write(separators[0])
+        f.write(newline(1) + json.dumps(key) + separators[1])
+        if isinstance(value, list) and value:
+            f.write('[')
+            for item_position, item in enumerate(value):
+                if item_position:
+                    f.write(separators[0])
+                f.write(newline(2) + dumps(item, 2))
+            f.write(newline(1) + ']')
+        else:
+            f.write(dumps(value, 1))
+    f.write(newline(0) + '}')
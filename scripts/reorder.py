@@ -1,13 +1,88 @@
 import json
 import getopt, sys
+import os
 
-def NewId(currId, num, idDict = -1):
-    oldId = currId.split('/')
-    newId = f"{oldId[0]}/{'0'*(5 - len(str(num)))}{num}/{oldId[-1] if len(oldId) > 2 else ''}"
-    if idDict != -1:
-        idDict[currId] = newId
-    num += 1
-    return newId, num, idDict
+from batch import expand_inputs, is_batch, run_batch
+from remap import IdRemapper, write_json
+
+def relation_id(old_id, number):
+    """Formats a relation id like "Relations/30000/"."""
+    return f"{old_id.split('/')[0]}/{number}/"
+
+def participant_id(old_id, number):
+    """Formats a participant id like "Participants/20000/name"."""
+    pid = old_id.split('/')
+    return f"{pid[0]}/{number}/{pid[2] if len(pid) > 2 else ''}"
+
+def reorder(schemaJson, v=0):
+    """Reorders the ids of a schema in place, in one pass over each list.
+
+    Parameters:
+    schemaJson (dict): the schema
+    v (int): whether to print which step the program is on
+
+    Returns:
+    schemaJson (dict): the same schema
+    """
+    if v: print("Reordering entities...", end='')
+    entities = IdRemapper(0)
+    for entity in schemaJson['entities']:
+        entity['@id'] = entities.renumber(entity['@id'])
+    if v: print("done.")
+
+    if v: print("Resolving entity references in relations...", end='')
+    relations = IdRemapper(30000, relation_id)
+    for relation in schemaJson['relations']:
+        relation['relationSubject'] = entities[relation['relationSubject']]
+        relation['relationObject'] = entities[relation['relationObject']]
+        relation['@id'] = relations.renumber(relation['@id'])
+    if v: print("done.")
+
+    if v: print("Reordering events and participants, resolving entity references...", end='')
+    events = IdRemapper(10000)
+    participants = IdRemapper(20000, participant_id)
+    for scheme in schemaJson['events']:
+        scheme['@id'] = events.resolve(scheme['@id'])
+
+        # children and their outlinks, numbered where they are first referenced
+        if 'children' in scheme:
+            for child in scheme['children']:
+                child['child'] = events.resolve(child['child'])
+                if 'outlinks' in child:
+                    child['outlinks'] = [events.resolve(outlink) for outlink in child['outlinks']]
+
+        # reorder participants and use new entity ID's
+        if 'participants' in scheme:
+            for participant in scheme['participants']:
+                participant['@id'] = participants.renumber(participant['@id'])
+                participant['entity'] = entities[participant['entity']]
+    if v: print("done.")
+    return schemaJson
+
+def reorder_file(input_file, output_file, v=0, compact=False):
+    """Reorders the ids of a JSON file and writes the result.
+
+    Parameters:
+    input_file (str): schema to read
+    output_file (str): file to write, may be input_file
+    v (int): whether to print which step the program is on
+    compact (bool): whether to write without indentation
+
+    Returns:
+    output_file (str): the written file
+    """
+    if v: print("Reading file...", end='')
+    with open(input_file, encoding='utf8') as f:
+        schemaJson = json.load(f)
+    if v: print("done.")
+
+    reorder(schemaJson, v)
+
+    if v: print("Writing...", end='')
+    with open(output_file, "w") as outf:
+        write_json(schemaJson, outf, None if compact else 4)
+    if v: print("done.")
+    return output_file
 
 def main(argv):
     h = """
@@ -27,33 +102,65 @@ def main(argv):
     double quotes, e.g. "path\\to\\file" on Windows.
     ======================================================================
     -h      help
-    -i      input file
+    -i      input file, directory or glob pattern, can be given several times
     
     Optionals:
     -v      verbose output, i.e. prints which step the program is on
+    -o      output directory, by default files are overwritten
+    -j      number of processes for several files, all cores by default
+    -c      compact output without indentation, smaller and faster to write
+
+    A directory or pattern, e.g. "deliveries/*.json", reorders every JSON
+    file it holds in parallel and prints a summary with the files that
+    failed.
     """
     # obtain arguments
-    input_file = ''
+    inputs = []
+    output_dir = ''
+    workers = None
+    compact = False
     v = 0
     try:
-        opts, _ = getopt.getopt(argv, "hi:v", ["help", "inputfile=", "verbose"])
+        opts, args = getopt.gnu_getopt(argv, "hi:vo:j:c", ["help", "inputfile=", "verbose", "outputdir=", "jobs=", "compact"])
     except getopt.GetoptError:
         print(h)
         sys.exit(2)
+    inputs.extend(args)
     for opt, arg in opts:
         if opt in ("-h", "--help"):
             print(h)
             sys.exit()
         if opt in ("-i", "--inputfile"):
-            input_file = arg
+            inputs.append(arg)
         elif opt in ("-v", "--verbose"):
             v = 1
+        elif opt in ("-o", "--outputdir"):
+            output_dir = arg
+        elif opt in ("-j", "--jobs"):
+            if not arg.isdigit() or int(arg) < 1:
+                print("ERROR: -j takes a number of processes.")
+                sys.exit(2)
+            workers = int(arg)
+        elif opt in ("-c", "--compact"):
+            compact = True
 
     # exit with help
-    if input_file == '':
+    if not inputs:
         print(h)
         sys.exit(2)
 
+    if is_batch(inputs, output_dir):
+        files, unmatched = expand_inputs(inputs)
+        for pattern in unmatched:
+            print(f"WARNING: no JSON file found for {pattern}")
+        if not files:
+            sys.exit(2)
+        jobs = [(input_file, os.path.join(output_dir, relative) if output_dir else input_file)
+                for input_file, relative in files]
+        results = run_batch(reorder_file, jobs, workers, (v, compact))
+        sys.exit(1 if any(error for _, _, error in results) else 0)
+    input_file = inputs[0]
+
     # check input file is a json
     if 'json' not in input_file[-5:]:
         print("ERROR: please input a JSON file.")
@@ -62,80 +169,7 @@ def main(argv):
 
     # reorder listed files
     file = input_file[:-5]
-    if v: print("Reading file...", end='')
-    with open(f'{file}.json', encoding='utf8') as f:
-        schema_string = f.read()
-    schemaJson = json.loads(schema_string)
-    if v: print("done.")
-
-    if v: print("Reordering entities...", end='')
-    entities = schemaJson['entities']
-    numE = 0
-    entDict = {}
-    for entity in entities:
-        newId, numE, entDict = NewId(entity['@id'], numE, entDict)
-        entity['@id'] = newId
-    if v: print("done.")
-
-    if v: print("Resolving entity references in relations...", end='')
-    relations = schemaJson['relations']
-    numR = 30000
-    for relation in relations:
-        relation['relationSubject'] = entDict[relation['relationSubject']]
-        relation['relationObject'] = entDict[relation['relationObject']]
-        rid = relation['@id'].split('/')
-        relation['@id'] = f'{rid[0]}/{numR}/'
-        numR += 1
-    if v: print("done.")
-
-    if v: print("Reordering events and participants, resolving entity references...", end='')
-    schema = schemaJson['events']
-    numP = 20000
-    numS = 10000
-    schemeDict = {}
-    for scheme in schema:
-        if scheme['@id'] not in schemeDict:
-            newId, numS, schemeDict = NewId(scheme['@id'], numS, schemeDict)
-            scheme['@id'] = newId
-        else:
-            scheme['@id'] = schemeDict[scheme['@id']]
-
-        # children
-        if 'children' in scheme:
-            for child in scheme['children']:
-                if child['child'] not in schemeDict:
-                    newId, numS, schemeDict = NewId(child['child'], numS, schemeDict)
-                    child['child'] = newId
-                else:
-                    child['child'] = schemeDict[child['child']]
-                
-                # child outlinks
-                if 'outlinks' in child:
-                    for i in range(len(child['outlinks'])):
-                        if child['outlinks'][i] not in schemeDict:
-                            newId, numS, schemeDict = NewId(child['outlinks'][i], numS, schemeDict)
-                            child['outlinks'][i] = newId
-                        else:
-                            child['outlinks'][i] = schemeDict[child['outlinks'][i]]
-
-        # reorder participants and use new entity ID's
-        if 'participants' in scheme:
-            for participant in scheme['participants']:
-                pid = participant['@id'].split('/')
-                participant['@id'] = f"{pid[0]}/{numP}/{pid[2] if len(pid) > 2 else ''}"
-                numP += 1
-
-                participant['entity'] = entDict[participant['entity']]
-    if v: print("done.")
-
-    if v: print("Writing...", end='')
-    schemaJson['events'] = schema
-    schemaJson['entities'] = entities
-    schemaJson['relations'] = relations
-    jsonObject = json.dumps(schemaJson, indent = 4)
-    with open(f"{file}.json", "w") as outf:
-        outf.write(jsonObject)
-    if v: print("done.")
+    reorder_file(f'{file}.json', f"{file}.json", v, compact)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
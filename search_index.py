@@ -0,0 +1,192 @@
+# ===============================================
+# search_index.py
+# ------------
+# inverted index for finding schema elements by text
+# ===============================================
+
+import bisect
+import heapq
+import re
+
+# fields searched for each kind of element, with the weight of a match
+SEARCH_FIELDS = {
+    'event': {'name': 4, 'aka': 3, 'wd_node': 3, 'qnode': 3, 'wd_label': 2, 'qlabel': 2,
+              'description': 1, 'wd_description': 1},
+    'entity': {'name': 4, 'aka': 3, 'wd_node': 3, 'qnode': 3, 'wd_label': 2, 'qlabel': 2,
+               'wd_description': 1},
+    'relation': {'name': 4, 'wd_node': 3, 'relationPredicate': 3, 'wd_label': 2, 'wd_description': 1},
+    'participant': {'roleName': 4}
+}
+# lists of an event holding elements of each kind
+ELEMENT_KEYS = {'entities': 'entity', 'relations': 'relation', 'participants': 'participant'}
+# share of the weight when a query word is only the beginning of a word
+PREFIX_FACTOR = 0.5
+
+TOKEN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Splits text into lowercase words, "wd:Q42240" gives ['wd', 'q42240']."""
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    """Maps words of the names, descriptions, Wikidata ids and labels of schema elements to the elements.
+
+    Events are indexed together with the entities, relations and
+    participants they define, and re-indexed as a whole when they change,
+    like in SchemaIndex. Words are kept sorted, so the words starting with
+    a prefix are found by bisection.
+
+    Parameters:
+    events (list): events to index
+    """
+
+    def __init__(self, events=()):
+        # word -> {document key: weight}
+        self._postings = {}
+        # sorted words, None until the next search after indexing many events at once
+        self._words = []
+        # document key -> ((kind, @id, name, event @id, event name), {word: weight})
+        self._documents = {}
+        # event @id -> keys of the documents of the event and its elements
+        self._by_event = {}
+        if events:
+            self._words = None
+            for event in events:
+                self.index_event(event)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def index_event(self, event):
+        """Adds an event and its elements, or refreshes them after an edit."""
+        event_id = event['@id']
+        if event_id in self._by_event:
+            self.remove_event(event_id)
+        keys = [self._add('event', event, event)]
+        for list_key, kind in ELEMENT_KEYS.items():
+            for element in event.get(list_key, []):
+                if '@id' in element:
+                    keys.append(self._add(kind, element, event))
+        self._by_event[event_id] = list(dict.fromkeys(keys))
+
+    def remove_event(self, event_id):
+        """Drops an event and its elements."""
+        for key in self._by_event.pop(event_id, ()):
+            self._remove_document(key)
+
+    def search(self, query, limit=20, kinds=None):
+        """Finds the elements matching every word of a query, best matches first.
+
+        A query word matches the words it begins, whole words count more.
+        Elements score the weights of the fields they match in, see
+        SEARCH_FIELDS.
+
+        Parameters:
+        query (str): words to search for
+        limit (int): maximum number of results
+        kinds (set): kinds of elements to return, None for all
+
+        Returns:
+        results (list): kind, @id, name, event, eventName and score of each matching element
+        total (int): number of matching elements
+        """
+        if self._words is None:
+            self._words = sorted(self._postings)
+        # the words each query word begins, the query word with the fewest documents first
+        prefixes = []
+        for query_word in dict.fromkeys(tokenize(query)):
+            start = bisect.bisect_left(self._words, query_word)
+            end = bisect.bisect_left(self._words, query_word + '\U0010ffff', start)
+            words = self._words[start:end]
+            prefixes.append((sum(len(self._postings[word]) for word in words), query_word, words))
+        prefixes.sort()
+
+        scores = None
+        for size, query_word, words in prefixes:
+            matches = {}
+            if scores is None or size <= len(scores):
+                for word in words:
+                    factor = 1 if word == query_word else PREFIX_FACTOR
+                    for key, weight in self._postings[word].items():
+                        if scores is not None and key not in scores:
+                            continue
+                        score = weight * factor
+                        if score > matches.get(key, 0):
+                            matches[key] = score
+            else:
+                # fewer documents left than documents with the word, look at their words instead
+                for key in scores:
+                    for word, weight in self._documents[key][1].items():
+                        if word.startswith(query_word):
+                            score = weight * (1 if word == query_word else PREFIX_FACTOR)
+                            if score > matches.get(key, 0):
+                                matches[key] = score
+            if scores is not None:
+                for key, score in matches.items():
+                    matches[key] = score + scores[key]
+            scores = matches
+            if not scores:
+                break
+        if not scores:
+            return [], 0
+        if kinds is not None:
+            scores = {key: score for key, score in scores.items() if key[0] in kinds}
+
+        # elements defined in several events are returned once
+        best = {}
+        for key, score in scores.items():
+            element_key = key[:2]
+            if element_key not in best or score > scores[best[element_key]]:
+                best[element_key] = key
+        ranked = heapq.nsmallest(limit, best.values(), key=lambda key: (
+            -scores[key], len(self._documents[key][0][2] or ''), key))
+        results = []
+        for key in ranked:
+            kind, element_id, name, event_id, event_name = self._documents[key][0]
+            results.append({'kind': kind, '@id': element_id, 'name': name, 'event': event_id,
+                            'eventName': event_name, 'score': scores[key]})
+        return results, len(best)
+
+    def _add(self, kind, element, event):
+        key = (kind, element['@id'], event['@id'])
+        fields = SEARCH_FIELDS[kind]
+        words = {}
+        for field, values in element.items():
+            weight = fields.get(field)
+            if weight is None or not values:
+                continue
+            for value in values if isinstance(values, list) else (values,):
+                if not isinstance(value, str):
+                    continue
+                for word in TOKEN.findall(value.lower()):
+                    if weight > words.get(word, 0):
+                        words[word] = weight
+        name = element.get('roleName' if kind == 'participant' else 'name')
+        result = (kind, element['@id'], name if isinstance(name, str) else None, event['@id'], event.get('name'))
+        # another element with the same @id in the same event
+        if key in self._documents:
+            for word, weight in self._documents[key][1].items():
+                if weight > words.get(word, 0):
+                    words[word] = weight
+            self._remove_document(key)
+        self._documents[key] = (result, words)
+        for word, weight in words.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                if self._words is not None:
+                    bisect.insort(self._words, word)
+            postings[key] = weight
+        return key
+
+    def _remove_document(self, key):
+        _, words = self._documents.pop(key)
+        for word in words:
+            postings = self._postings[word]
+            del postings[key]
+            if not postings:
+                del self._postings[word]
+                if self._words is not None:
+                    del self._words[bisect.bisect_left(self._words, word)]
@@ -0,0 +1,120 @@
+# ===============================================
+# serialization.py
+# ------------
+# JSON encoding and compression of responses
+# ===============================================
+
+import gzip
+import json
+
+from flask import Response
+
+from instrumentation import stage
+
+# optional, faster encoders and compressors
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'text/')
+
+
+def encode_default(obj):
+    """Turns objects with a to_dict() method, like graph nodes and edges, into JSON values."""
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return to_dict()
+
+
+def dumps(obj):
+    """Serializes obj to JSON with orjson if it is installed, else with the json module.
+
+    Parameters:
+    obj: JSON serializable object, may contain graph nodes and edges
+
+    Returns:
+    bytes: UTF-8 encoded JSON
+    """
+    with stage('serialize'):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=encode_default)
+            except TypeError:
+                # e.g. integers beyond 64 bits or non-string keys, which json handles
+                pass
+        return json.dumps(obj, default=encode_default).encode('utf-8')
+
+
+def loads(data):
+    """Parses JSON bytes or text with orjson if it is installed, else with the json module."""
+    with stage('parse'):
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except ValueError:
+                # let json parse what orjson rejects (NaN, big integers) and report real errors
+                pass
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+def json_response(obj, status=200):
+    """Returns a Response with obj serialized by dumps()."""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def choose_encoding(accept_encodings):
+    """Returns the best compression the client accepts, or None.
+
+    Parameters:
+    accept_encodings (Accept): parsed Accept-Encoding header of the request
+    """
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, accept_encodings):
+    """Compresses the body of a response with an encoding the client accepts.
+
+    Streamed, passed through, already encoded, small or binary responses are
+    returned unchanged.
+
+    Parameters:
+    response (Response): finished response
+    accept_encodings (Accept): parsed Accept-Encoding header of the request
+
+    Returns:
+    response (Response): the same response
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_MIMETYPES)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
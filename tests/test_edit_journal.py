@@ -0,0 +1,65 @@
+# ===============================================
+# test_edit_journal.py
+# ------------
+# journal entries of replaced documents and pruning of old entries
+# ===============================================
+
+import copy
+import random
+
+from edit_journal import EditJournal, apply_changes, document_changes, revert_changes
+
+
+def document(events):
+    return {'@id': 'schema', 'sdfVersion': '3.0', 'events': events}
+
+
+def test_document_changes_round_trip():
+    for seed in range(500):
+        generator = random.Random(seed)
+        before = [{'@id': str(position), 'value': generator.randint(0, 3)} for position in range(20)]
+        after = copy.deepcopy(before)
+        for step in range(generator.randint(0, 3)):
+            choice = generator.random()
+            if choice < 0.4:
+                after[generator.randrange(len(after))]['value'] = 9
+            elif choice < 0.7:
+                del after[generator.randrange(len(after))]
+            else:
+                after.insert(generator.randint(0, len(after)), {'@id': f'new {step}'})
+        changes = document_changes(document(before), document(after))
+        if changes is None:
+            continue
+        events = copy.deepcopy(before)
+        apply_changes(events, changes)
+        assert events == after
+        revert_changes(events, changes)
+        assert events == before
+
+
+def test_document_changes_needs_the_same_header():
+    events = [{'@id': 'a'}, {'@id': 'b'}, {'@id': 'c'}]
+    assert document_changes({}, document(events)) is None
+    assert document_changes(dict(document(events), name='other'), document(events)) is None
+    assert document_changes(document(events), document(events)) == {'removed': [], 'changed': [], 'added': []}
+
+
+def test_prune_keeps_the_last_entries(tmp_path):
+    journal = EditJournal(str(tmp_path / 'journal.db'), snapshot_every=5, keep=12)
+    schema_json = document([{'@id': str(position), 'value': 0} for position in range(10)])
+    journal.record('workspace', 'POST /upload', 1, document=schema_json)
+    for version in range(2, 60):
+        before = copy.deepcopy(schema_json)
+        schema_json['events'][version % 10]['value'] = version
+        journal.record('workspace', 'POST /reload', version, document_changes(before, schema_json), schema_json)
+    entries = journal.history('workspace', limit=100)
+    assert len(entries) <= 12 + 5
+    head, version = journal.head('workspace')
+    assert version == 59
+    assert journal.document(head) == schema_json
+    # the oldest entry kept became a snapshot
+    assert entries[0]['parent'] is None and entries[0]['snapshot'] is not None
+    assert len(journal.document(entries[0]['id'])['events']) == 10
+    documents = journal.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+    assert documents <= 4
+    journal.close()
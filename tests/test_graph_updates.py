@@ -0,0 +1,192 @@
+# ===============================================
+# test_graph_updates.py
+# ------------
+# edits applied to the graph incrementally must give the graph a full build gives,
+# and their patches must turn the client copies into the new document and graph
+# ===============================================
+
+import copy
+import json
+import random
+
+import pytest
+
+import app
+from scripts.generate_schema import generate_schema
+from serialization import dumps
+
+
+def graph_state(graph):
+    """Returns the nodes and edges of a graph as compared by the tests, edges ignoring their order."""
+    nodes = {node_id: node.to_dict() for node_id, node in graph.nodes.items()}
+    edges = sorted(json.dumps(edge.to_dict(), sort_keys=True) for edge in graph.edges)
+    return nodes, edges
+
+
+def event(event_id, name, children=None):
+    schema_event = {'@id': event_id, 'name': name, 'outlinks': [], 'participants': []}
+    if children is not None:
+        schema_event['children'] = children
+        schema_event['children_gate'] = 'or'
+    return schema_event
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def load(client, workspace_id, schema_json):
+    response = client.post('/reload', data=dumps(schema_json), headers={'X-Workspace-Id': workspace_id})
+    assert response.status_code == 200
+    return app.workspaces._workspaces[workspace_id]
+
+
+def assert_rebuilt(workspace):
+    assert graph_state(workspace.graph) == graph_state(app.build_graph(copy.deepcopy(workspace.schema_json)))
+
+
+def apply_schema_patch(document, ops):
+    """Applies a schemaPatch to a copy of the document the way clients do."""
+    for op in ops:
+        keys = [key.replace('~1', '/').replace('~0', '~') for key in op['path'].split('/')[1:]]
+        if not keys:
+            document = copy.deepcopy(op['value'])
+            continue
+        target = document
+        for key in keys[:-1]:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+        key = keys[-1]
+        if isinstance(target, list) and key != '-':
+            key = int(key)
+        if op['op'] == 'remove':
+            del target[key]
+        elif op['op'] == 'add' and isinstance(target, list):
+            if key == '-':
+                target.append(copy.deepcopy(op['value']))
+            else:
+                target.insert(key, copy.deepcopy(op['value']))
+        else:
+            target[key] = copy.deepcopy(op['value'])
+    return document
+
+
+def client_graph(graph):
+    """Returns the nodes and edges a client keeps, edges keyed by their id."""
+    return ({node_id: node.to_dict() for node_id, node in graph.nodes.items()},
+            {edge.id: edge.to_dict()['data'] for edge in graph.edges})
+
+
+def apply_graph_patch(nodes, edges, patch):
+    """Applies a graphPatch to the nodes and edges of client_graph, removals first."""
+    for node_id in patch['nodes']['remove']:
+        nodes.pop(node_id, None)
+    for node in patch['nodes']['update']:
+        nodes[node['data']['id']] = node
+    for edge_id in patch['edges']['remove']:
+        edges.pop(edge_id, None)
+    for edge in patch['edges']['add']:
+        edges[edge['data']['id']] = edge['data']
+
+
+def assert_patched(graph, nodes, edges):
+    # edge ids are not unique, the edge a client keeps for an id is one of the edges with that id
+    server_nodes, _ = client_graph(graph)
+    assert nodes == server_nodes
+    server_edges = {}
+    for edge in graph.edges:
+        server_edges.setdefault(edge.id, []).append(edge.to_dict()['data'])
+    assert set(edges) == set(server_edges)
+    for edge_id, data in edges.items():
+        assert data in server_edges[edge_id]
+
+
+def random_edit(r, schema_json, step):
+    """Returns the name and body of a random edit of the document, as sent to its route."""
+    event_ids = [schema_event['@id'] for schema_event in schema_json['events']]
+    entity_ids = [entity['@id'] for schema_event in schema_json['events'] for entity in schema_event.get('entities', [])]
+    op = r.choice(['add_event', 'add_entity', 'add_participant', 'add_outlink', 'add_relation',
+                   'delete_entity', 'remove_element', 'node', 'rename'])
+    if op == 'add_event':
+        new_event = {'@id': f'Events/t{step}/', 'name': r.choice(['added', 'Added outlinks']),
+                     'outlinks': [], 'participants': [], 'parent_id': {'@id': r.choice(event_ids)}}
+        if r.random() < 0.3:
+            new_event['children'] = []
+            new_event['children_gate'] = 'or'
+        return op, new_event
+    if op == 'add_participant' and entity_ids:
+        return op, {'event_id': r.choice(event_ids),
+                    'participant_data': {'@id': f'Participants/t{step}/', 'roleName': 'role',
+                                         'entity': r.choice(entity_ids)}}
+    if op == 'add_outlink':
+        return op, {'fromNodeId': r.choice(event_ids), 'toNodeId': r.choice(event_ids)}
+    if op == 'add_relation' and len(entity_ids) > 1:
+        subject, object_ = r.sample(entity_ids, 2)
+        return op, {'fromNodeId': subject, 'toNodeId': object_,
+                    'relation': {'@id': f'Relations/t{step}/', 'name': 'relation',
+                                 'relationSubject': subject, 'relationObject': object_}}
+    if op == 'delete_entity' and entity_ids:
+        return op, {'entity_ids': r.sample(entity_ids, min(2, len(entity_ids)))}
+    if op == 'remove_element' and len(event_ids) > 3:
+        return op, {'ids': r.sample(event_ids[1:], 2)}
+    if op == 'node':
+        return op, {'id': r.choice(event_ids), 'updatedFields': {'description': f'edited {step}'}}
+    if op == 'rename' and len(event_ids) > 1:
+        return 'node', {'id': r.choice(event_ids[1:]), 'updatedFields': {'name': f'renamed {step}'}}
+    return 'add_entity', {'event_id': r.choice(event_ids), 'entity_data': {'@id': f'Entities/t{step}/', 'name': 'entity'}}
+
+
+def send_edit(client, workspace_id, version, op, data):
+    url = f'/{op}?delta={version}'
+    headers = {'X-Workspace-Id': workspace_id}
+    if op == 'delete_entity':
+        return client.delete(url, json=data, headers=headers)
+    if op == 'node':
+        return client.post(url, data=dumps(data), headers=headers)
+    return client.post(url, json=data, headers=headers)
+
+
+def test_container_parent_follows_document_order(client):
+    # C is listed by P1 and P2, the spliced edge to X starts at the parent listed last
+    schema_json = {'@id': 'schema', 'sdfVersion': '3.0', 'events': [
+        event('R', 'Root', ['P1', 'P2']),
+        event('P1', 'p1', ['C']),
+        event('P2', 'p2', ['C']),
+        event('C', 'C outlinks', ['X']),
+        event('X', 'x')
+    ]}
+    workspace = load(client, 'parent-order', schema_json)
+    response = client.post('/node', data=dumps({'id': 'P1', 'updatedFields': {'description': 'd'}}),
+                           headers={'X-Workspace-Id': 'parent-order'})
+    assert response.status_code == 200
+    assert_rebuilt(workspace)
+    assert ('P2', 'X') in {(edge.source, edge.target) for edge in workspace.graph.edges}
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_edits_match_a_full_build(client, seed):
+    workspace_id = f'random-{seed}'
+    workspace = load(client, workspace_id, generate_schema(seed, events=60, entities=15, relations=8))
+    document = copy.deepcopy(workspace.schema_json)
+    nodes, edges = client_graph(workspace.graph)
+    r = random.Random(seed)
+    for step in range(30):
+        if r.random() < 0.15:
+            op, data = 'batch', {'operations': [dict(zip(('op', 'data'), random_edit(r, workspace.schema_json, f'{step}.{i}')))
+                                                for i in range(2)]}
+        else:
+            op, data = random_edit(r, workspace.schema_json, step)
+        version = workspace.version
+        response = send_edit(client, workspace_id, version, op, data)
+        # edits the validator rejects change nothing
+        assert response.status_code in (200, 400), response.data
+        if response.status_code == 400:
+            assert workspace.version == version
+            assert_rebuilt(workspace)
+            continue
+        assert_rebuilt(workspace)
+        body = response.get_json()
+        document = apply_schema_patch(document, body['schemaPatch'])
+        assert document == workspace.schema_json
+        apply_graph_patch(nodes, edges, body['graphPatch'])
+        assert_patched(workspace.graph, nodes, edges)
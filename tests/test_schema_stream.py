@@ -0,0 +1,51 @@
+# ===============================================
+# test_schema_stream.py
+# ------------
+# limits on decompressed uploads and on how far the streaming parser reads ahead
+# ===============================================
+
+import gzip
+import io
+import json
+
+import pytest
+
+from schema_stream import UploadReader, UploadTooLarge, decompress, parse_schema
+
+# a few kilobytes inflating to four megabytes
+BOMB = gzip.compress(b' ' * (4 << 20), 9)
+
+
+def test_decompress_stops_at_the_limit():
+    with pytest.raises(UploadTooLarge):
+        decompress(BOMB, max_bytes=1 << 20)
+    assert len(decompress(BOMB, max_bytes=4 << 20)) == 4 << 20
+
+
+def test_decompress_rejects_truncated_gzip():
+    with pytest.raises(EOFError):
+        decompress(BOMB[:len(BOMB) // 2])
+
+
+def test_upload_reader_inflates_one_chunk_at_a_time():
+    reader = UploadReader(io.BytesIO(BOMB), chunk_size=1 << 16, max_bytes=1 << 20)
+    sizes = []
+    with pytest.raises(UploadTooLarge):
+        for chunk in reader:
+            sizes.append(len(chunk))
+    assert max(sizes) <= 1 << 16
+    assert reader.size <= (1 << 20) + (1 << 16)
+
+
+def test_parse_schema_bounds_malformed_values():
+    read = []
+
+    def chunks():
+        yield '{"events": [{"name": tru'
+        for _ in range(1000):
+            read.append(1)
+            yield ' ' * (1 << 16)
+
+    with pytest.raises(json.JSONDecodeError):
+        parse_schema(chunks(), max_value=1 << 20)
+    assert len(read) < 40
@@ -0,0 +1,144 @@
+# ===============================================
+# workspace.py
+# ------------
+# per-session schema state shared by the routes
+# ===============================================
+
+import collections
+import logging
+import threading
+import uuid
+
+from graph_store import GraphStore
+from schema_index import SchemaIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Workspace:
+    """Schema document, graph and index of one curator session.
+
+    Routes hold the lock for the whole request, so a workspace is edited by
+    one request at a time while other workspaces are served concurrently.
+    """
+
+    def __init__(self, workspace_id):
+        self.workspace_id = workspace_id
+        self.schema_json = {}
+        self.graph = GraphStore()
+        self.index = SchemaIndex()
+        self.schema_name = None
+        # CachedSchema whose objects are shared with other workspaces, until the first edit
+        self.cached = None
+        # bumped by every edit, clients send it back as ?delta=<version> to get patches
+        self.version = 0
+        # tells this workspace from an earlier one with the same id, whose versions a client may still hold
+        self.epoch = uuid.uuid4().hex
+        # (version, {key: result}) of results derived from that version, see app.version_views
+        self.views = None
+        self.lock = threading.RLock()
+        self._users = 0
+
+
+class WorkspaceLimitError(RuntimeError):
+    """Raised for a new workspace while every kept workspace holds edits that cannot be restored."""
+
+
+class WorkspaceManager:
+    """Workspaces keyed by session or workspace id, evicting the least recently used.
+
+    Unless dropped workspaces can be restored, a workspace holding a document
+    is never evicted, and new workspaces are refused once these fill the limit.
+
+    Parameters:
+    max_workspaces (int): number of workspaces kept in memory
+    schema_cache (SchemaCache): cache of the uploads workspaces share, released by dropped workspaces
+    restorable (bool): whether evicted workspaces come back with their edits, e.g. from the edit journal
+    """
+
+    def __init__(self, max_workspaces=32, schema_cache=None, restorable=False):
+        self.max_workspaces = max_workspaces
+        self.schema_cache = schema_cache
+        self.restorable = restorable
+        self._workspaces = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._workspaces)
+
+    def __contains__(self, workspace_id):
+        return workspace_id in self._workspaces
+
+    def acquire(self, workspace_id, create=True):
+        """Returns the workspace with the given id, creating it if needed, and marks it in use.
+
+        Every call returning a workspace has to be paired with release() once the request is done.
+
+        Parameters:
+        workspace_id (str): session or workspace id
+        create (bool): whether to create the workspace if it is not kept
+
+        Returns:
+        workspace (Workspace): the workspace, not yet locked, or None if it is not kept and create is False
+
+        Raises:
+        WorkspaceLimitError: if there is no room for a new workspace
+        """
+        with self._lock:
+            workspace = self._workspaces.get(workspace_id)
+            if workspace is None:
+                if not create:
+                    return None
+                self._evict(self.max_workspaces - 1)
+                if len(self._workspaces) >= self.max_workspaces and not self.restorable:
+                    raise WorkspaceLimitError(f'All {self.max_workspaces} workspaces are in use or hold edits that are not journaled.')
+                workspace = self._workspaces[workspace_id] = Workspace(workspace_id)
+            else:
+                self._workspaces.move_to_end(workspace_id)
+            workspace._users += 1
+            self._evict()
+        return workspace
+
+    def release(self, workspace):
+        """Marks a workspace returned by acquire() as idle again."""
+        with self._lock:
+            workspace._users -= 1
+            if workspace._users == 0 and self._workspaces.get(workspace.workspace_id) is not workspace:
+                # discarded while in use
+                self._drop(workspace)
+            self._evict()
+
+    def discard(self, workspace_id):
+        """Drops a workspace, e.g. when its session ends."""
+        with self._lock:
+            workspace = self._workspaces.pop(workspace_id, None)
+            if workspace is not None and workspace._users == 0:
+                self._drop(workspace)
+
+    def _drop(self, workspace):
+        # the cache entry may be evicted once no workspace shares it
+        if workspace.cached is not None and self.schema_cache is not None:
+            self.schema_cache.release(workspace.cached)
+            workspace.cached = None
+
+    def _evict(self, limit=None):
+        # drop idle workspaces from the least recently used end, never one in use
+        # and, unless they can be restored, never one holding a document
+        excess = len(self._workspaces) - (self.max_workspaces if limit is None else limit)
+        if excess <= 0:
+            return
+        kept = 0
+        for workspace_id, workspace in list(self._workspaces.items()):
+            if excess <= 0:
+                break
+            if workspace._users:
+                continue
+            if workspace.schema_json and not self.restorable:
+                kept += 1
+                continue
+            del self._workspaces[workspace_id]
+            self._drop(workspace)
+            excess -= 1
+        if excess > 0 and kept:
+            logger.warning('Not evicting %d idle workspaces whose edits are not journaled, set SCHEMA_JOURNAL '
+                           'to restore evicted workspaces', kept)